@@ -0,0 +1,329 @@
+"""Admission control for the write endpoints: rate limits and concurrency caps.
+
+Each write route belongs to a class (``feedback``: ``POST /api/feedback`` and
+``/api/feedback/batch``; ``nperf``: ``POST /api/nperf/results``; ``upload``:
+``POST /api/upload``). A request of a class goes through two checks, before
+any of its body is read:
+
+1. a token bucket per client and class (``RATE_LIMITS``, sustained requests
+   per second / burst, e.g. ``feedback=2/60,nperf=2/60,upload=0.5/20``; empty,
+   so off, by default): when it is empty the request gets ``429`` with
+   ``Retry-After`` set to the time until the next token. Only enable it where
+   the client IP is known: behind a proxy that is not trusted for
+   ``X-Forwarded-For`` every client shares the proxy's bucket (the Helm chart
+   sets both);
+2. a cap on the requests of the class running at once in the worker
+   (``ADMISSION_CONCURRENCY``, default ``feedback=16,nperf=16,upload=4``, in
+   line with the connection pool). Requests over the cap wait in a FIFO queue
+   of ``ADMISSION_QUEUE`` places (64) for at most ``ADMISSION_QUEUE_TARGET_MS``
+   (500). A request still waiting then gets ``503`` with ``Retry-After``. For
+   the next second, requests finding no free slot get ``503`` at once instead
+   of queueing, so an overload is shed in microseconds rather than after a
+   wait. A full queue also answers ``503`` at once.
+
+The client is the remote address. Behind a proxy, uvicorn replaces it with
+``X-Forwarded-For`` only for the proxies listed in ``FORWARDED_ALLOW_IPS``
+(addresses or CIDR ranges; never ``*``, which lets clients pick their bucket).
+``RATE_LIMIT_KEY_HEADER`` names a header set by a trusted proxy (e.g.
+``CF-Connecting-IP``) to use instead.
+
+``RATE_LIMIT_BACKEND``:
+- ``memory`` (default): buckets per worker, so a client gets one budget per
+  worker;
+- ``redis``: buckets shared by all workers and replicas (``REDIS_URL``), taken
+  with one atomic script call. When Redis is unreachable requests are let
+  through;
+- ``off``: no rate limit (the concurrency caps stay).
+
+The concurrency caps are always per worker: they protect the worker's own
+threadpool and connection pool.
+"""
+import asyncio
+import math
+import os
+import time
+import types
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from . import metrics
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_KEY_HEADER = os.getenv("RATE_LIMIT_KEY_HEADER", "").lower()
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))  # memory backend: buckets kept
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", "64"))
+ADMISSION_QUEUE_TARGET = float(os.getenv("ADMISSION_QUEUE_TARGET_MS", "500")) / 1000
+OVERLOAD_HOLD = 1.0  # seconds of immediate shedding after a queue timeout
+REDIS_PREFIX = "artci:ratelimit"
+
+# (method, path) -> class; the paths have no parameters, so they are also the route templates
+ROUTE_CLASSES = {
+    ("POST", "/api/feedback"): "feedback",
+    ("POST", "/api/feedback/batch"): "feedback",
+    ("POST", "/api/nperf/results"): "nperf",
+    ("POST", "/api/upload"): "upload",
+}
+
+
+def _parse(spec: str) -> Dict[str, str]:
+    """``"a=1,b=2"`` -> ``{"a": "1", "b": "2"}``."""
+    items = (item.split("=", 1) for item in spec.split(",") if "=" in item)
+    return {name.strip(): value.strip() for name, value in items}
+
+
+def _rate(value: str) -> Tuple[float, float]:
+    rate, _, burst = value.partition("/")
+    return float(rate), float(burst or rate)
+
+
+RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    name: _rate(value)
+    for name, value in _parse(os.getenv("RATE_LIMITS", "")).items()
+}
+ADMISSION_CONCURRENCY: Dict[str, int] = {
+    name: int(value)
+    for name, value in _parse(os.getenv("ADMISSION_CONCURRENCY", "feedback=16,nperf=16,upload=4")).items()
+}
+
+
+# -----------------------------
+# Token buckets
+# -----------------------------
+
+class MemoryBuckets:
+    """Buckets of this worker, the least recently used dropped beyond ``max_keys``."""
+
+    backend = "memory"
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()  # key -> [tokens, last refill]
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """0 when a token was taken, else the seconds until one is available."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+    async def close(self) -> None:
+        pass
+
+
+# KEYS[1] bucket; ARGV rate, burst, now (s). Returns {taken, tokens left}.
+TAKE_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local taken = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  taken = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {taken, tostring(tokens)}
+"""
+
+
+class RedisBuckets:
+    """Buckets shared by every worker; one script call per request."""
+
+    backend = "redis"
+
+    def __init__(self, url: str, prefix: str = REDIS_PREFIX):
+        import redis.asyncio  # only needed when this backend is selected
+
+        self.client = redis.asyncio.Redis.from_url(url, socket_timeout=0.5)
+        self.prefix = prefix
+        self.errors = 0
+        self._script = self.client.register_script(TAKE_SCRIPT)
+        self._warned_at = 0.0
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        try:
+            taken, tokens = await self._script(keys=[f"{self.prefix}:{key}"], args=[rate, burst, time.time()])
+        except Exception as e:
+            # fail open: an outage of the limiter must not stop the writes
+            self.errors += 1
+            if time.monotonic() - self._warned_at > 60:
+                self._warned_at = time.monotonic()
+                print(f"Rate limiting: Redis unavailable ({e}), requests are let through")
+            return 0.0
+        return 0.0 if int(taken) else (1 - float(tokens)) / rate
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+buckets: Any = None
+if RATE_LIMIT_BACKEND == "redis":
+    buckets = RedisBuckets(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+elif RATE_LIMIT_BACKEND != "off":
+    buckets = MemoryBuckets()
+
+
+# -----------------------------
+# Concurrency caps
+# -----------------------------
+
+class Gate:
+    """At most ``limit`` requests of a class at once; a bounded, time-limited queue for the others."""
+
+    def __init__(self, name: str, limit: int, queue_size: int = ADMISSION_QUEUE,
+                 target: float = ADMISSION_QUEUE_TARGET):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.target = target
+        self.active = 0
+        self.shed: Dict[str, int] = {}
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._overloaded_until = 0.0
+
+    async def acquire(self) -> Optional[str]:
+        """None once admitted (call :meth:`release` after), else the reason of the refusal."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return None
+        loop = asyncio.get_running_loop()
+        if loop.time() < self._overloaded_until:
+            return "overloaded"
+        if len(self._waiters) >= self.queue_size:
+            return "queue_full"
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        t0 = loop.time()
+        try:
+            await asyncio.wait((waiter,), timeout=self.target)
+        except asyncio.CancelledError:  # client gone while queued
+            if waiter.cancel():
+                self._waiters.remove(waiter)
+            else:
+                self.release()  # the slot was handed over meanwhile
+            raise
+        metrics.ADMISSION_QUEUE_WAIT.labels(self.name).observe(loop.time() - t0)
+        if waiter.done():
+            return None  # release() handed its slot over
+        waiter.cancel()
+        self._waiters.remove(waiter)
+        self._overloaded_until = loop.time() + OVERLOAD_HOLD
+        return "queue_timeout"
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # the slot goes to the oldest waiter, active unchanged
+                return
+        self.active -= 1
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+
+gates: Dict[str, Gate] = {name: Gate(name, limit) for name, limit in ADMISSION_CONCURRENCY.items() if limit > 0}
+rate_limited: Dict[str, int] = {}
+
+
+# -----------------------------
+# Middleware
+# -----------------------------
+
+def client_key(scope) -> str:
+    if RATE_LIMIT_KEY_HEADER:
+        for name, value in scope["headers"]:
+            if name.decode("latin-1") == RATE_LIMIT_KEY_HEADER:
+                return value.decode("latin-1")[:100]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _refuse(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware; only the routes of ``ROUTE_CLASSES`` are checked."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route_class = None
+        if scope["type"] == "http":
+            route_class = ROUTE_CLASSES.get((scope["method"], scope["path"].rstrip("/") or "/"))
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        limit = RATE_LIMITS.get(route_class)
+        if buckets is not None and limit and limit[0] > 0:
+            wait = await buckets.take(f"{route_class}:{client_key(scope)}", *limit)
+            if wait:
+                rate_limited[route_class] = rate_limited.get(route_class, 0) + 1
+                metrics.ADMISSION_SHED.labels(route_class, "rate_limited").inc()
+                await self._reject(scope, receive, send, _refuse(429, "Too many requests, retry later", wait))
+                return
+
+        gate = gates.get(route_class)
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+        reason = await gate.acquire()
+        if reason is not None:
+            gate.shed[reason] = gate.shed.get(reason, 0) + 1
+            metrics.ADMISSION_SHED.labels(route_class, reason).inc()
+            await self._reject(scope, receive, send, _refuse(503, "Server busy, retry later", OVERLOAD_HOLD))
+            return
+        metrics.ADMISSION_ACTIVE.labels(route_class).inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            metrics.ADMISSION_ACTIVE.labels(route_class).dec()
+            gate.release()
+
+    @staticmethod
+    async def _reject(scope, receive, send, response: JSONResponse) -> None:
+        # not routed: label the request metrics with the route it was meant for
+        scope["route"] = types.SimpleNamespace(path=scope["path"].rstrip("/"))
+        await response(scope, receive, send)
+
+
+async def stop() -> None:
+    if buckets is not None:
+        await buckets.close()
+
+
+def stats() -> Dict[str, Any]:
+    """Limits and refusals of this worker."""
+    return {
+        "rate_limit_backend": buckets.backend if buckets is not None else "off",
+        "rate_limit_errors": getattr(buckets, "errors", 0),
+        "classes": {
+            name: {
+                "rate_limit": dict(zip(("per_second", "burst"), RATE_LIMITS[name])) if name in RATE_LIMITS else None,
+                "concurrency": gates[name].limit if name in gates else None,
+                "active": gates[name].active if name in gates else None,
+                "queued": gates[name].queued if name in gates else None,
+                "shed": {"rate_limited": rate_limited.get(name, 0), **(gates[name].shed if name in gates else {})},
+            }
+            for name in sorted(set(ROUTE_CLASSES.values()))
+        },
+    }
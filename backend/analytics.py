@@ -0,0 +1,459 @@
+"""SQL-side analytics queries.
+
+The analytics endpoints read the pre-aggregated ``feedback_rollups`` table (see
+``backend.rollups``), so their cost depends on the number of hour buckets in the
+selected range rather than on the number of feedbacks. The raw-table helpers
+(``feedback_conditions``, ``rating_items``...) push filters into the WHERE
+clause and explode the ``ratings`` JSON in the database; they are used to fill
+``feedback_ratings``, which in turn feeds the rollups (``rating_rows``).
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Integer, and_, case, cast, Date, func, literal_column, select, true
+from sqlalchemy.orm import Session
+
+from . import models, pagination
+
+RATING_VALUES = ["1", "2", "3", "4"]
+
+
+def parse_date(s: Optional[str]) -> Optional[datetime]:
+    """Parse a YYYY-MM-DD (or ISO datetime) query param, ignoring bad input."""
+    if not s:
+        return None
+    try:
+        return datetime.fromisoformat(s)
+    except Exception:
+        return None
+
+
+def iter_criteria(ratings: List[Dict[str, Any]]):
+    """Yield tuples (criterion_key, label, rating_value_as_int) from stored ratings array."""
+    for entry in ratings or []:
+        if not isinstance(entry, dict):
+            continue
+        # each entry like {"crit-1": {"label": ..., "sublabel": ..., "rating": "2"}}
+        for key, val in entry.items():
+            try:
+                label = (val.get("label") or "").strip()
+                rating_str = (val.get("rating") or "").strip()
+                if not label or rating_str not in {"1", "2", "3", "4"}:
+                    continue
+                yield key, label, int(rating_str)
+            except Exception:
+                continue
+
+
+def iter_rating_items(ratings: List[Dict[str, Any]]):
+    """Yield tuples (label, rating_value_as_int) from stored ratings array."""
+    for _key, label, rating in iter_criteria(ratings):
+        yield label, rating
+
+
+def _dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+
+def feedback_conditions(start_date: Optional[str], end_date: Optional[str],
+                        type_filter: Optional[str], provider_filter: Optional[str],
+                        since: Optional[datetime] = None, sector_filter: Optional[str] = None,
+                        model=None) -> list:
+    """WHERE clauses equivalent to the old ``_filter_rows`` Python filter.
+
+    ``model`` defaults to ``Feedback``; ``FeedbackRating`` carries the same columns.
+    """
+    fb = model if model is not None else models.Feedback
+    conds = []
+    if type_filter:
+        conds.append(fb.type == type_filter)
+    if provider_filter:
+        conds.append(fb.provider == provider_filter)
+    if sector_filter:
+        conds.append(fb.sector == sector_filter)
+    start_dt = parse_date(start_date)
+    end_dt = parse_date(end_date)
+    if start_dt:
+        conds.append(fb.created_at >= start_dt)
+    if end_dt:
+        conds.append(fb.created_at <= end_dt + timedelta(days=1))  # inclusive end date
+    if since:
+        conds.append(fb.created_at >= since)
+    return conds
+
+
+def utc_expr(db: Session, col):
+    """A timestamptz column as UTC wall-clock time, whatever the session TimeZone.
+
+    The rollups bucket in UTC, like ``rollups.rollup_rows`` does in Python.
+    """
+    if _dialect(db) == "sqlite":
+        return col
+    return func.timezone("UTC", col)
+
+
+def day_expr(db: Session, col):
+    """Calendar day (UTC) of a timestamp column."""
+    if _dialect(db) == "sqlite":
+        return func.date(col)
+    return cast(utc_expr(db, col), Date)
+
+
+def hour_expr(db: Session, col):
+    if _dialect(db) == "sqlite":
+        return cast(func.strftime("%H", col), Integer)
+    return cast(func.extract("hour", utc_expr(db, col)), Integer)
+
+
+def weekday_expr(db: Session, col):
+    """Weekday with Monday=0, like ``datetime.weekday()``."""
+    if _dialect(db) == "sqlite":
+        # strftime('%w') is 0=Sunday
+        return (cast(func.strftime("%w", col), Integer) + 6) % 7
+    return cast(func.extract("isodow", utc_expr(db, col)), Integer) - 1
+
+
+def rating_items(db: Session, conds: list):
+    """Select one row per criterion rating exploded from the ``ratings`` JSON.
+
+    Mirrors ``iter_rating_items``: every ``{"crit-N": {...}}`` entry of
+    the array yields one row when it has a non-empty string label and a rating
+    in "1".."4". Non-object entries and the ``_meta`` entry are skipped.
+    """
+    fb = models.Feedback
+    if _dialect(db) == "postgresql":
+        ratings = case((func.jsonb_typeof(fb.ratings) == "array", fb.ratings),
+                       else_=literal_column("'[]'::jsonb"))
+        elems = func.jsonb_array_elements(ratings).table_valued("value").lateral("e")
+        obj = case((func.jsonb_typeof(elems.c.value) == "object", elems.c.value),
+                   else_=literal_column("'{}'::jsonb"))
+        crit = func.jsonb_each(obj).table_valued("key", "value").lateral("c")
+        raw_label = crit.c.value.op("->")("label")
+        raw_rating = crit.c.value.op("->")("rating")
+        label = func.btrim(crit.c.value.op("->>")("label"))
+        rating = func.btrim(crit.c.value.op("->>")("rating"))
+        valid = and_(
+            func.jsonb_typeof(crit.c.value) == "object",
+            func.jsonb_typeof(raw_label) == "string",
+            func.jsonb_typeof(raw_rating) == "string",
+        )
+    else:
+        elems = func.json_each(fb.ratings).table_valued("value", "type").alias("e")
+        obj = case((elems.c.type == "object", elems.c.value), else_="{}")
+        crit = func.json_each(obj).table_valued("key", "value", "type").alias("c")
+        is_obj = crit.c.type == "object"
+        label = func.trim(case((is_obj, func.json_extract(crit.c.value, "$.label"))))
+        rating = func.trim(case((is_obj, func.json_extract(crit.c.value, "$.rating"))))
+        valid = and_(
+            is_obj,
+            func.json_type(crit.c.value, "$.label") == "text",
+            func.json_type(crit.c.value, "$.rating") == "text",
+        )
+
+    return (
+        select(
+            fb.id.label("feedback_id"),
+            fb.created_at.label("created_at"),
+            fb.type.label("type"),
+            fb.provider.label("provider"),
+            fb.sector.label("sector"),
+            crit.c.key.label("criterion"),
+            label.label("label"),
+            cast(rating, Integer).label("rating"),
+        )
+        .select_from(fb)
+        .join(elems, true())
+        .join(crit, true())
+        .where(*conds, valid, label != "", rating.in_(RATING_VALUES))
+        .subquery("items")
+    )
+
+
+def rating_rows(conds: list):
+    """``rating_items`` read from the normalized ``feedback_ratings`` table.
+
+    Same columns, but plain integer rows joined to the label lookup: no JSON is
+    parsed. ``conds`` are built with ``feedback_conditions(..., model=FeedbackRating)``.
+    """
+    fr, lb = models.FeedbackRating, models.RatingLabel
+    return (
+        select(
+            fr.feedback_id.label("feedback_id"),
+            fr.created_at.label("created_at"),
+            fr.type.label("type"),
+            fr.provider.label("provider"),
+            fr.sector.label("sector"),
+            fr.criterion.label("criterion"),
+            lb.label.label("label"),
+            cast(fr.rating, Integer).label("rating"),
+        )
+        .join(lb, lb.id == fr.label_id)
+        .where(*conds)
+        .subquery("items")
+    )
+
+
+def rollup_conditions(start_date: Optional[str], end_date: Optional[str],
+                      type_filter: Optional[str], provider_filter: Optional[str],
+                      since: Optional[datetime] = None) -> list:
+    """Same filters as ``feedback_conditions`` but on ``feedback_rollups``.
+
+    Rollups are bucketed per hour, so dates are compared on the calendar day.
+    """
+    ru = models.FeedbackRollup
+    conds = []
+    if type_filter:
+        conds.append(ru.type == type_filter)
+    if provider_filter:
+        conds.append(ru.provider == provider_filter)
+    start_dt = parse_date(start_date)
+    end_dt = parse_date(end_date)
+    if start_dt:
+        conds.append(ru.day >= start_dt.date())
+    if end_dt:
+        conds.append(ru.day <= end_dt.date())  # inclusive end date
+    if since:
+        conds.append(ru.day >= since.date())
+    return conds
+
+
+def _window_start(days: int) -> datetime:
+    return datetime.utcnow() - timedelta(days=max(1, days))
+
+
+# -----------------------------
+# Dashboard engine
+# -----------------------------
+# Every panel is computed from "facts": rollup rows summed over the requested
+# dimensions. A single endpoint loads only the dimensions it needs; the combined
+# dashboard loads the union once and derives all panels from the same rows.
+
+MEASURES = ["feedback_count", "rating_count", "rating_sum", "rating_1", "rating_2", "rating_3", "rating_4"]
+
+PANEL_DIMS = {
+    "summary": ["type", "provider", "label"],
+    "criteria": ["label"],
+    "time_series": ["day", "label"],
+    "heatmap": ["weekday", "hour", "label"],
+    "criteria_over_time": ["day", "label"],
+}
+DASHBOARD_DIMS = ["day", "weekday", "hour", "type", "provider", "label"]
+
+
+def load_facts(db: Session, dims: List[str], start_date=None, end_date=None, type_filter=None,
+               provider_filter=None, since: Optional[datetime] = None) -> list:
+    """One GROUP BY over the rollups; rows expose the dims and MEASURES as attributes."""
+    ru = models.FeedbackRollup
+    conds = rollup_conditions(start_date, end_date, type_filter, provider_filter, since=since)
+    cols = [getattr(ru, d) for d in dims]
+    sums = [func.sum(getattr(ru, m)).label(m) for m in MEASURES]
+    return db.execute(select(*cols, *sums).where(*conds).group_by(*cols)).all()
+
+
+def summary_panel(facts: list) -> Dict[str, Any]:
+    by_type: Dict[str, int] = defaultdict(int)
+    by_provider: Dict[str, int] = defaultdict(int)
+    dist = dict.fromkeys(RATING_VALUES, 0)
+    for f in facts:
+        if f.label == "":
+            by_type[f.type] += int(f.feedback_count)
+            by_provider[f.provider] += int(f.feedback_count)
+        else:
+            for k in RATING_VALUES:
+                dist[k] += int(getattr(f, "rating_" + k))
+    return {
+        "total_feedback": sum(by_type.values()),
+        "by_type": dict(by_type),
+        "by_provider": dict(by_provider),
+        "rating_distribution": dist,
+    }
+
+
+def criteria_panel(facts: list) -> List[Dict[str, Any]]:
+    totals: Dict[str, List[int]] = {}
+    for f in facts:
+        if f.label == "":
+            continue
+        t = totals.setdefault(f.label, [0] * len(MEASURES))
+        for i, m in enumerate(MEASURES):
+            t[i] += int(getattr(f, m))
+
+    result = []
+    for label in sorted(totals.keys()):
+        _fb, c, s, r1, r2, r3, r4 = totals[label]
+        avg = (s / c) if c else 0.0
+        result.append({
+            "label": label,
+            "count": c,
+            "avg": round(avg, 2),
+            "distribution": {"1": r1, "2": r2, "3": r3, "4": r4},
+        })
+    return result
+
+
+def time_series_panel(facts: list, days: int = 30) -> List[Dict[str, Any]]:
+    since = _window_start(days)
+    buckets: Dict[str, int] = defaultdict(int)
+    for f in facts:
+        if f.label == "" and f.day >= since.date():
+            buckets[str(f.day)] += int(f.feedback_count)
+
+    # ensure all days present
+    out = []
+    for i in range(max(1, days)):
+        key = str((since + timedelta(days=i + 1)).date())  # up to today roughly
+        out.append({"date": key, "count": buckets.get(key, 0)})
+    return out
+
+
+def heatmap_panel(facts: list) -> List[Dict[str, int]]:
+    grid: Dict[tuple, int] = defaultdict(int)
+    for f in facts:
+        if f.label == "":
+            grid[(f.weekday, f.hour)] += int(f.feedback_count)
+
+    out: List[Dict[str, int]] = []
+    for w in range(7):
+        for h in range(24):
+            out.append({"weekday": w, "hour": h, "count": grid.get((w, h), 0)})
+    return out
+
+
+def criteria_over_time_panel(facts: list, days: int = 30) -> List[Dict[str, Any]]:
+    since = _window_start(days)
+    sums: Dict[tuple, int] = defaultdict(int)
+    counts: Dict[tuple, int] = defaultdict(int)
+    for f in facts:
+        if f.label == "" or f.day < since.date():
+            continue
+        key = (str(f.day), f.label)
+        sums[key] += int(f.rating_sum)
+        counts[key] += int(f.rating_count)
+
+    # Build output for each day in window and every label seen
+    labels = sorted({lbl for (_d, lbl) in counts.keys()})
+    out: List[Dict[str, Any]] = []
+    for i in range(max(1, days)):
+        d_str = str((since + timedelta(days=i + 1)).date())
+        for lbl in labels:
+            c = counts.get((d_str, lbl), 0)
+            s = sums.get((d_str, lbl), 0)
+            avg = (s / c) if c else 0.0
+            out.append({"date": d_str, "label": lbl, "avg": round(avg, 2), "count": c, "sum": s})
+    return out
+
+
+def to_columns(rows: List[Dict[str, Any]], keys: List[str]) -> Dict[str, list]:
+    """Columnar shape of a panel: one array per key instead of one object per row."""
+    return {k: [r[k] for r in rows] for k in keys}
+
+
+TIME_SERIES_KEYS = ["date", "count"]
+CRITERIA_OVER_TIME_KEYS = ["date", "label", "avg", "count", "sum"]
+
+
+def dashboard(db: Session, days: int = 30, start_date=None, end_date=None, type_filter=None,
+              provider_filter=None) -> Dict[str, Any]:
+    """All dashboard panels from a single rollup query."""
+    facts = load_facts(db, DASHBOARD_DIMS, start_date, end_date, type_filter, provider_filter)
+    return {
+        "summary": summary_panel(facts),
+        "criteria": criteria_panel(facts),
+        "time_series": time_series_panel(facts, days),
+        "heatmap": heatmap_panel(facts),
+        "criteria_over_time": criteria_over_time_panel(facts, days),
+    }
+
+
+def summary(db: Session, start_date=None, end_date=None, type_filter=None, provider_filter=None) -> Dict[str, Any]:
+    facts = load_facts(db, PANEL_DIMS["summary"], start_date, end_date, type_filter, provider_filter)
+    return summary_panel(facts)
+
+
+def criteria(db: Session, start_date=None, end_date=None, type_filter=None, provider_filter=None) -> List[Dict[str, Any]]:
+    facts = load_facts(db, PANEL_DIMS["criteria"], start_date, end_date, type_filter, provider_filter)
+    return criteria_panel(facts)
+
+
+def time_series(db: Session, days: int = 30, start_date=None, end_date=None, type_filter=None,
+                provider_filter=None) -> List[Dict[str, Any]]:
+    facts = load_facts(db, PANEL_DIMS["time_series"], start_date, end_date, type_filter, provider_filter,
+                       since=_window_start(days))
+    return time_series_panel(facts, days)
+
+
+def heatmap(db: Session, start_date=None, end_date=None, type_filter=None, provider_filter=None) -> List[Dict[str, int]]:
+    facts = load_facts(db, PANEL_DIMS["heatmap"], start_date, end_date, type_filter, provider_filter)
+    return heatmap_panel(facts)
+
+
+def criteria_over_time(db: Session, days: int = 30, start_date=None, end_date=None, type_filter=None,
+                       provider_filter=None) -> List[Dict[str, Any]]:
+    facts = load_facts(db, PANEL_DIMS["criteria_over_time"], start_date, end_date, type_filter, provider_filter,
+                       since=_window_start(days))
+    return criteria_over_time_panel(facts, days)
+
+
+# -----------------------------
+# Feedback linked to nPerf results
+# -----------------------------
+
+def nperf_ratings(db: Session, start_date=None, end_date=None, type_filter=None, provider_filter=None,
+                  sector_filter=None, limit: int = 50, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """Criterion ratings of the feedbacks linked to each nPerf result, one page of results.
+
+    A feedback is linked to the results with the same ``nperf_test_id`` (both
+    columns are indexed). The date, type and provider filters apply to the
+    feedbacks, ``sector_filter`` to the results. Results come newest first with
+    keyset pagination, as in ``GET /api/nperf/results``; results without any
+    matching feedback are skipped.
+    """
+    nr, fb, fr, lb = models.NPerfResult, models.Feedback, models.FeedbackRating, models.RatingLabel
+    fb_conds = feedback_conditions(start_date, end_date, type_filter, provider_filter)
+    linked = select(fb.id).where(fb.nperf_test_id == nr.nperf_test_id, *fb_conds).exists()
+    conds = [nr.nperf_test_id != "", linked]
+    if sector_filter:
+        conds.append(nr.sector == sector_filter)
+    results, next_cursor = pagination.keyset_page(db, nr, conds, limit, cursor)
+
+    ids = [r.id for r in results]
+    feedback_counts: Dict[int, int] = {}
+    criteria: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    if ids:
+        feedback_counts = dict(db.execute(
+            select(nr.id, func.count(fb.id))
+            .join(fb, fb.nperf_test_id == nr.nperf_test_id)
+            .where(nr.id.in_(ids), *fb_conds)
+            .group_by(nr.id)
+        ).all())
+        stmt = (
+            select(nr.id, lb.label, func.count(), func.sum(fr.rating),
+                   *[func.sum(case((fr.rating == int(v), 1), else_=0)) for v in RATING_VALUES])
+            .select_from(nr)
+            .join(fb, fb.nperf_test_id == nr.nperf_test_id)
+            .join(fr, fr.feedback_id == fb.id)
+            .join(lb, lb.id == fr.label_id)
+            .where(nr.id.in_(ids), *fb_conds)
+            .group_by(nr.id, lb.label)
+        )
+        for result_id, label, c, s, *dist in db.execute(stmt):
+            criteria[result_id].append({
+                "label": label,
+                "count": c,
+                "avg": round(s / c, 2) if c else 0.0,
+                "distribution": dict(zip(RATING_VALUES, map(int, dist))),
+            })
+
+    items = []
+    for r in results:
+        items.append({
+            "id": r.id,
+            "nperf_test_id": r.nperf_test_id,
+            "external_uuid": r.external_uuid,
+            "sector": r.sector,
+            "created_at": r.created_at,
+            "feedback_count": feedback_counts.get(r.id, 0),
+            "criteria": sorted(criteria[r.id], key=lambda c: c["label"]),
+        })
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,369 @@
+"""Background processing and serving of uploaded attachments.
+
+``POST /api/upload`` stores the file as is (``backend.uploads``) and queues a
+row in ``attachment_jobs``; it does not wait for the processing. Each API
+worker runs a processor that claims pending jobs and hands them to a pool of
+``ATTACHMENT_PROCESSES`` processes (1; 0 disables the processing). Images are
+re-encoded there with Pillow:
+
+- EXIF orientation is applied to the pixels, then every metadata block (EXIF
+  with its GPS position, XMP, comments) is left out; the ICC profile is kept;
+- one variant per size of ``ATTACHMENT_SIZES`` (longest side, default
+  ``320,1280,2560``; capped at the original size), each as WebP and as JPEG,
+  quality ``ATTACHMENT_QUALITY`` (80).
+
+The variants go to ``uploads/variants/<name>/`` with a ``manifest.json``.
+``GET /uploads/<name>`` then sends the smallest variant at least ``?w=`` pixels
+wide (the largest size without ``w``), WebP when the client accepts it. The
+original of a processed image is no longer served: it still holds the
+metadata. Other files, and images not processed yet, are served unchanged.
+
+Jobs live in the database, so they survive restarts. A job left ``running``
+by a worker that died is retried after ``ATTACHMENT_JOB_TIMEOUT`` seconds
+(300). A job failing ``ATTACHMENT_MAX_ATTEMPTS`` times (3) is marked
+``failed``. Workers wake on their own uploads and poll every
+``ATTACHMENT_POLL_SECONDS`` (5) for the others'.
+
+Needs ``Pillow``. Existing uploads are queued with::
+
+    python -m backend.attachments backfill
+    python -m backend.attachments status
+"""
+import argparse
+import asyncio
+import json
+import mimetypes
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, func, insert, or_, select, update
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+from . import models
+from .db import AsyncSessionLocal
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # optional: attachments are served as uploaded
+    Image = None
+
+ATTACHMENT_PROCESSES = int(os.getenv("ATTACHMENT_PROCESSES", "1"))
+ATTACHMENT_SIZES = sorted(int(s) for s in os.getenv("ATTACHMENT_SIZES", "320,1280,2560").split(",") if s.strip())
+ATTACHMENT_QUALITY = int(os.getenv("ATTACHMENT_QUALITY", "80"))
+ATTACHMENT_MAX_PIXELS = int(os.getenv("ATTACHMENT_MAX_PIXELS", str(50_000_000)))  # larger images fail
+ATTACHMENT_JOB_TIMEOUT = float(os.getenv("ATTACHMENT_JOB_TIMEOUT", "300"))
+ATTACHMENT_MAX_ATTEMPTS = int(os.getenv("ATTACHMENT_MAX_ATTEMPTS", "3"))
+ATTACHMENT_POLL_SECONDS = float(os.getenv("ATTACHMENT_POLL_SECONDS", "5"))
+
+UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploads")
+VARIANTS = "variants"  # sub-directory of the upload directory
+MANIFEST = "manifest.json"
+FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+PROCESSED_CACHE = "public, max-age=86400"
+PENDING_CACHE = "no-cache"  # the response changes once the image is processed
+
+enabled = ATTACHMENT_PROCESSES > 0 and Image is not None
+if ATTACHMENT_PROCESSES > 0 and Image is None:
+    print("Attachment processing needs Pillow (pip install Pillow); uploads are served as stored")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# -----------------------------
+# Image processing (runs in the pool processes)
+# -----------------------------
+
+def _atomic_write(path: str, write) -> None:
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def process_file(upload_dir: str, filename: str) -> Optional[Dict[str, Any]]:
+    """Write the variants of one upload; returns its manifest, None when it is not a still image."""
+    Image.MAX_IMAGE_PIXELS = ATTACHMENT_MAX_PIXELS  # bigger raises DecompressionBombError
+    try:
+        source = Image.open(os.path.join(upload_dir, filename))
+    except UnidentifiedImageError:
+        return None
+    with source:
+        if getattr(source, "is_animated", False):
+            return None  # a still variant would lose the animation
+        icc = source.info.get("icc_profile")
+        image = ImageOps.exif_transpose(source)  # orientation into the pixels, before EXIF is dropped
+        alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if alpha else "RGB")
+
+    out_dir = os.path.join(upload_dir, VARIANTS, filename)
+    os.makedirs(out_dir, exist_ok=True)
+    width, height = image.size
+    variants: List[Dict[str, Any]] = []
+    for side in sorted({min(s, max(width, height)) for s in ATTACHMENT_SIZES}):
+        resized = image.copy()
+        resized.thumbnail((side, side), Image.Resampling.LANCZOS)
+        flat = resized
+        if alpha:  # JPEG has no alpha channel: flatten on white
+            flat = Image.new("RGB", resized.size, (255, 255, 255))
+            flat.paste(resized, mask=resized.getchannel("A"))
+        for fmt, img, options in (
+                ("webp", resized, {"quality": ATTACHMENT_QUALITY, "method": 4}),
+                ("jpeg", flat, {"quality": ATTACHMENT_QUALITY, "optimize": True, "progressive": True})):
+            name = f"{resized.width}x{resized.height}.{'jpg' if fmt == 'jpeg' else fmt}"
+            path = os.path.join(out_dir, name)
+            # only the ICC profile is passed on: no exif=, no xmp=
+            _atomic_write(path, lambda f: img.save(f, fmt.upper(), icc_profile=icc, **options))
+            variants.append({"file": f"{VARIANTS}/{filename}/{name}", "format": fmt, "width": resized.width,
+                             "height": resized.height, "bytes": os.path.getsize(path)})
+
+    manifest = {"source": filename, "width": width, "height": height, "variants": variants}
+    # written last: serving switches to the variants once they all exist
+    _atomic_write(os.path.join(out_dir, MANIFEST), lambda f: f.write(json.dumps(manifest).encode()))
+    return manifest
+
+
+# -----------------------------
+# Jobs
+# -----------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_task: Optional[asyncio.Task] = None
+_wake: Optional[asyncio.Event] = None
+_upload_dir = UPLOAD_DIR
+
+
+def _new_pool() -> ProcessPoolExecutor:
+    # spawn: a fork of the server would inherit its event loop, threads and connections
+    return ProcessPoolExecutor(max_workers=ATTACHMENT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _insert_ignore(dialect: str):
+    """INSERT of a job that keeps the existing one for the same file."""
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(models.AttachmentJob).prefix_with("IGNORE")
+    return dialect_insert(models.AttachmentJob).on_conflict_do_nothing(index_elements=["filename"])
+
+
+async def enqueue(filename: str) -> Optional[str]:
+    """Queue the processing of a stored upload; returns the job status (None when disabled)."""
+    if not enabled:
+        return None
+    job = models.AttachmentJob
+    async with AsyncSessionLocal() as db:
+        await db.execute(_insert_ignore(db.get_bind().dialect.name).values(filename=filename, status="pending"))
+        await db.commit()
+        status = await db.scalar(select(job.status).where(job.filename == filename))
+    if _wake is not None:
+        _wake.set()
+    return status
+
+
+async def _claim() -> Optional[Tuple[int, str, int]]:
+    """Take the oldest pending (or abandoned) job; a conditional UPDATE makes it ours only."""
+    job = models.AttachmentJob
+    stale = _now() - timedelta(seconds=ATTACHMENT_JOB_TIMEOUT)
+    abandoned = and_(job.status == "running", job.updated_at < stale)
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(job).where(abandoned, job.attempts >= ATTACHMENT_MAX_ATTEMPTS)
+                         .values(status="failed", error="timed out", updated_at=_now()))
+        await db.commit()
+        rows = (await db.execute(
+            select(job.id, job.filename, job.status, job.attempts)
+            .where(or_(job.status == "pending", abandoned)).order_by(job.id).limit(10)
+        )).all()
+        for job_id, filename, status, attempts in rows:
+            # attempts grows on every claim: another worker claiming first makes this match nothing
+            claimed = await db.execute(
+                update(job).where(job.id == job_id, job.status == status, job.attempts == attempts)
+                .values(status="running", attempts=attempts + 1, updated_at=_now()))
+            await db.commit()
+            if claimed.rowcount == 1:
+                return job_id, filename, attempts + 1
+    return None
+
+
+async def _finish(job_id: int, status: str, manifest: Optional[Dict[str, Any]] = None,
+                  error: Optional[str] = None) -> None:
+    job = models.AttachmentJob
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(job).where(job.id == job_id)
+                         .values(status=status, variants=manifest, error=error, updated_at=_now()))
+        await db.commit()
+
+
+async def _process(job_id: int, filename: str, attempts: int) -> None:
+    global _pool
+    loop = asyncio.get_running_loop()
+    try:
+        manifest = await loop.run_in_executor(_pool, process_file, _upload_dir, filename)
+    except FileNotFoundError:
+        await _finish(job_id, "failed", error="file not found")
+        return
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):  # a process died (e.g. out of memory): start new ones
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = _new_pool()
+        print(f"Attachment {filename}: processing failed (attempt {attempts}): {e}")
+        status = "pending" if attempts < ATTACHMENT_MAX_ATTEMPTS else "failed"
+        await _finish(job_id, status, error=f"{type(e).__name__}: {e}"[:500])
+        return
+    await _finish(job_id, "done" if manifest else "skipped", manifest)
+
+
+async def _run() -> None:
+    active: Set[asyncio.Task] = set()
+    while True:
+        try:
+            while len(active) < ATTACHMENT_PROCESSES:
+                claimed = await _claim()
+                if claimed is None:
+                    break
+                task = asyncio.get_running_loop().create_task(_process(*claimed))
+                active.add(task)
+                task.add_done_callback(active.discard)
+        except Exception as e:
+            print(f"Attachment jobs: claim failed: {e}")
+        _wake.clear()
+        waiter = asyncio.ensure_future(_wake.wait())
+        try:
+            await asyncio.wait({waiter, *active}, timeout=ATTACHMENT_POLL_SECONDS,
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+
+
+async def start(upload_dir: str = UPLOAD_DIR) -> None:
+    global _pool, _task, _wake, _upload_dir
+    if not enabled:
+        return
+    _upload_dir = upload_dir
+    _wake = asyncio.Event()
+    _pool = _new_pool()
+    _task = asyncio.get_running_loop().create_task(_run(), name="attachment-jobs")
+
+
+async def stop() -> None:
+    """Jobs still running are picked up again after ATTACHMENT_JOB_TIMEOUT."""
+    global _pool, _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def job_info(filename: str) -> Optional[Dict[str, Any]]:
+    job = models.AttachmentJob
+    async with AsyncSessionLocal() as db:
+        row = await db.scalar(select(job).where(job.filename == filename))
+    if row is None:
+        return None
+    return {"filename": row.filename, "status": row.status, "attempts": row.attempts, "error": row.error,
+            "variants": row.variants, "created_at": row.created_at, "updated_at": row.updated_at}
+
+
+# -----------------------------
+# Serving
+# -----------------------------
+
+@lru_cache(maxsize=1024)
+def _read_manifest(path: str, mtime_ns: int) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        return json.loads(f.read())
+
+
+def manifest(upload_dir: str, filename: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(upload_dir, VARIANTS, filename, MANIFEST)
+    try:
+        return _read_manifest(path, os.stat(path).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+
+def pick_variant(variants: List[Dict[str, Any]], width: Optional[int], accept: str) -> Dict[str, Any]:
+    """Smallest file at least ``width`` pixels wide (else of the widest size), WebP when accepted."""
+    formats = ("webp", "jpeg") if "image/webp" in accept else ("jpeg",)
+    candidates = [v for v in variants if v["format"] in formats]
+    widest = max(v["width"] for v in candidates)
+    wanted = min(width, widest) if width else widest
+    return min((v for v in candidates if v["width"] >= wanted), key=lambda v: v["bytes"])
+
+
+def response(request: Request, upload_dir: str, filename: str, width: Optional[int] = None) -> Response:
+    """``GET /uploads/<name>``: the best processed variant, else the stored file."""
+    if filename != os.path.basename(filename) or filename.startswith(".") or filename == VARIANTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    info = manifest(upload_dir, filename)
+    headers = {"Cache-Control": PENDING_CACHE}
+    if info is not None and info["variants"]:
+        variant = pick_variant(info["variants"], width, request.headers.get("accept", ""))
+        path, media_type = os.path.join(upload_dir, variant["file"]), FORMATS[variant["format"]]
+        headers = {"Cache-Control": PROCESSED_CACHE, "Vary": "Accept"}
+    else:
+        path = os.path.join(upload_dir, filename)
+        media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Not Found")
+    file_response = FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
+    if request.headers.get("if-none-match") == file_response.headers["etag"]:
+        return Response(status_code=304, headers={k: file_response.headers[k]
+                                                  for k in ("etag", "cache-control", "vary") if k in file_response.headers})
+    return file_response
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Attachment processing jobs")
+    parser.add_argument("command", choices=["backfill", "status"])
+    parser.add_argument("--upload-dir", default=UPLOAD_DIR)
+    args = parser.parse_args()
+
+    from .db import SessionLocal
+    job = models.AttachmentJob
+    with SessionLocal() as db:
+        if args.command == "status":
+            for status, count in db.execute(select(job.status, func.count()).group_by(job.status).order_by(job.status)):
+                print(f"{status:8} {count}")
+            return
+        known = set(db.scalars(select(job.filename)))
+        names = sorted(n for n in os.listdir(args.upload_dir)
+                       if n not in known and not n.startswith(".") and n != VARIANTS
+                       and os.path.isfile(os.path.join(args.upload_dir, n)))
+        for name in names:
+            db.add(job(filename=name, status="pending"))
+        db.commit()
+    print(f"Queued {len(names)} upload(s); the API workers process them")
+
+
+if __name__ == "__main__":
+    main()
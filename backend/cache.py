@@ -0,0 +1,196 @@
+"""Response cache for the analytics endpoints.
+
+Entries are keyed by (endpoint, start_date, end_date, type, provider, days) plus
+a data version. ``create_feedback`` calls :meth:`bump` after each commit, which
+makes every entry computed before it unreachable; the TTL bounds staleness for
+changes the version does not see (other workers with the in-process backend,
+rollup rebuilds...).
+
+Configuration (environment):
+- ``ANALYTICS_CACHE``: ``memory`` (default, per worker), ``redis`` (shared by all
+  workers/replicas, needs ``REDIS_URL``) or ``off``.
+- ``ANALYTICS_CACHE_TTL``: seconds, default 30.
+- ``ANALYTICS_CACHE_SIZE``: max entries of the in-process LRU, default 512. With
+  Redis, bound memory with ``maxmemory`` + ``maxmemory-policy allkeys-lru``.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics
+
+_MISSING = object()
+
+
+class MemoryCache:
+    """Thread-safe LRU with per-entry expiry, local to one worker process."""
+
+    backend = "memory"
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple, version: int) -> Any:
+        now = time.monotonic()
+        full_key = (version,) + key
+        with self._lock:
+            item = self._entries.get(full_key)
+            if item is None or item[0] < now:
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(full_key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Tuple, value: Any, version: int) -> None:
+        with self._lock:
+            full_key = (version,) + key
+            self._entries[full_key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def bump(self) -> None:
+        # older versions are never read again and age out of the LRU
+        with self._lock:
+            self.version += 1
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisCache:
+    """Cache shared by all workers; the version counter lives in Redis too."""
+
+    backend = "redis"
+
+    def __init__(self, url: str, ttl: float = 30.0, prefix: str = "artci:analytics"):
+        import redis  # only needed when this backend is selected
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self) -> int:
+        return int(self.client.get(f"{self.prefix}:version") or 0)
+
+    def _key(self, key: Tuple, version: int) -> str:
+        return f"{self.prefix}:{version}:" + json.dumps(key, separators=(",", ":"))
+
+    def get(self, key: Tuple, version: int) -> Any:
+        raw = self.client.get(self._key(key, version))
+        if raw is None:
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key: Tuple, value: Any, version: int) -> None:
+        self.client.set(self._key(key, version), json.dumps(value), ex=max(1, int(self.ttl)))
+
+    def bump(self) -> None:
+        self.client.incr(f"{self.prefix}:version")
+
+    def size(self) -> int:
+        return sum(1 for _ in self.client.scan_iter(f"{self.prefix}:{self.version}:*", count=1000))
+
+
+class NullCache:
+    backend = "off"
+    version = 0
+    hits = 0
+    misses = 0
+    ttl = 0
+
+    def get(self, key: Tuple, version: int) -> Any:
+        return _MISSING
+
+    def set(self, key: Tuple, value: Any, version: int) -> None:
+        pass
+
+    def bump(self) -> None:
+        pass
+
+    def size(self) -> int:
+        return 0
+
+
+def _from_env():
+    kind = os.getenv("ANALYTICS_CACHE", "memory").lower()
+    ttl = float(os.getenv("ANALYTICS_CACHE_TTL", "30"))
+    if kind == "off" or ttl <= 0:
+        return NullCache()
+    if kind == "redis":
+        return RedisCache(os.getenv("REDIS_URL", "redis://localhost:6379/0"), ttl=ttl)
+    return MemoryCache(ttl=ttl, max_entries=int(os.getenv("ANALYTICS_CACHE_SIZE", "512")))
+
+
+analytics_cache = _from_env()
+
+
+def cached(endpoint: str, compute: Callable[[], Any], start_date: Optional[str] = None,
+           end_date: Optional[str] = None, type_filter: Optional[str] = None,
+           provider_filter: Optional[str] = None, days: Optional[int] = None) -> Any:
+    """Return the cached response for this filter tuple, computing it on a miss."""
+    key = (endpoint, start_date, end_date, type_filter, provider_filter, days)
+    try:
+        # read the version first: a bump while computing must not be cached as fresh
+        version = analytics_cache.version
+        value = analytics_cache.get(key, version)
+    except Exception as e:  # a cache outage must not take the dashboard down
+        print(f"Analytics cache get failed: {e}")
+        return compute()
+    metrics.CACHE_REQUESTS.labels("miss" if value is _MISSING else "hit").inc()
+    if value is _MISSING:
+        value = compute()
+        try:
+            analytics_cache.set(key, value, version)
+        except Exception as e:
+            print(f"Analytics cache set failed: {e}")
+    return value
+
+
+def invalidate() -> None:
+    """Called after new feedback is committed."""
+    try:
+        analytics_cache.bump()
+    except Exception as e:
+        print(f"Analytics cache invalidation failed: {e}")
+
+
+async def ainvalidate() -> None:
+    """:func:`invalidate` for async handlers; a Redis round trip runs off the event loop."""
+    if analytics_cache.backend == "redis":
+        await run_in_threadpool(invalidate)
+    else:
+        invalidate()
+
+
+def stats() -> Dict[str, Any]:
+    c = analytics_cache
+    try:
+        version, size = c.version, c.size()
+    except Exception:
+        version, size = None, None
+    return {
+        "backend": c.backend,
+        "hits": c.hits,
+        "misses": c.misses,
+        "entries": size,
+        "version": version,
+        "ttl": c.ttl,
+    }
@@ -0,0 +1,466 @@
+"""In-memory columnar analytics engine (optional, ``ANALYTICS_ENGINE=numpy``).
+
+Each worker keeps the feedback facts as NumPy columns and answers the dashboard
+endpoints (summary, criteria, time_series, heatmap, criteria_over_time,
+dashboard) with vectorised masks and ``bincount``\\ s instead of a GROUP BY over
+``feedback_rollups``. The output is the same as the SQL engine's.
+
+- one row per feedback: hour bucket (``int32`` hours since 1970-01-01, the
+  wall-clock day and hour the rollups use), type and provider codes (``int16``,
+  dictionary-encoded);
+- one row per criterion rating: the same plus the label code (``int16``) and
+  the rating (``int8``), i.e. 11 bytes per rating.
+
+The columns are loaded from ``feedbacks`` and ``feedback_ratings`` in the
+background at startup; until then the SQL engine answers. Feedbacks committed
+by this worker are appended right away (``ingest.feedbacks_committed``). Those
+of other workers are read every ``ANALYTICS_ENGINE_REFRESH`` seconds (10) by
+id. Every ``ANALYTICS_ENGINE_RELOAD`` seconds (3600, 0 = never) the columns
+are reloaded from scratch. That picks up rows whose transaction ran longer
+than a minute. ``partitions`` archive and restore bump the ``feedbacks`` row of
+``data_versions``; a worker that sees a new version at its next refresh reloads
+right away, so an archived month stops being counted within seconds.
+
+Needs ``numpy`` (``pip install numpy``); without it the SQL engine is used.
+``GET /api/analytics/engine`` reports the engine in use and its memory.
+"""
+import asyncio
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Date, Integer, cast, func, literal_column, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .analytics import RATING_VALUES, _window_start, iter_rating_items, parse_date
+from .db import SessionLocal
+
+try:
+    import numpy as np
+except ImportError:  # optional: the SQL engine answers
+    np = None
+
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "sql").lower()
+ANALYTICS_ENGINE_REFRESH = float(os.getenv("ANALYTICS_ENGINE_REFRESH", "10"))
+ANALYTICS_ENGINE_RELOAD = float(os.getenv("ANALYTICS_ENGINE_RELOAD", "3600"))
+
+LOAD_CHUNK_ROWS = 50000
+SETTLE_SECONDS = 60  # a feedback older than this is assumed committed or rolled back
+EPOCH = date(1970, 1, 1).toordinal()
+FEEDBACK_COLUMNS = {"hour": "int32", "type": "int16", "provider": "int16"}
+RATING_COLUMNS = {"hour": "int32", "type": "int16", "provider": "int16", "label": "int16", "rating": "int8"}
+
+
+def epoch_hour_expr(db: Session, col):
+    """Hours since 1970-01-01 of the day and hour the rollups use (``day_expr``/``hour_expr``)."""
+    if db.get_bind().dialect.name == "sqlite":
+        days = cast(func.julianday(func.date(col)) - 2440587.5, Integer)
+        return days * 24 + cast(func.strftime("%H", col), Integer)
+    col = func.timezone("UTC", col)
+    days = cast(col, Date) - literal_column("DATE '1970-01-01'")
+    return cast(days * 24 + func.extract("hour", col), Integer)
+
+
+def _day_number(d: date) -> int:
+    return d.toordinal() - EPOCH
+
+
+def _epoch_hour(ts: datetime) -> int:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    return _day_number(ts.date()) * 24 + ts.hour
+
+
+class _Dictionary:
+    """Dictionary encoding: value -> small int code, in order of first appearance."""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+        self._lock = threading.Lock()
+
+    def code(self, value: str) -> int:
+        c = self.codes.get(value)
+        if c is None:
+            with self._lock:
+                c = self.codes.get(value)
+                if c is None:
+                    if len(self.values) >= np.iinfo(np.int16).max:
+                        raise OverflowError("too many distinct values for int16 codes")
+                    c = len(self.values)
+                    self.values.append(value)
+                    self.codes[value] = c
+        return c
+
+    def encode(self, values: List[str]) -> "np.ndarray":
+        return np.fromiter(map(self.code, values), dtype=np.int16, count=len(values))
+
+
+class _Columns:
+    """Growable set of equal-length arrays; capacity doubles so appends are amortised O(1)."""
+
+    def __init__(self, dtypes: Dict[str, str]):
+        self.size = 0
+        self.arrays = {name: np.empty(1024, dtype) for name, dtype in dtypes.items()}
+
+    def extend(self, columns: Dict[str, "np.ndarray"]) -> None:
+        n = len(next(iter(columns.values())))
+        end = self.size + n
+        for name, array in self.arrays.items():
+            if end > len(array):
+                # readers keep the old array: it is never written again
+                grown = np.empty(max(end, 2 * len(array)), array.dtype)
+                grown[:self.size] = array[:self.size]
+                self.arrays[name] = array = grown
+            array[self.size:end] = columns[name]
+        self.size = end
+
+    def view(self) -> Dict[str, "np.ndarray"]:
+        return {name: array[:self.size] for name, array in self.arrays.items()}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
+
+
+class ColumnarStore:
+    """Feedback facts of one worker. Query methods take the arguments of the
+    ``analytics`` functions of the same name (``db`` is not used)."""
+
+    def __init__(self):
+        self.types = _Dictionary()
+        self.providers = _Dictionary()
+        self.labels = _Dictionary()
+        self.feedbacks = _Columns(FEEDBACK_COLUMNS)
+        self.ratings = _Columns(RATING_COLUMNS)
+        self.settled_id = 0  # every feedback up to this id is loaded
+        self.recent: Set[int] = set()  # loaded ids above settled_id
+        self.loaded_at: Optional[datetime] = None
+        self.load_seconds = 0.0
+        self.refreshed_at: Optional[datetime] = None
+        self.version = 0  # data_version() the columns were loaded at
+        self._lock = threading.Lock()
+
+    # -- loading --------------------------------------------------------
+
+    def _read(self, db: Session, stmt, encode) -> Tuple[List["np.ndarray"], List[Dict[str, "np.ndarray"]]]:
+        ids, chunks = [], []
+        for rows in db.execute(stmt.execution_options(yield_per=LOAD_CHUNK_ROWS)).partitions():
+            cols = list(zip(*rows))
+            ids.append(np.array(cols[0], dtype=np.int64))
+            chunks.append(encode(cols))
+        return ids, chunks
+
+    def catch_up(self) -> int:
+        """Load the feedbacks committed since the last call. Returns how many were added."""
+        t0 = time.perf_counter()
+        fb, fr, lb = models.Feedback, models.FeedbackRating, models.RatingLabel
+        with SessionLocal() as db:
+            since_id = self.settled_id
+            cutoff = datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS)
+            settled = db.scalar(select(func.max(fb.id)).where(fb.id > since_id, fb.created_at < cutoff))
+            label_ids = dict(db.execute(select(lb.id, lb.label)).all())
+
+            def label_code(label_id: int) -> int:
+                if label_id not in label_ids:  # created after the lookup above
+                    label_ids[label_id] = db.scalar(select(lb.label).where(lb.id == label_id))
+                return self.labels.code(label_ids[label_id])
+
+            fb_ids, fb_chunks = self._read(
+                db,
+                select(fb.id, epoch_hour_expr(db, fb.created_at), fb.type, fb.provider).where(fb.id > since_id),
+                lambda c: {"hour": np.array(c[1], np.int32), "type": self.types.encode(c[2]),
+                           "provider": self.providers.encode(c[3])})
+            # read after the feedbacks: every rating of a feedback read above is visible
+            rt_ids, rt_chunks = self._read(
+                db,
+                select(fr.feedback_id, epoch_hour_expr(db, fr.created_at), fr.type, fr.provider, fr.label_id,
+                       fr.rating).where(fr.feedback_id > since_id),
+                lambda c: {"hour": np.array(c[1], np.int32), "type": self.types.encode(c[2]),
+                           "provider": self.providers.encode(c[3]),
+                           "label": np.array([label_code(i) for i in c[4]], np.int16),
+                           "rating": np.array(c[5], np.int8)})
+
+        added = 0
+        with self._lock:
+            ids = np.concatenate(fb_ids) if fb_ids else np.empty(0, np.int64)
+            new = ~np.isin(ids, np.fromiter(self.recent, np.int64, len(self.recent)))
+            if fb_chunks:
+                self.feedbacks.extend({k: np.concatenate([c[k] for c in fb_chunks])[new] for k in FEEDBACK_COLUMNS})
+            if rt_chunks:
+                keep = np.isin(np.concatenate(rt_ids), ids[new])
+                self.ratings.extend({k: np.concatenate([c[k] for c in rt_chunks])[keep] for k in RATING_COLUMNS})
+            added = int(new.sum())
+            self.recent.update(ids[new].tolist())
+            if settled is not None and settled > self.settled_id:
+                self.settled_id = settled
+                self.recent = {i for i in self.recent if i > settled}
+            self.refreshed_at = datetime.utcnow()
+            if self.loaded_at is None:
+                self.loaded_at = self.refreshed_at
+                self.load_seconds = time.perf_counter() - t0
+        return added
+
+    def append(self, feedbacks: Iterable[Any]) -> None:
+        """Add freshly committed feedbacks (ORM objects or ``RETURNING`` rows, as ``rollups.rollup_rows``)."""
+        fb_cols: Dict[str, list] = {k: [] for k in FEEDBACK_COLUMNS}
+        rt_cols: Dict[str, list] = {k: [] for k in RATING_COLUMNS}
+        with self._lock:
+            for fb in feedbacks:
+                if fb.id <= self.settled_id or fb.id in self.recent:
+                    continue
+                self.recent.add(fb.id)
+                hour = _epoch_hour(fb.created_at)
+                t, p = self.types.code(fb.type), self.providers.code(fb.provider or "")
+                for k, v in zip(FEEDBACK_COLUMNS, (hour, t, p)):
+                    fb_cols[k].append(v)
+                for label, rating in iter_rating_items(fb.ratings):
+                    for k, v in zip(RATING_COLUMNS, (hour, t, p, self.labels.code(label), rating)):
+                        rt_cols[k].append(v)
+            if fb_cols["hour"]:
+                self.feedbacks.extend({k: np.array(v, FEEDBACK_COLUMNS[k]) for k, v in fb_cols.items()})
+            if rt_cols["hour"]:
+                self.ratings.extend({k: np.array(v, RATING_COLUMNS[k]) for k, v in rt_cols.items()})
+
+    # -- queries --------------------------------------------------------
+
+    def _snapshot(self) -> Tuple[Dict[str, "np.ndarray"], Dict[str, "np.ndarray"]]:
+        with self._lock:
+            return self.feedbacks.view(), self.ratings.view()
+
+    def _filter(self, cols: Dict[str, "np.ndarray"], start_date, end_date, type_filter,
+                provider_filter) -> Dict[str, "np.ndarray"]:
+        """Same rows as ``rollup_conditions``: dates compared on the calendar day."""
+        mask = None
+
+        def both(m):
+            nonlocal mask
+            mask = m if mask is None else mask & m
+
+        if type_filter:
+            both(cols["type"] == self.types.codes.get(type_filter, -1))
+        if provider_filter:
+            both(cols["provider"] == self.providers.codes.get(provider_filter, -1))
+        start_dt, end_dt = parse_date(start_date), parse_date(end_date)
+        if start_dt:
+            both(cols["hour"] >= _day_number(start_dt.date()) * 24)
+        if end_dt:
+            both(cols["hour"] < (_day_number(end_dt.date()) + 1) * 24)  # inclusive end date
+        if mask is None:
+            return cols
+        return {name: array[mask] for name, array in cols.items()}
+
+    def _sorted_labels(self, present: "np.ndarray") -> List[Tuple[int, str]]:
+        values = self.labels.values
+        return sorted(((int(i), values[i]) for i in np.flatnonzero(present)), key=lambda item: item[1])
+
+    def _summary(self, fbs, rts) -> Dict[str, Any]:
+        def counts(codes, dictionary):
+            values = dictionary.values
+            return {values[i]: int(c) for i, c in enumerate(np.bincount(codes, minlength=len(values))) if c}
+
+        dist = np.bincount(rts["rating"], minlength=5)
+        return {
+            "total_feedback": len(fbs["hour"]),
+            "by_type": counts(fbs["type"], self.types),
+            "by_provider": counts(fbs["provider"], self.providers),
+            "rating_distribution": {k: int(dist[int(k)]) for k in RATING_VALUES},
+        }
+
+    def _criteria(self, rts) -> List[Dict[str, Any]]:
+        n = len(self.labels.values)
+        grid = np.bincount(rts["label"].astype(np.intp) * 4 + rts["rating"] - 1, minlength=4 * n).reshape(n, 4)
+        counts, sums = grid.sum(axis=1), grid @ np.arange(1, 5)
+        result = []
+        for i, label in self._sorted_labels(counts > 0):
+            c, s = int(counts[i]), int(sums[i])
+            result.append({
+                "label": label,
+                "count": c,
+                "avg": round(s / c, 2),
+                "distribution": {k: int(grid[i, j]) for j, k in enumerate(RATING_VALUES)},
+            })
+        return result
+
+    @staticmethod
+    def _time_series(fbs, days: int, since: datetime) -> List[Dict[str, Any]]:
+        offset = fbs["hour"] // 24 - _day_number(since.date())
+        per_day = np.bincount(offset[(offset >= 1) & (offset <= days)], minlength=days + 1)
+        return [{"date": str((since + timedelta(days=i + 1)).date()), "count": int(per_day[i + 1])}
+                for i in range(days)]
+
+    @staticmethod
+    def _heatmap(fbs) -> List[Dict[str, int]]:
+        hours = fbs["hour"]
+        grid = np.bincount((hours // 24 + 3) % 7 * 24 + hours % 24, minlength=7 * 24)  # 1970-01-01 was a Thursday
+        return [{"weekday": w, "hour": h, "count": int(grid[w * 24 + h])} for w in range(7) for h in range(24)]
+
+    def _criteria_over_time(self, rts, days: int, since: datetime) -> List[Dict[str, Any]]:
+        n = len(self.labels.values)
+        offset = rts["hour"] // 24 - _day_number(since.date())
+        labels = self._sorted_labels(np.bincount(rts["label"][offset >= 0], minlength=n) > 0)
+        window = (offset >= 1) & (offset <= days)
+        cell = (offset[window] - 1).astype(np.intp) * n + rts["label"][window]
+        counts = np.bincount(cell, minlength=days * n)
+        sums = np.bincount(cell, weights=rts["rating"][window], minlength=days * n).astype(np.int64)
+        out: List[Dict[str, Any]] = []
+        for d in range(days):
+            d_str = str((since + timedelta(days=d + 1)).date())
+            for i, label in labels:
+                c, s = int(counts[d * n + i]), int(sums[d * n + i])
+                avg = (s / c) if c else 0.0
+                out.append({"date": d_str, "label": label, "avg": round(avg, 2), "count": c, "sum": s})
+        return out
+
+    def summary(self, db=None, start_date=None, end_date=None, type_filter=None, provider_filter=None):
+        fbs, rts = self._snapshot()
+        filters = (start_date, end_date, type_filter, provider_filter)
+        return self._summary(self._filter(fbs, *filters), self._filter(rts, *filters))
+
+    def criteria(self, db=None, start_date=None, end_date=None, type_filter=None, provider_filter=None):
+        _fbs, rts = self._snapshot()
+        return self._criteria(self._filter(rts, start_date, end_date, type_filter, provider_filter))
+
+    def time_series(self, db=None, days: int = 30, start_date=None, end_date=None, type_filter=None,
+                    provider_filter=None):
+        fbs, _rts = self._snapshot()
+        days = max(1, days)
+        return self._time_series(self._filter(fbs, start_date, end_date, type_filter, provider_filter),
+                                 days, _window_start(days))
+
+    def heatmap(self, db=None, start_date=None, end_date=None, type_filter=None, provider_filter=None):
+        fbs, _rts = self._snapshot()
+        return self._heatmap(self._filter(fbs, start_date, end_date, type_filter, provider_filter))
+
+    def criteria_over_time(self, db=None, days: int = 30, start_date=None, end_date=None, type_filter=None,
+                           provider_filter=None):
+        _fbs, rts = self._snapshot()
+        days = max(1, days)
+        return self._criteria_over_time(self._filter(rts, start_date, end_date, type_filter, provider_filter),
+                                        days, _window_start(days))
+
+    def dashboard(self, db=None, days: int = 30, start_date=None, end_date=None, type_filter=None,
+                  provider_filter=None):
+        fbs, rts = self._snapshot()
+        filters = (start_date, end_date, type_filter, provider_filter)
+        fbs, rts = self._filter(fbs, *filters), self._filter(rts, *filters)
+        days = max(1, days)
+        since = _window_start(days)
+        return {
+            "summary": self._summary(fbs, rts),
+            "criteria": self._criteria(rts),
+            "time_series": self._time_series(fbs, days, since),
+            "heatmap": self._heatmap(fbs),
+            "criteria_over_time": self._criteria_over_time(rts, days, since),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ratings, fb_bytes, rt_bytes = self.ratings.size, self.feedbacks.nbytes, self.ratings.nbytes
+            return {
+                "feedbacks": self.feedbacks.size,
+                "ratings": ratings,
+                "bytes": fb_bytes + rt_bytes,
+                "bytes_per_rating": round(rt_bytes / ratings, 1) if ratings else None,
+                "loaded_at": self.loaded_at,
+                "load_seconds": round(self.load_seconds, 3),
+                "refreshed_at": self.refreshed_at,
+            }
+
+
+enabled = ANALYTICS_ENGINE == "numpy"
+if enabled and np is None:
+    print("ANALYTICS_ENGINE=numpy needs numpy (pip install numpy); using the SQL engine")
+    enabled = False
+
+store: Optional[ColumnarStore] = None  # set once the first load is done
+_task: Optional[asyncio.Task] = None
+
+
+DATA_VERSION_NAME = "feedbacks"
+
+
+def data_version(db: Session) -> int:
+    dv = models.DataVersion
+    return db.scalar(select(dv.version).where(dv.name == DATA_VERSION_NAME)) or 0
+
+
+def bump_data_version(conn) -> None:
+    """Make every worker reload its columns; call it in the transaction that removes or restores rows."""
+    dv = models.DataVersion
+    conn.execute(update(dv).where(dv.name == DATA_VERSION_NAME).values(version=dv.version + 1,
+                                                                        changed_at=func.now()))
+
+
+def load() -> ColumnarStore:
+    new = ColumnarStore()
+    with SessionLocal() as db:
+        new.version = data_version(db)  # read first: a change during the load triggers another one
+    new.catch_up()
+    return new
+
+
+def _stale(current: ColumnarStore) -> bool:
+    with SessionLocal() as db:
+        return data_version(db) != current.version
+
+
+async def _run() -> None:
+    global store
+    while store is None:
+        try:
+            store = await run_in_threadpool(load)
+            print(f"Columnar analytics: {store.feedbacks.size} feedbacks loaded in {store.load_seconds:.1f} s")
+        except Exception as e:
+            print(f"Columnar analytics: load failed ({e}), retrying")
+            await asyncio.sleep(max(1.0, ANALYTICS_ENGINE_REFRESH))
+    loaded = time.monotonic()
+    while True:
+        await asyncio.sleep(ANALYTICS_ENGINE_REFRESH)
+        try:
+            expired = ANALYTICS_ENGINE_RELOAD > 0 and time.monotonic() - loaded >= ANALYTICS_ENGINE_RELOAD
+            if expired or await run_in_threadpool(_stale, store):
+                store = await run_in_threadpool(load)
+                loaded = time.monotonic()
+            else:
+                await run_in_threadpool(store.catch_up)
+        except Exception as e:
+            print(f"Columnar analytics: refresh failed: {e}")
+
+
+async def start() -> None:
+    global _task
+    if enabled:
+        _task = asyncio.get_running_loop().create_task(_run(), name="columnar-analytics")
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def append(feedbacks: List[Any]) -> None:
+    """Called after a commit of new feedbacks (never fails the write)."""
+    if store is None:
+        return
+    try:
+        store.append(feedbacks)
+    except Exception as e:
+        print(f"Columnar analytics: append failed: {e}")
+
+
+def stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = {"engine": "numpy" if store is not None else "sql", "configured": ANALYTICS_ENGINE}
+    if store is not None:
+        out.update(store.stats())
+    return out
@@ -1,21 +1,393 @@
+import asyncio
+import itertools
+import json
 import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json
+    orjson = None
 
 # Load environment variables from .env if available
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 
-connect_args = {}
-if DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+# Pool settings are per engine and per worker process: keep
+# workers * replicas * (DB_POOL_SIZE + DB_MAX_OVERFLOW) * 2 engines below the
+# server's max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds waiting for a connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 disables
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))  # PostgreSQL only, 0 = none
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Optional read replicas (comma-separated URLs) for the analytics, list and
+# export endpoints; writes and read-your-write lookups stay on DATABASE_URL.
+DATABASE_READ_URLS = [u.strip() for u in os.getenv("DATABASE_READ_URLS", os.getenv("DATABASE_READ_URL", "")).split(",")
+                      if u.strip()]
+DB_READ_MAX_LAG = float(os.getenv("DB_READ_MAX_LAG", "10"))  # seconds of replication lag tolerated
+DB_READ_CHECK_INTERVAL = float(os.getenv("DB_READ_CHECK_INTERVAL", "5"))  # seconds between health checks
+
+# Slow-query log: statements slower than SLOW_QUERY_MS are printed with the
+# types and lengths of their parameters and, for SELECTs, the plan (no listener
+# at all when 0). The values themselves (comments, user fields) only with
+# SLOW_QUERY_PARAMS=true.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+SLOW_QUERY_PARAMS = os.getenv("SLOW_QUERY_PARAMS", "false").lower() == "true"
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+SLOW_QUERY_EXPLAIN_EVERY = 300  # seconds before the plan of the same statement is logged again
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+IS_SQLITE_MEMORY = IS_SQLITE and (":memory:" in DATABASE_URL or DATABASE_URL.rstrip("/") == "sqlite:")
+
+
+def _async_url(url: str) -> str:
+    """Same database as DATABASE_URL, through an asyncio driver
+    (aiosqlite for SQLite, asyncpg for PostgreSQL)."""
+    scheme, sep, rest = url.partition("://")
+    driver = scheme.split("+", 1)[0]
+    if driver == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if driver in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+
+class PoolWaitStats:
+    """Time spent waiting for a pooled connection at checkout."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.listeners: List[Callable[[float, bool], None]] = []  # e.g. backend.metrics
+        self._lock = threading.Lock()
+
+    def record(self, waited: float, timed_out: bool = False) -> None:
+        for listener in self.listeners:
+            listener(waited, timed_out)
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+def _timed_pool(base):
+    class TimedPool(base):
+        wait_stats: PoolWaitStats = None
+
+        def _do_get(self):
+            t0 = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except Exception:
+                self.wait_stats.record(0, timed_out=True)
+                raise
+            self.wait_stats.record(time.perf_counter() - t0)
+            return conn
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def _pool_args(pool_base, wait_stats: PoolWaitStats) -> Dict[str, Any]:
+    if IS_SQLITE_MEMORY:
+        return {}  # SQLAlchemy picks a pool suited to in-memory SQLite
+    pool_cls = _timed_pool(pool_base)
+    pool_cls.wait_stats = wait_stats
+    return {
+        "poolclass": pool_cls,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
 
-engine = create_engine(DATABASE_URL, echo=False, future=True, connect_args=connect_args)
+def _set_sqlite_pragmas(dbapi_connection, _record) -> None:
+    # WAL lets readers run while a write is in progress; NORMAL only fsyncs at
+    # checkpoints (still durable across application crashes); the busy timeout
+    # makes writers wait for the lock instead of failing with "database is locked".
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    if not IS_SQLITE_MEMORY:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def _connect_args(url: str) -> Dict[str, Any]:
+    if url.startswith("sqlite"):
+        return {"check_same_thread": False}
+    if DB_STATEMENT_TIMEOUT_MS:
+        return {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return {}
+
+
+connect_args = _connect_args(DATABASE_URL)
+
+# (de)serialisation of the JSON columns (Feedback.ratings) by both engines
+json_args: Dict[str, Any] = {}
+if orjson is not None:
+    json_args = {"json_serializer": lambda obj: orjson.dumps(obj).decode(), "json_deserializer": orjson.loads}
+
+sync_pool_waits = PoolWaitStats()
+engine = create_engine(DATABASE_URL, echo=False, future=True, connect_args=connect_args,
+                       **json_args, **_pool_args(QueuePool, sync_pool_waits))
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 Base = declarative_base()
 
+# Async engine used by the hot write endpoints, so they do not hold a threadpool
+# thread while waiting on the database. Objects stay loaded after commit: the
+# endpoints return them straight from INSERT ... RETURNING.
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+async_pool_waits = PoolWaitStats()
+async_engine_args = _pool_args(AsyncAdaptedQueuePool, async_pool_waits)
+async_connect_args = {}
+if IS_SQLITE and async_engine_args:
+    # SQLite has a single writer: queue writes on one connection instead of
+    # letting several connections fight over the file lock.
+    async_engine_args.update(pool_size=1, max_overflow=0)
+elif not IS_SQLITE and DB_STATEMENT_TIMEOUT_MS:
+    async_connect_args = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False, connect_args=async_connect_args,
+                                   **json_args, **async_engine_args)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+
+# Lag of a streaming replica; 0 once it has replayed all it received (an idle
+# primary sends nothing, so the last replay timestamp alone would keep growing).
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReadReplica:
+    """Engine of one read replica, with its health and replication lag."""
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.waits = PoolWaitStats()
+        self.engine = create_engine(url, echo=False, future=True, connect_args=_connect_args(url),
+                                    **json_args, **_pool_args(QueuePool, self.waits))
+        if url.startswith("sqlite"):
+            event.listen(self.engine, "connect", _set_sqlite_pragmas)
+        event.listen(self.engine, "handle_error", self._on_error)
+        self.session = sessionmaker(bind=self.engine, autoflush=False, autocommit=False, future=True)
+        self.healthy = True  # until a check says otherwise
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def _on_error(self, context) -> None:
+        if context.is_disconnect:  # fail over now rather than at the next check
+            self.healthy = False
+            self.error = type(context.original_exception).__name__
+
+    def check(self) -> None:
+        try:
+            with self.engine.connect() as conn:
+                lag = conn.scalar(REPLICA_LAG_SQL) if self.engine.dialect.name == "postgresql" else 0
+            self.lag = float(lag or 0)
+            self.error = None if self.lag <= DB_READ_MAX_LAG else "lagging"
+        except Exception as e:
+            self.error = type(e).__name__
+        self.healthy = self.error is None
+
+
+read_replicas = [ReadReplica(f"read{i}", url) for i, url in enumerate(DATABASE_READ_URLS)]
+_next_replica = itertools.count()
+_check_task: Optional[asyncio.Task] = None
+
+
+def ReadSessionLocal() -> Session:
+    """Session on the next healthy replica (round robin), else on the primary."""
+    healthy = [r for r in read_replicas if r.healthy]
+    if not healthy:
+        return SessionLocal()
+    return healthy[next(_next_replica) % len(healthy)].session()
+
+
+def check_replicas() -> None:
+    for replica in read_replicas:
+        was_healthy = replica.healthy
+        replica.check()
+        if replica.healthy != was_healthy:
+            state = "back in rotation" if replica.healthy else f"out of rotation ({replica.error})"
+            print(f"Read replica {replica.name} {state}")
+
+
+async def _check_loop() -> None:
+    while True:
+        await asyncio.sleep(DB_READ_CHECK_INTERVAL)
+        await run_in_threadpool(check_replicas)
+
+
+async def start_replica_checks() -> None:
+    global _check_task
+    if read_replicas:
+        await run_in_threadpool(check_replicas)  # no request reaches a replica that is down at startup
+        _check_task = asyncio.get_running_loop().create_task(_check_loop(), name="read-replica-checks")
+
+
+async def stop_replica_checks() -> None:
+    global _check_task
+    if _check_task is not None:
+        _check_task.cancel()
+        try:
+            await _check_task
+        except asyncio.CancelledError:
+            pass
+        _check_task = None
+
+
+# -----------------------------
+# Slow-query log
+# -----------------------------
+
+EXPLAIN_PREFIX = {"postgresql": "EXPLAIN ", "sqlite": "EXPLAIN QUERY PLAN "}
+_explained: Dict[str, float] = {}  # statement -> when its plan was last logged
+
+
+def _shapes(parameters: Any) -> Any:
+    """Parameters for the log without their values: ``str[42]``, ``int``, ``None``."""
+    if isinstance(parameters, dict):
+        return {k: _shapes(v) for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_shapes(v) for v in parameters[:50]]
+    if parameters is None:
+        return None
+    if isinstance(parameters, (str, bytes)):
+        return f"{type(parameters).__name__}[{len(parameters)}]"
+    return type(parameters).__name__
+
+
+def _short(parameters: Any) -> Any:
+    """Parameters for the log; long values (comments, JSON) cut to 200 characters."""
+    if isinstance(parameters, dict):
+        return {k: _short(v) for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_short(v) for v in parameters[:50]]
+    if isinstance(parameters, (str, bytes)) and len(parameters) > 200:
+        return parameters[:200] + "..."
+    return parameters
+
+
+def _explain(conn, statement: str, parameters: Any) -> Optional[List[str]]:
+    """Plan of a slow SELECT, on the same connection and transaction, at most once per statement
+    every SLOW_QUERY_EXPLAIN_EVERY seconds. Runs on the DBAPI connection: no events, no recursion."""
+    prefix = EXPLAIN_PREFIX.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip()[:6].upper().startswith(("SELECT", "WITH")):
+        return None
+    now = time.monotonic()
+    if now - _explained.get(statement, -SLOW_QUERY_EXPLAIN_EVERY) < SLOW_QUERY_EXPLAIN_EVERY:
+        return None
+    if len(_explained) > 1000:
+        _explained.clear()
+    _explained[statement] = now
+    # PostgreSQL: a failed EXPLAIN must not abort the transaction of the request
+    savepoint = conn.dialect.name == "postgresql" and conn.in_transaction()
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute(prefix + statement, parameters)
+            plan = [str(row[-1]) for row in cursor.fetchall()]  # PostgreSQL: the line; SQLite: the detail
+        except Exception as e:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            return [f"EXPLAIN failed: {e}"]
+        if savepoint:
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    except Exception as e:
+        return [f"EXPLAIN failed: {e}"]
+    finally:
+        cursor.close()
+
+
+def _log_slow_queries(name: str, eng) -> None:
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_t0", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["slow_query_t0"].pop()) * 1000
+        if elapsed_ms < SLOW_QUERY_MS:
+            return
+        entry: Dict[str, Any] = {"engine": name, "ms": round(elapsed_ms, 1), "statement": " ".join(statement.split()),
+                                 "parameters": _short(parameters) if SLOW_QUERY_PARAMS else _shapes(parameters),
+                                 "executemany": executemany}
+        if SLOW_QUERY_EXPLAIN and not executemany:
+            entry["plan"] = _explain(conn, statement, parameters)
+        print("Slow query: " + json.dumps(entry, default=str))
+
+    def error(context):
+        stack = context.connection.info.get("slow_query_t0") if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+    event.listen(eng, "before_cursor_execute", before)
+    event.listen(eng, "after_cursor_execute", after)
+    event.listen(eng, "handle_error", error)
+
+
+if SLOW_QUERY_MS > 0:
+    for _name, _eng in [("sync", engine), ("async", async_engine.sync_engine)] + \
+            [(r.name, r.engine) for r in read_replicas]:
+        _log_slow_queries(_name, _eng)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Current pool usage and checkout wait times of every engine (this worker)."""
+    out = {}
+    engines = [("sync", engine, sync_pool_waits), ("async", async_engine.sync_engine, async_pool_waits)]
+    engines += [(r.name, r.engine, r.waits) for r in read_replicas]
+    for name, eng, waits in engines:
+        pool = eng.pool
+        info: Dict[str, Any] = {"pool": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            info.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(),
+                        checked_in=pool.checkedin())
+        info.update(waits.as_dict())
+        out[name] = info
+    for r in read_replicas:
+        out[r.name].update(healthy=r.healthy, lag_s=r.lag, error=r.error)
+    return out
+
 
 def get_db():
     db = SessionLocal()
@@ -23,3 +395,29 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_read_db():
+    """:func:`get_db` for read-only endpoints: a replica session when one is configured and healthy."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def ping() -> None:
+    """Round trip to the database through the sync engine (readiness check)."""
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+async def aping() -> None:
+    """Same as :func:`ping` through the async engine."""
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
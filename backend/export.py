@@ -0,0 +1,182 @@
+"""Streaming bulk export of feedback as NDJSON, CSV or Parquet.
+
+Rows are read through a server-side cursor (``yield_per``) and written out in
+chunks of ``EXPORT_CHUNK_ROWS`` rows, so memory stays flat whatever the number
+of exported rows. The ``ratings`` JSON is flattened into one ``rating:<label>``
+column per known criterion label (value 1-4, empty when the criterion was not
+rated), the same columns whatever the filters.
+
+Parquet needs ``pyarrow`` (optional, ``pip install pyarrow``).
+"""
+import csv
+import io
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import quote
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models
+from .analytics import iter_rating_items
+from .db import ReadSessionLocal
+from .responses import dumps
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "2000"))
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+BASE_COLUMNS = ["id", "created_at", "type", "provider", "sector", "nperf_test_id", "comments", "attachment"]
+RATING_PREFIX = "rating:"
+
+
+def criteria_labels(db: Session) -> List[str]:
+    """Every criterion label of ``rating_labels``, sorted (CSV/Parquet header)."""
+    lb = models.RatingLabel
+    return list(db.scalars(select(lb.label).order_by(lb.label)))
+
+
+def flatten(row: Any) -> Dict[str, Any]:
+    """One export record: the feedback columns plus one key per rated criterion."""
+    attachment = None
+    for entry in row.ratings or []:
+        if isinstance(entry, dict) and isinstance(entry.get("_meta"), dict):
+            attachment = entry["_meta"].get("attachment") or None
+    out = {
+        "id": row.id,
+        "created_at": row.created_at,
+        "type": row.type,
+        "provider": row.provider,
+        "sector": row.sector,
+        "nperf_test_id": row.nperf_test_id,
+        "comments": row.comments,
+        "attachment": attachment,
+    }
+    for label, rating in iter_rating_items(row.ratings):
+        out[RATING_PREFIX + label] = rating
+    return out
+
+
+def iter_records(db: Session, conds: list) -> Iterator[List[Dict[str, Any]]]:
+    """Chunks of flattened records, oldest first, read with a server-side cursor."""
+    fb = models.Feedback
+    stmt = (
+        select(fb.id, fb.created_at, fb.type, fb.provider, fb.sector, fb.nperf_test_id, fb.comments, fb.ratings)
+        .where(*conds)
+        .order_by(fb.id)
+        .execution_options(yield_per=EXPORT_CHUNK_ROWS)  # implies stream_results
+    )
+    for partition in db.execute(stmt).partitions():
+        yield [flatten(row) for row in partition]
+
+
+def _iso(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def ndjson_chunks(chunks: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    for records in chunks:
+        yield b"".join(dumps(r) + b"\n" for r in records)
+
+
+def csv_chunks(chunks: Iterator[List[Dict[str, Any]]], columns: List[str]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    yield buf.getvalue().encode()
+    for records in chunks:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows({k: _iso(v) for k, v in r.items()} for r in records)
+        yield buf.getvalue().encode()
+
+
+class _ChunkSink:
+    """Write-only file object handing out what pyarrow wrote since the last drain."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_chunks(chunks: Iterator[List[Dict[str, Any]]], columns: List[str]) -> Iterator[bytes]:
+    """One Parquet row group per chunk; the footer is written at the end."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    fields = [
+        pa.field("id", pa.int64()),
+        pa.field("created_at", pa.timestamp("us", tz="UTC")),
+    ]
+    fields += [pa.field(c, pa.string()) for c in BASE_COLUMNS[2:]]
+    fields += [pa.field(c, pa.int8()) for c in columns[len(BASE_COLUMNS):]]
+    schema = pa.schema(fields)
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for records in chunks:
+            writer.write_table(pa.Table.from_pylist(records, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream(fmt: str, conds: list) -> Iterator[bytes]:
+    """Response body generator. Owns its session (on a read replica when configured):
+    it outlives the request handler."""
+    with ReadSessionLocal() as db:
+        if fmt == "ndjson":
+            yield from ndjson_chunks(iter_records(db, conds))
+            return
+        columns = BASE_COLUMNS + [RATING_PREFIX + label for label in criteria_labels(db)]
+        if fmt == "csv":
+            yield from csv_chunks(iter_records(db, conds), columns)
+        else:
+            yield from parquet_chunks(iter_records(db, conds), columns)
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def filename(fmt: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> str:
+    span = "_".join(p for p in (start_date, end_date) if p)
+    return f"feedback{'_' + span if span else ''}.{FORMATS[fmt][1]}"
+
+
+def content_disposition(name: str) -> str:
+    """``attachment`` header value for a file name built from query parameters (RFC 6266)."""
+    fallback = re.sub(r"[^A-Za-z0-9._-]", "_", name)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(name, safe='')}"
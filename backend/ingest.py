@@ -0,0 +1,269 @@
+"""Insert helpers and optional write-behind buffering for the ingestion endpoints.
+
+By default (``INGEST_MODE=direct``) every POST inserts and commits its own row.
+With ``INGEST_MODE=buffered``, ``POST /api/feedback`` and ``POST /api/nperf/results``
+only validate the payload, queue it and answer ``202 Accepted``;
+a background task per worker flushes the queue as multi-row INSERTs every
+``INGEST_FLUSH_MS`` milliseconds or ``INGEST_BATCH_SIZE`` rows, whichever comes
+first. The queue is drained on shutdown.
+
+Other settings: ``INGEST_QUEUE_MAX`` (rows waiting before new ones get a 503),
+``INGEST_MAX_BATCH`` (max items accepted by ``POST /api/feedback/batch``).
+
+A batch that the database rejects for its data (``IntegrityError``,
+``DataError``) is split in halves until the bad rows are isolated: the other
+rows are written, each bad row is logged and counted in ``rejected_rows``.
+Other errors (connection lost, timeout) retry the whole batch.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import cache, columnar, live, metrics, models, ratings, rollups, schemas
+from .db import AsyncSessionLocal
+
+INGEST_MODE = os.getenv("INGEST_MODE", "direct").lower()
+INGEST_FLUSH_MS = int(os.getenv("INGEST_FLUSH_MS", "200"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "20000"))
+INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", "5000"))
+
+FLUSH_RETRIES = 3
+_WAKE = object()  # queued by stop() so the runner flushes without waiting for the window
+
+
+def feedback_values(payload: schemas.FeedbackIn) -> Dict[str, Any]:
+    """Column values of a feedback row.
+
+    Comments/attachment are also appended to the ratings list as a ``_meta``
+    entry (analytics skip it); 'attachment' is not a column of models.Feedback.
+    """
+    data = payload.model_dump()  # ensure primitive types for JSON storage
+    ratings = list(data.get("ratings") or [])
+    meta = {"comments": data.get("comments") or "", "attachment": data.get("attachment") or ""}
+    if meta["comments"] or meta["attachment"]:
+        ratings.append({"_meta": meta})
+    return {
+        "type": data["type"],
+        "provider": data["provider"] or "",  # NOT NULL column
+        "ratings": ratings,  # stored as JSON/JSONB
+        "comments": data.get("comments"),
+        "nperf_test_id": data.get("nperf_test_id"),
+        "sector": data.get("sector"),
+    }
+
+
+def nperf_values(payload: schemas.NPerfResultIn) -> Dict[str, Any]:
+    return {
+        "nperf_test_id": payload.nperf_test_id,
+        "external_uuid": payload.external_uuid,
+        "sector": payload.sector,
+    }
+
+
+async def insert_feedbacks(db: AsyncSession, rows: List[Dict[str, Any]]) -> List[models.Feedback]:
+    """Multi-row INSERT ... RETURNING plus the rating rows and rollups; the caller commits."""
+    if not rows:
+        return []
+    fbs = list((await db.scalars(insert(models.Feedback).returning(models.Feedback, sort_by_parameter_order=True), rows)).all())
+    await ratings.arecord(db, fbs)
+    await rollups.arecord(db, fbs)
+    return fbs
+
+
+def _nperf_upsert(dialect: str):
+    """INSERT ... ON CONFLICT (external_uuid, nperf_test_id) DO UPDATE, so that RETURNING gives the stored row."""
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(models.NPerfResult)
+    stmt = dialect_insert(models.NPerfResult)
+    return stmt.on_conflict_do_update(index_elements=["external_uuid", "nperf_test_id"],
+                                      set_={"sector": stmt.excluded.sector})
+
+
+async def insert_nperf_results(db: AsyncSession, rows: List[Dict[str, Any]]) -> List[models.NPerfResult]:
+    """Upsert on (external_uuid, nperf_test_id): a client retry returns the row stored the first time
+    instead of adding a copy. Rows without an external_uuid are always inserted."""
+    if not rows:
+        return []
+    # one statement cannot update the same row twice: keep the last copy of a key within the batch
+    unique: Dict[Any, Dict[str, Any]] = {}
+    for i, row in enumerate(rows):
+        key = (row["external_uuid"], row["nperf_test_id"])
+        unique[key if None not in key else i] = row
+    stmt = _nperf_upsert(db.get_bind().dialect.name)
+    return list((await db.scalars(stmt.returning(models.NPerfResult), list(unique.values()))).all())
+
+
+class IngestBuffer:
+    """In-process queue flushed by one background task as multi-row INSERTs."""
+
+    def __init__(self, name: str, insert_rows: Callable[[AsyncSession, List[Dict[str, Any]]], Awaitable[list]],
+                 batch_size: int = INGEST_BATCH_SIZE, flush_ms: int = INGEST_FLUSH_MS,
+                 max_queue: int = INGEST_QUEUE_MAX, on_flush: Optional[Callable[[list], Awaitable[None]]] = None):
+        self.name = name
+        self.insert_rows = insert_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self.max_queue = max_queue
+        self.on_flush = on_flush
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        # reported by stats()
+        self.accepted = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0  # whole batches given up after FLUSH_RETRIES
+        self.rejected_rows = 0  # single rows refused by the database
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self) -> None:
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self._closed = False
+        self._task = asyncio.get_running_loop().create_task(self._run(), name=f"ingest-{self.name}")
+
+    async def stop(self) -> None:
+        """Stop accepting rows, flush what is queued, then stop the task."""
+        self._closed = True
+        if self._task is None:
+            return
+        await self.queue.put(_WAKE)  # cut the current batch window short
+        await self.queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def submit(self, row: Dict[str, Any]) -> None:
+        """Queue one row; raises ``asyncio.QueueFull`` when the buffer is saturated."""
+        if self._closed or self.queue is None:
+            raise asyncio.QueueFull()
+        self.queue.put_nowait(row)
+        self.accepted += 1
+        metrics.INGEST_QUEUED.labels(self.name).inc()
+        metrics.INGEST_QUEUE_DEPTH.labels(self.name).set(self.queue.qsize())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _WAKE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            rows = [row for row in batch if row is not _WAKE]
+            try:
+                if rows:
+                    await self._flush(rows)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        """Insert a batch, retried on transient errors; rows refused by the database for their data
+        are isolated by bisection (each half is flushed on its own) and dropped alone."""
+        for attempt in range(1, FLUSH_RETRIES + 1):
+            t0 = time.perf_counter()
+            try:
+                async with AsyncSessionLocal() as db:
+                    inserted = await self.insert_rows(db, batch)
+                    await db.commit()
+            except (IntegrityError, DataError) as e:
+                if len(batch) == 1:
+                    self.rejected_rows += 1
+                    metrics.INGEST_FAILED.labels(self.name).inc()
+                    print(f"Ingest: {self.name} row rejected by the database and dropped: {batch[0]!r}: {e.orig}")
+                    return
+                middle = len(batch) // 2
+                await self._flush(batch[:middle])
+                await self._flush(batch[middle:])
+                return
+            except Exception as e:
+                print(f"Ingest flush of {len(batch)} {self.name} rows failed (attempt {attempt}): {e}")
+                if attempt < FLUSH_RETRIES:
+                    await asyncio.sleep(0.5 * attempt)
+                    continue
+                self.failed_rows += len(batch)
+                metrics.INGEST_FAILED.labels(self.name).inc(len(batch))
+                return
+            elapsed = (time.perf_counter() - t0) * 1000
+            metrics.INGEST_ROWS.labels(self.name).inc(len(batch))
+            metrics.INGEST_FLUSH_TIME.labels(self.name).observe(elapsed / 1000)
+            metrics.INGEST_QUEUE_DEPTH.labels(self.name).set(self.queue.qsize())
+            self.batches += 1
+            self.flushed_rows += len(batch)
+            self.last_batch_size = len(batch)
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self._total_flush_ms += elapsed
+            if self.on_flush is not None:
+                await self.on_flush(inserted)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "accepted": self.accepted,
+            "flushed_rows": self.flushed_rows,
+            "failed_rows": self.failed_rows,
+            "rejected_rows": self.rejected_rows,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "avg_batch_size": round(self.flushed_rows / self.batches, 1) if self.batches else 0,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / self.batches, 2) if self.batches else 0,
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
+
+
+async def feedbacks_committed(fbs: List[models.Feedback]) -> None:
+    """After a commit of new feedbacks: fresh analytics for the next reads, deltas to live dashboards."""
+    columnar.append(fbs)
+    await cache.ainvalidate()
+    await live.publish_feedbacks(fbs)
+
+
+buffered = INGEST_MODE == "buffered"
+feedback_buffer = IngestBuffer("feedback", insert_feedbacks, on_flush=feedbacks_committed)
+nperf_buffer = IngestBuffer("nperf", insert_nperf_results)
+
+
+async def start() -> None:
+    if buffered:
+        feedback_buffer.start()
+        nperf_buffer.start()
+
+
+async def stop() -> None:
+    if buffered:
+        await feedback_buffer.stop()
+        await nperf_buffer.stop()
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "mode": INGEST_MODE,
+        "flush_ms": INGEST_FLUSH_MS,
+        "batch_size": INGEST_BATCH_SIZE,
+        "feedback": feedback_buffer.stats(),
+        "nperf": nperf_buffer.stats(),
+    }
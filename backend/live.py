@@ -0,0 +1,245 @@
+"""Live dashboard updates: ``GET /api/analytics/stream`` (Server-Sent Events).
+
+Every committed batch of feedbacks is turned into its rollup increments
+(:func:`backend.rollups.rollup_rows`, the rows just added to
+``feedback_rollups``) and published once as a ``delta`` event; each open
+dashboard adds them to the panels it shows, after applying its own filters.
+A write costs O(new feedbacks), whatever the number of viewers, and viewers
+no longer recompute the whole dashboard to see it.
+
+One broadcaster per worker fans each event out to the streams of that worker,
+encoded once. Each stream has a bounded queue: a viewer that falls behind gets
+a ``resync`` event and reloads the dashboard instead of slowing the others.
+
+Configuration (environment):
+- ``LIVE_BROKER``: ``memory`` (default, events stay in the worker that
+  committed them), ``redis`` (all workers and replicas; uses ``REDIS_URL``)
+  or ``off``. ``memory`` is turned off when ``WORKERS`` (or
+  ``WEB_CONCURRENCY``) is above 1: a viewer would only see the feedback of its
+  own worker. The dashboard then polls instead, and also reloads every few
+  minutes while streaming.
+- ``LIVE_QUEUE_SIZE`` (events buffered per viewer, 100), ``LIVE_HEARTBEAT``
+  (seconds between keep-alive comments, 15), ``LIVE_MAX_CLIENTS`` (streams per
+  worker, 1000, then 503).
+- ``LIVE_MAX_AGE``: seconds after which a stream ends (600); the browser
+  reconnects, possibly to another worker.
+
+uvicorn waits for open responses before it runs the shutdown handlers, so the
+streams are ended as soon as the server receives SIGTERM/SIGINT.
+"""
+import asyncio
+import os
+import signal
+import threading
+from typing import Any, AsyncIterator, Iterable, Optional, Set
+
+from fastapi import HTTPException
+from starlette.responses import StreamingResponse
+
+from . import metrics, rollups
+from .responses import dumps
+
+LIVE_BROKER = os.getenv("LIVE_BROKER", "memory").lower()
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "100"))
+LIVE_HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT", "15"))
+LIVE_MAX_CLIENTS = int(os.getenv("LIVE_MAX_CLIENTS", "1000"))
+LIVE_MAX_AGE = float(os.getenv("LIVE_MAX_AGE", "600"))
+REDIS_CHANNEL = "artci:live"
+# uvicorn --workers (WEB_CONCURRENCY is its default, the image passes WORKERS)
+WORKERS = int(os.getenv("WEB_CONCURRENCY") or os.getenv("WORKERS") or "1")
+
+RETRY_MS = 3000  # EventSource reconnection delay
+HEARTBEAT = b": ping\n\n"
+RESYNC = b"event: resync\ndata: {}\n\n"
+_CLOSE = object()  # queued by stop(): the stream ends
+
+
+def frame(event: str, data: Any) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+class Broadcaster:
+    """Fan-out of encoded events to the streams of this worker."""
+
+    def __init__(self, queue_size: int = LIVE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._queues: Set[asyncio.Queue] = set()
+
+    @property
+    def clients(self) -> int:
+        return len(self._queues)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._queues.add(queue)
+        metrics.LIVE_CLIENTS.inc()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        if queue in self._queues:
+            self._queues.discard(queue)
+            metrics.LIVE_CLIENTS.dec()
+
+    def deliver(self, data: bytes) -> None:
+        for queue in list(self._queues):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                # the viewer missed events: drop its backlog, it reloads instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+                metrics.LIVE_RESYNCS.inc()
+
+    def close_all(self) -> None:
+        for queue in list(self._queues):
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(_CLOSE)
+
+
+class MemoryBroker:
+    """Events reach the streams of the committing worker only."""
+
+    def __init__(self, broadcaster: Broadcaster):
+        self.broadcaster = broadcaster
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, data: bytes) -> None:
+        self.broadcaster.deliver(data)
+
+
+class RedisBroker:
+    """Events go through a Redis channel; one subscriber task per worker delivers them locally."""
+
+    def __init__(self, broadcaster: Broadcaster, url: str, channel: str = REDIS_CHANNEL):
+        import redis.asyncio  # only needed when this broker is selected
+
+        self.broadcaster = broadcaster
+        self.channel = channel
+        self.client = redis.asyncio.Redis.from_url(url)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._listen(), name="live-redis")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.client.aclose()
+
+    async def publish(self, data: bytes) -> None:
+        await self.client.publish(self.channel, data)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self.client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.broadcaster.deliver(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Live updates: Redis subscription lost ({e}), retrying")
+                # events published meanwhile are lost: every viewer reloads
+                self.broadcaster.deliver(RESYNC)
+                await asyncio.sleep(1)
+
+
+broadcaster = Broadcaster()
+broker: Any = None
+if LIVE_BROKER == "redis":
+    broker = RedisBroker(broadcaster, os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+elif LIVE_BROKER == "memory" and WORKERS > 1:
+    print(f"Live updates disabled: LIVE_BROKER=memory with {WORKERS} workers, set LIVE_BROKER=redis")
+elif LIVE_BROKER != "off":
+    broker = MemoryBroker(broadcaster)
+
+
+def _end_streams_on_exit() -> None:
+    """Chain the server's SIGTERM/SIGINT handlers: streams end when shutdown begins."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(broadcaster.close_all)
+            previous(signum, frame)
+
+        signal.signal(sig, handler)
+
+
+async def start() -> None:
+    if broker is not None:
+        await broker.start()
+        _end_streams_on_exit()
+
+
+async def stop() -> None:
+    """End the streams still open, then the broker."""
+    broadcaster.close_all()
+    if broker is not None:
+        await broker.stop()
+
+
+async def publish_feedbacks(feedbacks: Iterable[Any]) -> None:
+    """Publish the rollup increments of committed feedbacks (never fails the write)."""
+    if broker is None or (isinstance(broker, MemoryBroker) and not broadcaster.clients):
+        return
+    rows = rollups.rollup_rows(feedbacks)
+    if not rows:
+        return
+    try:
+        await broker.publish(frame("delta", {"rows": rows}))
+        metrics.LIVE_EVENTS.inc()
+    except Exception as e:
+        print(f"Live updates: publish failed: {e}")
+
+
+async def _events(queue: asyncio.Queue) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LIVE_MAX_AGE
+    try:
+        yield f"retry: {RETRY_MS}\n: connected\n\n".encode()
+        while True:
+            timeout = min(LIVE_HEARTBEAT, deadline - loop.time())
+            if timeout <= 0:
+                return
+            try:
+                data = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                data = HEARTBEAT  # keeps proxies from closing an idle connection
+            if data is _CLOSE:
+                return
+            yield data
+    finally:
+        broadcaster.unsubscribe(queue)
+
+
+def response() -> StreamingResponse:
+    if broker is None:
+        raise HTTPException(status_code=404, detail="Live updates are disabled")
+    if broadcaster.clients >= LIVE_MAX_CLIENTS:
+        raise HTTPException(status_code=503, detail="Too many live viewers", headers={"Retry-After": "30"})
+    # subscribed before the response starts: no event is missed in between
+    queue = broadcaster.subscribe()
+    return StreamingResponse(_events(queue), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # nginx: do not buffer the stream
+    })
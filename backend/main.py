@@ -1,183 +1,269 @@
+import asyncio
 import os
-from datetime import datetime, timedelta
-from collections import Counter, defaultdict
-from typing import List, Dict, Any, Optional
+from datetime import timedelta
+from typing import List, Dict, Any, Literal, Optional
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from starlette.responses import FileResponse
-from starlette.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
 
-from .db import get_db, Base, engine
-from . import models, schemas
+from .db import (aping, get_db, get_async_db, get_read_db, ping, pool_stats, start_replica_checks,
+                 stop_replica_checks)
+from . import (admission, analytics, attachments, cache, columnar, export, ingest, live, metrics, migrate, models,
+               pagination, partitions, profiling, responses, schemas, static, uploads)
 
-# Create tables on startup (simple bootstrap; for production prefer migrations)
+# Schema changes go through backend.migrate, run once before the workers start
+# (see the Dockerfile); AUTO_MIGRATE keeps `uvicorn --reload` working locally.
 try:
     if os.getenv("RESET_DB_ON_STARTUP", "").lower() == "true":
         print("WARNING: RESET_DB_ON_STARTUP is true. Dropping all tables...")
-        Base.metadata.drop_all(bind=engine)
-        
-    Base.metadata.create_all(bind=engine)
+        migrate.reset()
+    if os.getenv("AUTO_MIGRATE", "true").lower() == "true":
+        migrate.upgrade()
 except Exception as e:
-    # Ignorer l'erreur si c'est une 'UniqueViolation' due à une race condition entre workers
-    print(f"Schema creation warning (safe to ignore if multiple workers): {e}")
+    print(f"Schema migration warning: {e}")
 
-app = FastAPI(title="ARTCI Feedback API")
+app = FastAPI(title="ARTCI Feedback API", default_response_class=responses.JSONResponse)
+if profiling.enabled:
+    # before the routes are declared: sync endpoints report their thread to the profiler
+    app.router.route_class = profiling.ProfiledRoute
 
 # If you plan to serve the UI from the same app, CORS can be strict.
 # If UI may be served from another origin, adjust origins below.
+# innermost: refusals still get the CORS headers, so browsers can read the 429/503
+app.add_middleware(admission.AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # tighten in production
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "Retry-After"],
 )
+app.add_middleware(metrics.MetricsMiddleware)  # outermost (but for the profiler): also times CORS preflights
+if profiling.enabled:
+    app.add_middleware(profiling.ProfilingMiddleware)  # a profiled request is still counted by the metrics
+
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "2"))  # seconds per database check
 
 
 @app.get("/api/health")
 def health() -> Dict[str, str]:
+    """Liveness: the worker answers (no dependency checked)."""
     return {"status": "ok"}
 
 
+@app.get("/api/health/ready")
+async def ready() -> JSONResponse:
+    """Readiness: both engines can run a query; 503 takes the pod out of the load balancer."""
+    checks = {}
+    for name, check in (("db", lambda: run_in_threadpool(ping)), ("db_async", aping)):
+        try:
+            await asyncio.wait_for(check(), READY_TIMEOUT)
+            checks[name] = "ok"
+        except Exception as e:
+            checks[name] = f"error: {type(e).__name__}"
+    ok = all(v == "ok" for v in checks.values())
+    return JSONResponse(status_code=200 if ok else 503, content={"status": "ok" if ok else "unavailable", **checks})
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics() -> Response:
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+
+@app.on_event("startup")
+async def start_background():
+    await start_replica_checks()
+    await ingest.start()
+    await live.start()
+    await partitions.start()
+    await columnar.start()
+    await attachments.start(UPLOAD_DIR)
+
+
+@app.on_event("shutdown")
+async def stop_background():
+    # flush whatever is still buffered before the worker exits
+    await ingest.stop()
+    await live.stop()
+    await partitions.stop()
+    await columnar.stop()
+    await attachments.stop()
+    await admission.stop()
+    await stop_replica_checks()
+    metrics.shutdown()
+
+
+def _queued(buffer: ingest.IngestBuffer, row: Dict[str, Any]) -> JSONResponse:
+    try:
+        buffer.submit(row)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Ingestion queue is full, retry later",
+                            headers={"Retry-After": "1"})
+    return JSONResponse(status_code=202, content={"status": "queued"})
+
+
 @app.post("/api/feedback", response_model=schemas.FeedbackOut)
-def create_feedback(payload: schemas.FeedbackIn, db: Session = Depends(get_db)):
-    data = payload.model_dump()  # ensure primitive types for JSON storage
-    # Extract ratings and meta if needed, but since we have new columns, let's just map them.
-    # The 'ratings' column expects the list of dicts.
-    # We want to pass everything that matches the model.
-    
-    # We can handle the ratings/meta processing if still needed for the 'ratings' column structure.
-    # The original code appended meta to ratings list. We should preserve that behavior if it's important for analytics.
-    ratings = list(data.get("ratings") or [])
-    meta = {"comments": data.get("comments") or "", "attachment": data.get("attachment") or ""}
-    if meta["comments"] or meta["attachment"]:
-        ratings.append({"_meta": meta})
-    
-    # Update data['ratings'] with the modified list
-    data['ratings'] = ratings
-    
-    # Now create the object using unpacking. 
-    # Warning: payload.model_dump() includes 'comments'/'attachment' which are NOT in models.Feedback (unless I added them, which I didn't verify if I should have). 
-    # Ah, I added 'comments' in my previous edit to models.py? 
-    # Let me check my thought process... I said "I will also add comments column". 
-    # Wait, in the actual tool call for models.py (Step 161), I DID add `comments = Column(String, nullable=True)`.
-    # So 'comments' IS in the model now. 
-    # 'attachment' was NOT added to the model in Step 161.
-    # So if I pass 'attachment' to Feedback(**data), it will crash if using **data directly.
-    
-    # Safest bet: Explicit mapping for safety + preservation of original logic.
-    fb = models.Feedback(
-        type=data["type"],
-        provider=data["provider"],
-        ratings=ratings,  # stored as JSON/JSONB
-        comments=data.get("comments"), # Now exists in model
-        nperf_test_id=data.get("nperf_test_id"),
-        sector=data.get("sector")
-    )
-    db.add(fb)
-    db.commit()
-    db.refresh(fb)
+async def create_feedback(payload: schemas.FeedbackIn, db: AsyncSession = Depends(get_async_db)):
+    row = ingest.feedback_values(payload)
+    if ingest.buffered:
+        return _queued(ingest.feedback_buffer, row)
+    # RETURNING gives back id/created_at without a refresh round trip;
+    # the rollups are updated in the same transaction.
+    fb = (await ingest.insert_feedbacks(db, [row]))[0]
+    await db.commit()
+    metrics.INGEST_ROWS.labels("feedback").inc()
+    await ingest.feedbacks_committed([fb])
     return fb # Return the db object, Pydantic handles serialization
 
 
+@app.post("/api/feedback/batch")
+async def create_feedback_batch(payload: List[schemas.FeedbackIn], db: AsyncSession = Depends(get_async_db)) -> Dict[str, Any]:
+    """Bulk upload (e.g. offline backlog of a field-collection app) in one transaction."""
+    if len(payload) > ingest.INGEST_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {ingest.INGEST_MAX_BATCH} feedbacks per batch")
+    fbs = await ingest.insert_feedbacks(db, [ingest.feedback_values(p) for p in payload])
+    await db.commit()
+    metrics.INGEST_ROWS.labels("feedback").inc(len(fbs))
+    await ingest.feedbacks_committed(fbs)
+    return {"inserted": len(fbs), "ids": [fb.id for fb in fbs]}
+
+
 @app.post("/api/nperf/results", response_model=schemas.NPerfResultOut)
-def create_nperf_result(payload: schemas.NPerfResultIn, db: Session = Depends(get_db)):
-    db_obj = models.NPerfResult(
-        nperf_test_id=payload.nperf_test_id,
-        external_uuid=payload.external_uuid,
-        sector=payload.sector
-    )
-    db.add(db_obj)
-    db.commit()
-    db.refresh(db_obj)
+async def create_nperf_result(payload: schemas.NPerfResultIn, db: AsyncSession = Depends(get_async_db)):
+    row = ingest.nperf_values(payload)
+    if ingest.buffered:
+        return _queued(ingest.nperf_buffer, row)
+    db_obj = (await ingest.insert_nperf_results(db, [row]))[0]
+    await db.commit()
+    metrics.INGEST_ROWS.labels("nperf").inc()
     return db_obj
 
 
+@app.get("/api/db/pool")
+def db_pool_stats() -> Dict[str, Any]:
+    """Connection pool usage and checkout wait statistics (this worker)."""
+    return pool_stats()
+
+
+@app.get("/api/ingest/stats")
+def ingest_stats() -> Dict[str, Any]:
+    """Queue depth, batch sizes and flush latency of the ingestion buffers (this worker)."""
+    return ingest.stats()
+
+
+@app.get("/api/admission/stats")
+def admission_stats() -> Dict[str, Any]:
+    """Rate limits, concurrency caps and refused requests of the write endpoints (this worker)."""
+    return admission.stats()
+
+
 @app.get("/api/nperf/results", response_model=Dict[str, Any])
 def list_nperf_results(
     page: int = 1,
     limit: int = 50,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    db: Session = Depends(get_db)
+    sector: Optional[str] = None,
+    nperf_test_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    total: Literal["exact", "estimate", "none"] = "exact",
+    db: Session = Depends(get_read_db)
 ):
-    query = db.query(models.NPerfResult)
-
-    if start_date:
-        try:
-            start_dt = datetime.fromisoformat(start_date)
-            query = query.filter(models.NPerfResult.created_at >= start_dt)
-        except ValueError:
-            pass
-    if end_date:
-        try:
-            end_dt = datetime.fromisoformat(end_date)
-            # inclusive end date
-            query = query.filter(models.NPerfResult.created_at <= end_dt + timedelta(days=1))
-        except ValueError:
-            pass
-
-    total = query.count()
-    
-    # Pagination
-    offset = (page - 1) * limit
-    results = query.order_by(models.NPerfResult.created_at.desc()).offset(offset).limit(limit).all()
-
-    return {
-        "items": [schemas.NPerfResultOut.from_orm(r) for r in results],
-        "total": total,
+    """Newest results first. Pass ``cursor`` (the previous ``next_cursor``) for
+    keyset pagination; ``page`` (OFFSET) is kept for older clients."""
+    model = models.NPerfResult
+    conds = []
+    start_dt = analytics.parse_date(start_date)
+    end_dt = analytics.parse_date(end_date)
+    if start_dt:
+        conds.append(model.created_at >= start_dt)
+    if end_dt:
+        conds.append(model.created_at <= end_dt + timedelta(days=1))  # inclusive end date
+    if sector:
+        conds.append(model.sector == sector)
+    if nperf_test_id:
+        conds.append(model.nperf_test_id == nperf_test_id)
+
+    if cursor or page <= 1:
+        results, next_cursor = pagination.keyset_page(db, model, conds, limit, cursor)
+    else:
+        offset = (page - 1) * limit
+        results = db.scalars(
+            select(model).where(*conds).order_by(*pagination.newest_first(db, model)).offset(offset).limit(limit)
+        ).all()
+        next_cursor = pagination.encode_cursor(results[-1].created_at, results[-1].id) if len(results) == limit else None
+
+    return responses.trusted({
+        "items": [responses.fields(schemas.NPerfResultOut, r) for r in results],
+        "total": pagination.count_rows(db, model, conds, total),
         "page": page,
-        "limit": limit
-    }
-
-
-from sqlalchemy import text
+        "limit": limit,
+        "next_cursor": next_cursor,
+    })
 
 
 @app.post("/api/admin/update-schema")
-def update_schema(db: Session = Depends(get_db)):
-    """Temporary endpoint to manually update the database schema for feedbacks table"""
+def update_schema() -> Dict[str, Any]:
+    """Apply pending schema migrations (same as ``python -m backend.migrate``)."""
     try:
-        # PostgreSQL syntax to add columns if not exists
-        # Note: SQLite does not support IF NOT EXISTS in ADD COLUMN in older versions, 
-        # but modern Postgres does.
-        # We'll use a brute-force approach with try/except blocks for broad compatibility or specific syntax.
-        
-        # Adding nperf_test_id
-        try:
-            db.execute(text("ALTER TABLE feedbacks ADD COLUMN nperf_test_id VARCHAR(255)"))
-        except Exception as e:
-            # Likely already exists
-            print(f"Column nperf_test_id might already exist: {e}")
-            db.rollback()
-
-        # Adding sector
-        try:
-            db.execute(text("ALTER TABLE feedbacks ADD COLUMN sector VARCHAR(255)"))
-        except Exception as e:
-            print(f"Column sector might already exist: {e}")
-            db.rollback()
-
-        # Adding comments
-        try:
-            db.execute(text("ALTER TABLE feedbacks ADD COLUMN comments VARCHAR"))
-        except Exception as e:
-             print(f"Column comments might already exist: {e}")
-             db.rollback()
-             
-        db.commit()
-        return {"status": "Schema update attempted"}
+        applied = migrate.upgrade()
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "Schema up to date", "applied": applied}
 
 
 @app.get("/api/feedback", response_model=List[schemas.FeedbackOut])
-def list_feedback(limit: int = 50, db: Session = Depends(get_db)):
-    q = db.query(models.Feedback).order_by(models.Feedback.created_at.desc()).limit(limit)
-    return [schemas.FeedbackOut.from_orm(i) for i in q.all()]
+def list_feedback(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    type: Optional[str] = None,
+    provider: Optional[str] = None,
+    sector: Optional[str] = None,
+    nperf_test_id: Optional[str] = None,
+    total: Literal["exact", "estimate", "none"] = "none",
+    db: Session = Depends(get_read_db),
+):
+    """Newest feedback first. The cursor of the next page is returned in the
+    ``X-Next-Cursor`` header (absent on the last page), the total in
+    ``X-Total-Count`` when requested."""
+    conds = analytics.feedback_conditions(start_date, end_date, type, provider, sector_filter=sector)
+    if nperf_test_id:
+        conds.append(models.Feedback.nperf_test_id == nperf_test_id)
+    items, next_cursor = pagination.keyset_page(db, models.Feedback, conds, limit, cursor)
+    headers = {}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    count = pagination.count_rows(db, models.Feedback, conds, total)
+    if count is not None:
+        headers["X-Total-Count"] = str(count)
+    return responses.trusted([responses.fields(schemas.FeedbackOut, i) for i in items], headers=headers)
+
+
+@app.get("/api/feedback/export")
+def export_feedback(
+    format: Literal["ndjson", "csv", "parquet"] = "ndjson",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    type: Optional[str] = None,
+    provider: Optional[str] = None,
+    sector: Optional[str] = None,
+):
+    """Stream every matching feedback (oldest first) with one column per rated criterion."""
+    if format == "parquet" and not export.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow")
+    conds = analytics.feedback_conditions(start_date, end_date, type, provider, sector_filter=sector)
+    media_type = export.FORMATS[format][0]
+    headers = {"Content-Disposition": export.content_disposition(export.filename(format, start_date, end_date))}
+    return StreamingResponse(export.stream(format, conds), media_type=media_type, headers=headers)
 
 
 @app.get("/api/feedback/{feedback_id}", response_model=schemas.FeedbackOut)
@@ -185,59 +271,28 @@ def get_feedback(feedback_id: int, db: Session = Depends(get_db)):
     fb = db.get(models.Feedback, feedback_id)
     if not fb:
         raise HTTPException(status_code=404, detail="Feedback not found")
-    return schemas.FeedbackOut.from_orm(fb)
+    return responses.trusted(responses.fields(schemas.FeedbackOut, fb))
 
 
 # -----------------------------
 # Analytics endpoints
 # -----------------------------
 
-def _iter_rating_items(ratings: List[Dict[str, Any]]):
-    """Yield tuples (label, rating_value_as_int) from stored ratings array."""
-    for entry in ratings or []:
-        if not isinstance(entry, dict):
-            continue
-        # each entry like {"crit-1": {"label": ..., "sublabel": ..., "rating": "2"}}
-        for _key, val in entry.items():
-            try:
-                label = (val.get("label") or "").strip()
-                rating_str = (val.get("rating") or "").strip()
-                if not label or rating_str not in {"1", "2", "3", "4"}:
-                    continue
-                yield label, int(rating_str)
-            except Exception:
-                continue
-
-
-def _filter_rows(rows: List[models.Feedback], start_date: Optional[str], end_date: Optional[str],
-                 type_filter: Optional[str], provider_filter: Optional[str]) -> List[models.Feedback]:
-    """Filter feedback rows according to optional query params.
-    Dates should be in YYYY-MM-DD.
-    """
-    def parse_date(s: Optional[str]) -> Optional[datetime]:
-        if not s:
-            return None
-        try:
-            return datetime.fromisoformat(s)
-        except Exception:
-            return None
-
-    start_dt = parse_date(start_date)
-    end_dt = parse_date(end_date)
-
-    out: List[models.Feedback] = []
-    for r in rows:
-        if type_filter and r.type != type_filter:
-            continue
-        if provider_filter and r.provider != provider_filter:
-            continue
-        ts = r.created_at
-        if start_dt and ts and ts < start_dt:
-            continue
-        if end_dt and ts and ts > end_dt + timedelta(days=1):  # inclusive end date
-            continue
-        out.append(r)
-    return out
+@app.get("/api/analytics/cache")
+def analytics_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of the analytics response cache (this worker)."""
+    return cache.stats()
+
+
+@app.get("/api/analytics/engine")
+def analytics_engine_stats() -> Dict[str, Any]:
+    """Engine answering the dashboard endpoints (this worker): ``sql`` or the in-memory ``numpy`` columns."""
+    return responses.trusted(columnar.stats())
+
+
+def _engine():
+    """The columnar store once loaded (ANALYTICS_ENGINE=numpy), else the SQL rollups; same functions."""
+    return columnar.store or analytics
 
 
 @app.get("/api/analytics/summary")
@@ -246,27 +301,11 @@ def analytics_summary(
     end_date: Optional[str] = None,
     type: Optional[str] = None,  # fixe/mobile
     provider: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ) -> Dict[str, Any]:
-    rows = db.query(models.Feedback).all()
-    rows = _filter_rows(rows, start_date, end_date, type, provider)
-
-    total_fb = len(rows)
-    by_type = Counter([r.type for r in rows])
-    by_provider = Counter([r.provider for r in rows])
-
-    # rating distribution across all selected criteria in all feedbacks
-    dist = Counter()
-    for r in rows:
-        for _label, rating in _iter_rating_items(r.ratings):
-            dist[str(rating)] += 1
-
-    return {
-        "total_feedback": total_fb,
-        "by_type": dict(by_type),
-        "by_provider": dict(by_provider),
-        "rating_distribution": {k: dist.get(k, 0) for k in ["1", "2", "3", "4"]},
-    }
+    return responses.trusted(cache.cached(
+        "summary", lambda: _engine().summary(db, start_date, end_date, type, provider),
+        start_date, end_date, type, provider))
 
 
 @app.get("/api/analytics/criteria")
@@ -275,32 +314,11 @@ def analytics_criteria(
     end_date: Optional[str] = None,
     type: Optional[str] = None,
     provider: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ) -> List[Dict[str, Any]]:
-    rows = db.query(models.Feedback).all()
-    rows = _filter_rows(rows, start_date, end_date, type, provider)
-    sums = defaultdict(int)
-    counts = defaultdict(int)
-    dist = defaultdict(lambda: Counter())
-
-    for r in rows:
-        for label, rating in _iter_rating_items(r.ratings):
-            sums[label] += rating
-            counts[label] += 1
-            dist[label][str(rating)] += 1
-
-    result = []
-    for label in sorted(counts.keys()):
-        c = counts[label]
-        s = sums[label]
-        avg = (s / c) if c else 0.0
-        result.append({
-            "label": label,
-            "count": c,
-            "avg": round(avg, 2),
-            "distribution": {k: dist[label].get(k, 0) for k in ["1", "2", "3", "4"]},
-        })
-    return result
+    return responses.trusted(cache.cached(
+        "criteria", lambda: _engine().criteria(db, start_date, end_date, type, provider),
+        start_date, end_date, type, provider))
 
 
 @app.get("/api/analytics/time_series")
@@ -310,34 +328,15 @@ def analytics_time_series(
     end_date: Optional[str] = None,
     type: Optional[str] = None,
     provider: Optional[str] = None,
-    db: Session = Depends(get_db),
+    shape: Literal["rows", "columns"] = "rows",
+    db: Session = Depends(get_read_db),
 ) -> List[Dict[str, Any]]:
-    # gather rows in the last N days and bucket by date (YYYY-MM-DD)
-    now = datetime.utcnow()
-    since = now - timedelta(days=max(1, days))
-    rows = db.query(models.Feedback).all()
-    rows = _filter_rows(rows, start_date, end_date, type, provider)
-
-    buckets = Counter()
-    for r in rows:
-        ts = r.created_at
-        if ts is None:
-            continue
-        # normalize to date string in UTC
-        try:
-            d = ts.date() if hasattr(ts, 'date') else datetime.fromisoformat(str(ts)).date()
-        except Exception:
-            continue
-        if d >= since.date():
-            buckets[str(d)] += 1
-
-    # ensure all days present
-    out = []
-    for i in range(max(1, days)):
-        d = (since + timedelta(days=i+1)).date()  # up to today roughly
-        key = str(d)
-        out.append({"date": key, "count": buckets.get(key, 0)})
-    return out
+    """Feedback count per day (YYYY-MM-DD) over the last N days.
+    ``shape=columns`` returns ``{"date": [...], "count": [...]}``."""
+    rows = cache.cached("time_series",
+                        lambda: _engine().time_series(db, days, start_date, end_date, type, provider),
+                        start_date, end_date, type, provider, days)
+    return responses.trusted(analytics.to_columns(rows, analytics.TIME_SERIES_KEYS) if shape == "columns" else rows)
 
 
 @app.get("/api/analytics/heatmap")
@@ -346,27 +345,12 @@ def analytics_heatmap(
     end_date: Optional[str] = None,
     type: Optional[str] = None,
     provider: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ) -> List[Dict[str, int]]:
     """Return counts bucketed by weekday (0=Mon) and hour (0-23)."""
-    rows = db.query(models.Feedback).all()
-    rows = _filter_rows(rows, start_date, end_date, type, provider)
-    grid = Counter()  # key=(weekday, hour)
-    for r in rows:
-        ts = r.created_at
-        if not ts:
-            continue
-        try:
-            wd = ts.weekday()  # 0..6, Monday=0
-            hr = ts.hour
-            grid[(wd, hr)] += 1
-        except Exception:
-            continue
-    out: List[Dict[str, int]] = []
-    for wd in range(7):
-        for hr in range(24):
-            out.append({"weekday": wd, "hour": hr, "count": grid.get((wd, hr), 0)})
-    return out
+    return responses.trusted(cache.cached(
+        "heatmap", lambda: _engine().heatmap(db, start_date, end_date, type, provider),
+        start_date, end_date, type, provider))
 
 
 @app.get("/api/analytics/criteria_over_time")
@@ -376,46 +360,69 @@ def analytics_criteria_over_time(
     end_date: Optional[str] = None,
     type: Optional[str] = None,
     provider: Optional[str] = None,
-    db: Session = Depends(get_db),
+    shape: Literal["rows", "columns"] = "rows",
+    db: Session = Depends(get_read_db),
 ) -> List[Dict[str, Any]]:
     """Average rating per criterion per day for the given window.
-    Returns a flat list of rows: {date, label, avg}
+    Returns a flat list of rows: {date, label, avg, count, sum} (count and sum
+    of the ratings behind the average); ``shape=columns`` returns parallel
+    arrays instead: {"date": [...], "label": [...], "avg": [...], ...}
     """
-    now = datetime.utcnow()
-    since = now - timedelta(days=max(1, days))
-    rows = db.query(models.Feedback).all()
-    rows = _filter_rows(rows, start_date, end_date, type, provider)
-
-    # Aggregate sums and counts by date, label
-    sums: Dict[tuple, int] = defaultdict(int)
-    counts: Dict[tuple, int] = defaultdict(int)
-    for r in rows:
-        ts = r.created_at
-        if not ts:
-            continue
-        try:
-            d = ts.date() if hasattr(ts, 'date') else datetime.fromisoformat(str(ts)).date()
-        except Exception:
-            continue
-        if d < since.date():
-            continue
-        for label, rating in _iter_rating_items(r.ratings):
-            key = (str(d), label)
-            sums[key] += rating
-            counts[key] += 1
-
-    # Build output for each day in window and every label seen
-    labels = sorted({lbl for (_d, lbl) in counts.keys()})
-    out: List[Dict[str, Any]] = []
-    for i in range(max(1, days)):
-        d = (since + timedelta(days=i+1)).date()
-        d_str = str(d)
-        for lbl in labels:
-            c = counts.get((d_str, lbl), 0)
-            s = sums.get((d_str, lbl), 0)
-            avg = (s / c) if c else 0.0
-            out.append({"date": d_str, "label": lbl, "avg": round(avg, 2)})
-    return out
+    rows = cache.cached("criteria_over_time",
+                        lambda: _engine().criteria_over_time(db, days, start_date, end_date, type, provider),
+                        start_date, end_date, type, provider, days)
+    if shape == "columns":
+        return responses.trusted(analytics.to_columns(rows, analytics.CRITERIA_OVER_TIME_KEYS))
+    return responses.trusted(rows)
+
+
+@app.get("/api/analytics/dashboard")
+def analytics_dashboard(
+    days: int = 30,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    type: Optional[str] = None,
+    provider: Optional[str] = None,
+    shape: Literal["rows", "columns"] = "rows",
+    db: Session = Depends(get_read_db),
+) -> Dict[str, Any]:
+    """All dashboard panels (summary, criteria, time_series, heatmap,
+    criteria_over_time) computed from one pass over the rollups.
+    ``shape=columns`` applies to time_series and criteria_over_time."""
+    panels = cache.cached("dashboard", lambda: _engine().dashboard(db, days, start_date, end_date, type, provider),
+                          start_date, end_date, type, provider, days)
+    if shape == "columns":
+        # a new dict: the in-process cache hands out the stored object
+        panels = dict(panels,
+                      time_series=analytics.to_columns(panels["time_series"], analytics.TIME_SERIES_KEYS),
+                      criteria_over_time=analytics.to_columns(panels["criteria_over_time"],
+                                                              analytics.CRITERIA_OVER_TIME_KEYS))
+    return responses.trusted(panels)
+
+
+@app.get("/api/analytics/nperf")
+def analytics_nperf(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    type: Optional[str] = None,
+    provider: Optional[str] = None,
+    sector: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+) -> Dict[str, Any]:
+    """Criterion ratings of the feedbacks linked to each nPerf result (same
+    ``nperf_test_id``), newest result first. ``sector`` filters the results,
+    the other filters the feedbacks. Pass back ``next_cursor`` for the next page.
+    """
+    return responses.trusted(analytics.nperf_ratings(db, start_date, end_date, type, provider, sector, limit, cursor))
+
+
+@app.get("/api/analytics/stream")
+async def analytics_stream():
+    """Server-Sent Events for live dashboards: ``delta`` events carry the rollup
+    increments of newly committed feedbacks, ``resync`` asks to reload."""
+    return live.response()
 
 
 # Serve the built/static UI from / (source directory)
@@ -425,70 +432,77 @@ STATIC_DIR = os.path.abspath(STATIC_DIR)
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Serve favicon from /images even when browser requests /favicon.ico at root
-FAVICON_PATH = os.path.join(STATIC_DIR, "images", "favicon.ico")
+# Precompressed, fingerprinted copy of source/ (see backend.static)
+site = static.StaticSite(STATIC_DIR)
 
+# Serve favicon from /images even when browser requests /favicon.ico at root
 @app.get("/favicon.ico")
-def favicon():
-    if os.path.exists(FAVICON_PATH):
-        return FileResponse(FAVICON_PATH)
-    raise HTTPException(status_code=404, detail="favicon not found")
+def favicon(request: Request):
+    return site.response(request, "images/favicon.ico")
 
-# Register explicit pages BEFORE mounting the catch-all static route
-# (so /dashboard is not shadowed by the StaticFiles mount at "/").
+# Register explicit pages BEFORE the catch-all static route
+# (so /dashboard is not shadowed by the route at "/{path}").
 @app.get("/index.html")
-def index_html():
-    return FileResponse(os.path.join(STATIC_DIR, "index.html"))
+def index_html(request: Request):
+    return site.response(request, "index.html")
 
 
 @app.get("/dashboard")
-def dashboard_html():
-    return FileResponse(os.path.join(STATIC_DIR, "dashboard.html"))
-
-
-@app.post("/api/upload")
-async def upload(file: UploadFile = File(...)) -> Dict[str, str]:
-    # Save to uploads directory with a timestamped name
-    orig = file.filename or "upload.bin"
-    ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-    safe_name = "".join(c for c in orig if c.isalnum() or c in (".", "-", "_")) or "file"
-    name = f"{ts}_{safe_name}"
-    path = os.path.join(UPLOAD_DIR, name)
-    content = await file.read()
-    with open(path, "wb") as f:
-        f.write(content)
-    return {"filename": name, "url": f"/uploads/{name}"}
+def dashboard_html(request: Request):
+    return site.response(request, "dashboard.html")
+
+
+@app.post("/api/upload", openapi_extra=uploads.OPENAPI_BODY)
+async def upload(request: Request) -> Dict[str, Any]:
+    # Streamed to disk in chunks and stored under its content hash (see backend.uploads);
+    # thumbnails and recompressed variants are made afterwards (see backend.attachments)
+    stored = await uploads.save_upload(request, UPLOAD_DIR)
+    stored["processing"] = await attachments.enqueue(stored["filename"])
+    return stored
+
+
+@app.get("/api/attachments/{name}")
+async def attachment_status(name: str) -> Response:
+    info = await attachments.job_info(name)
+    if info is None:
+        raise HTTPException(status_code=404, detail="No processing job for this upload")
+    return responses.trusted(info)
 
 @app.get("/a-propos-android")
-def dashboard_html():
-    return FileResponse(os.path.join(STATIC_DIR, "a-propos-android.html"))
+def dashboard_html(request: Request):
+    return site.response(request, "a-propos-android.html")
 
 @app.get("/a-propos-huawei")
-def dashboard_html():
-    return FileResponse(os.path.join(STATIC_DIR, "a-propos-huawei.html"))
+def dashboard_html(request: Request):
+    return site.response(request, "a-propos-huawei.html")
 
 @app.get("/a-propos-ios")
-def dashboard_html():
-    return FileResponse(os.path.join(STATIC_DIR, "a-propos-ios.html"))
+def dashboard_html(request: Request):
+    return site.response(request, "a-propos-ios.html")
 
 @app.get("/cgu-eula")
-def dashboard_html():
-    return FileResponse(os.path.join(STATIC_DIR, "cgu-eula.html"))
+def dashboard_html(request: Request):
+    return site.response(request, "cgu-eula.html")
 
 @app.get("/politique-confidentialite")
-def dashboard_html():
-    return FileResponse(os.path.join(STATIC_DIR, "politique-confidentialite.html"))
+def dashboard_html(request: Request):
+    return site.response(request, "politique-confidentialite.html")
 
 @app.get("/politique-cookies")
-def dashboard_html():
-    return FileResponse(os.path.join(STATIC_DIR, "politique-cookies.html"))
+def dashboard_html(request: Request):
+    return site.response(request, "politique-cookies.html")
 
 @app.get("/ci-perf")
-def ci_perf_page():
-    response = FileResponse(os.path.join(STATIC_DIR, "ci-perf.html"))
-    response.headers["X-Frame-Options"] = "ALLOWALL"
-    return response
-
-# Finally, mount static catch-all at /
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
-app.mount("/", StaticFiles(directory=STATIC_DIR, html=True), name="static")
+def ci_perf_page(request: Request):
+    return site.response(request, "ci-perf.html", headers={"X-Frame-Options": "ALLOWALL"})
+
+# Finally, uploads and the static catch-all at /
+@app.api_route("/uploads/{name}", methods=["GET", "HEAD"], include_in_schema=False)
+def uploaded_file(name: str, request: Request, w: Optional[int] = None):
+    # smallest processed variant at least w pixels wide; the stored file until it is processed
+    return attachments.response(request, UPLOAD_DIR, name, w)
+
+
+@app.api_route("/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+def static_files(path: str, request: Request):
+    return site.response(request, path)
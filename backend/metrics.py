@@ -0,0 +1,228 @@
+"""Prometheus metrics for ``GET /metrics``.
+
+- HTTP: requests, latency and response size per route template, in-flight
+  requests, busy threadpool slots.
+- DB: statements and their duration (SQLAlchemy cursor events on every engine),
+  statements and SQL time per request, pool checkouts in use, checkout waits.
+- Ingestion: rows written / queued / dropped per kind, buffer depth, flush time.
+- Analytics cache hits and misses, live dashboard streams.
+- Admission control: write requests refused (by class and reason), admitted
+  requests in flight, queue wait.
+
+Comparing ``http_request_duration_seconds`` with ``http_request_db_seconds``
+for a route tells whether its time goes to SQL or to Python (serialisation,
+threadpool queueing). ``SERVER_TIMING=true`` gives the same split for a single
+request, in its ``Server-Timing`` header.
+
+With several uvicorn workers, point ``PROMETHEUS_MULTIPROC_DIR`` at an empty
+directory (the Docker image does) so that any worker answers for all of them.
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+from anyio.to_thread import current_default_thread_limiter
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+
+from . import db
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+# Server-Timing header on every response: SQL, JSON encoding and the rest (Python)
+# up to the response headers; the browser shows it in the network panel.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"],
+                         buckets=LATENCY_BUCKETS)
+HTTP_SIZE = Histogram("http_response_size_bytes", "HTTP response body size", ["method", "route"],
+                      buckets=SIZE_BUCKETS)
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being served", ["method"],
+                         multiprocess_mode="livesum")
+THREADPOOL_BUSY = Gauge("threadpool_busy_threads", "Threadpool slots in use (sync endpoints, file I/O)",
+                        multiprocess_mode="livesum")
+
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed", ["engine"])
+DB_QUERY_TIME = Histogram("db_query_duration_seconds", "SQL statement duration", ["engine"],
+                          buckets=LATENCY_BUCKETS)
+DB_QUERIES_PER_REQUEST = Histogram("http_request_db_queries", "SQL statements per HTTP request", ["route"],
+                                   buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+DB_TIME_PER_REQUEST = Histogram("http_request_db_seconds", "Time spent in SQL per HTTP request", ["route"],
+                                buckets=LATENCY_BUCKETS)
+DB_POOL_SIZE = Gauge("db_pool_size", "Configured pool size", ["engine"], multiprocess_mode="livesum")
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Pooled connections in use", ["engine"],
+                            multiprocess_mode="livesum")
+DB_POOL_WAIT = Histogram("db_pool_wait_seconds", "Wait for a pooled connection at checkout", ["engine"],
+                         buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts that timed out", ["engine"])
+
+INGEST_ROWS = Counter("ingest_rows_total", "Rows committed by the ingestion endpoints", ["kind"])
+INGEST_QUEUED = Counter("ingest_queued_total", "Rows accepted into the write-behind buffer", ["kind"])
+INGEST_FAILED = Counter("ingest_failed_rows_total", "Buffered rows dropped after all flush retries", ["kind"])
+INGEST_QUEUE_DEPTH = Gauge("ingest_queue_depth", "Rows waiting in the write-behind buffer", ["kind"],
+                           multiprocess_mode="livesum")
+INGEST_FLUSH_TIME = Histogram("ingest_flush_duration_seconds", "Write-behind flush duration", ["kind"],
+                              buckets=LATENCY_BUCKETS)
+
+CACHE_REQUESTS = Counter("analytics_cache_requests_total", "Analytics cache lookups", ["result"])
+
+LIVE_CLIENTS = Gauge("live_clients", "Open dashboard event streams", multiprocess_mode="livesum")
+LIVE_EVENTS = Counter("live_events_published_total", "Dashboard delta events published")
+LIVE_RESYNCS = Counter("live_resyncs_total", "Viewers that fell behind and were told to reload")
+
+ADMISSION_SHED = Counter("admission_shed_total", "Write requests refused by admission control",
+                         ["route_class", "reason"])
+ADMISSION_ACTIVE = Gauge("admission_active_requests", "Admitted write requests being served", ["route_class"],
+                         multiprocess_mode="livesum")
+ADMISSION_QUEUE_WAIT = Histogram("admission_queue_wait_seconds", "Wait in the admission queue", ["route_class"],
+                                 buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+class _RequestStats:
+    __slots__ = ("queries", "seconds", "render_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0  # in SQL
+        self.render_seconds = 0.0  # JSON encoding, counted with SERVER_TIMING only
+
+
+# sync endpoints run in the threadpool with a copy of the context, which still
+# points at the same _RequestStats object
+_request_stats: ContextVar[Optional[_RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def request_stats() -> Optional[_RequestStats]:
+    """Counters of the request being served (None outside a request)."""
+    return _request_stats.get()
+
+
+def _server_timing(stats: _RequestStats, elapsed: float) -> bytes:
+    db_ms, render_ms = stats.seconds * 1000, stats.render_seconds * 1000
+    app_ms = max(0.0, elapsed * 1000 - db_ms - render_ms)
+    return (f'db;dur={db_ms:.1f};desc="SQL ({stats.queries} statements)", serialize;dur={render_ms:.1f};desc="JSON", '
+            f'app;dur={app_ms:.1f};desc="Python", total;dur={elapsed * 1000:.1f}').encode()
+
+
+def _instrument_engine(name: str, engine) -> None:
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_t0", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_t0"].pop()
+        DB_QUERIES.labels(name).inc()
+        DB_QUERY_TIME.labels(name).observe(elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+
+    def error(context):
+        stack = context.connection.info.get("metrics_t0") if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    event.listen(engine, "handle_error", error)
+    event.listen(engine, "checkout", lambda *args: DB_POOL_CHECKED_OUT.labels(name).inc())
+    event.listen(engine, "checkin", lambda *args: DB_POOL_CHECKED_OUT.labels(name).dec())
+
+
+def _observe_waits(name: str):
+    def observe(waited: float, timed_out: bool) -> None:
+        if timed_out:
+            DB_POOL_TIMEOUTS.labels(name).inc()
+        else:
+            DB_POOL_WAIT.labels(name).observe(waited)
+    return observe
+
+
+for _name, _engine, _waits in [("sync", db.engine, db.sync_pool_waits),
+                               ("async", db.async_engine.sync_engine, db.async_pool_waits)] + \
+        [(r.name, r.engine, r.waits) for r in db.read_replicas]:
+    _instrument_engine(_name, _engine)
+    _waits.listeners.append(_observe_waits(_name))
+    _size = getattr(_engine.pool, "size", None)
+    if callable(_size):
+        DB_POOL_SIZE.labels(_name).set(_size())
+
+
+def _route(scope, status: int) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "other")
+    # mounts (uploads) do not set the route; keep the label set bounded
+    return "unmatched" if status == 404 else "other"
+
+
+def _busy_threads() -> int:
+    try:
+        return current_default_thread_limiter().borrowed_tokens
+    except Exception:
+        return 0
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (does not buffer streaming responses)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status, size = 500, 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", _server_timing(stats, time.perf_counter() - t0))]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        HTTP_IN_PROGRESS.labels(method).inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _request_stats.reset(token)
+            HTTP_IN_PROGRESS.labels(method).dec()
+            THREADPOOL_BUSY.set(_busy_threads())
+            route = _route(scope, status)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_LATENCY.labels(method, route).observe(elapsed)
+            HTTP_SIZE.labels(method, route).observe(size)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(stats.queries)
+            DB_TIME_PER_REQUEST.labels(route).observe(stats.seconds)
+
+
+def render() -> Tuple[bytes, str]:
+    """Body and content type of ``GET /metrics``."""
+    THREADPOOL_BUSY.set(_busy_threads())
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def shutdown() -> None:
+    """Drop this worker's live gauges from the multiprocess directory."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
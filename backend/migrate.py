@@ -0,0 +1,284 @@
+"""Versioned schema migrations.
+
+Run once per deploy, before the API workers start::
+
+    python -m backend.migrate           # apply pending migrations
+    python -m backend.migrate status    # list applied / pending versions
+
+Applied versions are recorded in ``schema_migrations``. On PostgreSQL a run
+holds an advisory lock, so pods starting together wait for each other instead
+of racing; every step is idempotent (``IF NOT EXISTS``, column checks) so an
+interrupted run can simply be restarted. Indexes are built ``CONCURRENTLY`` on
+PostgreSQL, which keeps the tables writable while they build.
+
+With ``AUTO_MIGRATE=true`` (default, handy with ``uvicorn --reload``) importing
+``backend.main`` also runs them; the Docker image disables it and migrates in
+its start command instead.
+"""
+import argparse
+import time
+from contextlib import contextmanager
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .db import Base, engine
+
+LOCK_KEY = 0x41525443  # "ARTC", pg_advisory_lock key shared by all runners
+LOCK_POLL_SECONDS = 0.5
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+    transactional: bool = True  # False for CREATE INDEX CONCURRENTLY
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str, transactional: bool = True):
+    def register(fn: Callable[[Connection], None]):
+        MIGRATIONS.append(Migration(version, name, fn, transactional))
+        return fn
+    return register
+
+
+def create_index(conn: Connection, name: str, table: str, columns: str, using: Optional[str] = None,
+                 unique: bool = False) -> None:
+    """CREATE INDEX IF NOT EXISTS, concurrently on PostgreSQL (needs an autocommit connection)."""
+    create = "CREATE UNIQUE INDEX" if unique else "CREATE INDEX"
+    if conn.dialect.name == "postgresql" and conn.scalar(
+            text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}) == "p":
+        # partitioned (backend.partitions): no CONCURRENTLY, the index is built on each partition
+        conn.execute(text(f"{create} IF NOT EXISTS {name} ON {table} ({columns})"))
+    elif conn.dialect.name == "postgresql":
+        # a failed concurrent build leaves an INVALID index that IF NOT EXISTS would keep
+        invalid = conn.scalar(text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                              {"name": name})
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+        method = f"USING {using} " if using else ""
+        conn.execute(text(f"{create} CONCURRENTLY IF NOT EXISTS {name} ON {table} {method}({columns})"))
+    elif using is None:
+        conn.execute(text(f"{create} IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+# -----------------------------
+# Migrations (never edit an applied one; add a new version instead)
+# -----------------------------
+
+@migration(1, "base tables")
+def _base_tables(conn: Connection) -> None:
+    for table in (models.Feedback.__table__, models.NPerfResult.__table__, models.FeedbackRollup.__table__):
+        table.create(conn, checkfirst=True)
+
+
+@migration(2, "feedback nperf_test_id/sector/comments columns")
+def _feedback_columns(conn: Connection) -> None:
+    # previously done by hand through POST /api/admin/update-schema
+    existing = {c["name"] for c in inspect(conn).get_columns("feedbacks")}
+    for name, ddl in (("nperf_test_id", "VARCHAR(255)"), ("sector", "VARCHAR(255)"), ("comments", "VARCHAR")):
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE feedbacks ADD COLUMN {name} {ddl}"))
+
+
+@migration(3, "indexes for list, export and analytics filters", transactional=False)
+def _filter_indexes(conn: Connection) -> None:
+    # keyset pagination / export: ORDER BY created_at DESC, id DESC
+    create_index(conn, "ix_feedbacks_created_at_id", "feedbacks", "created_at DESC, id DESC")
+    create_index(conn, "ix_feedbacks_type_provider_created_at", "feedbacks", "type, provider, created_at")
+    create_index(conn, "ix_feedbacks_sector_created_at", "feedbacks", "sector, created_at")
+    create_index(conn, "ix_feedbacks_nperf_test_id", "feedbacks", "nperf_test_id")
+    create_index(conn, "ix_nperf_results_created_at_id", "nperf_results", "created_at DESC, id DESC")
+    create_index(conn, "ix_nperf_results_sector_created_at", "nperf_results", "sector, created_at")
+    create_index(conn, "ix_nperf_results_nperf_test_id", "nperf_results", "nperf_test_id")
+    # containment queries on the ratings JSONB (ratings @> '[...]'); PostgreSQL only
+    create_index(conn, "ix_feedbacks_ratings", "feedbacks", "ratings jsonb_path_ops", using="gin")
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ANALYZE feedbacks"))
+        conn.execute(text("ANALYZE nperf_results"))
+
+
+@migration(4, "normalized feedback_ratings and rating_labels")
+def _feedback_ratings(conn: Connection) -> None:
+    from .ratings import backfill
+
+    models.RatingLabel.__table__.create(conn, checkfirst=True)
+    models.FeedbackRating.__table__.create(conn, checkfirst=True)
+    with Session(bind=conn) as db:
+        backfill(db)
+
+
+@migration(5, "unique nPerf result per external_uuid and test", transactional=False)
+def _nperf_results_unique(conn: Connection) -> None:
+    # client retries stored before the upsert: keep the first copy
+    conn.execute(text(
+        "DELETE FROM nperf_results WHERE external_uuid IS NOT NULL AND nperf_test_id IS NOT NULL"
+        " AND id NOT IN (SELECT MIN(id) FROM nperf_results WHERE external_uuid IS NOT NULL"
+        " AND nperf_test_id IS NOT NULL GROUP BY external_uuid, nperf_test_id)"
+    ))
+    create_index(conn, "ux_nperf_results_external_uuid_test_id", "nperf_results", "external_uuid, nperf_test_id",
+                 unique=True)
+
+
+@migration(6, "attachment processing jobs")
+def _attachment_jobs(conn: Connection) -> None:
+    models.AttachmentJob.__table__.create(conn, checkfirst=True)
+
+
+@migration(7, "backfill feedback_rollups of existing databases")
+def _backfill_rollups(conn: Connection) -> None:
+    # 001 creates feedback_rollups empty next to an existing feedbacks table, and
+    # the dashboard reads only the rollups; rebuild needs the 002/004 schema
+    from .rollups import rebuild
+
+    has_rollups = conn.scalar(select(models.FeedbackRollup.id).limit(1)) is not None
+    has_feedbacks = conn.scalar(select(models.Feedback.id).limit(1)) is not None
+    if has_feedbacks and not has_rollups:
+        with Session(bind=conn) as db:
+            rebuild(db)
+
+
+@migration(8, "SQLite indexes for keyset pagination on the normalized created_at", transactional=False)
+def _sqlite_sort_indexes(conn: Connection) -> None:
+    # pagination orders SQLite rows by strftime(created_at), which the plain
+    # created_at indexes of 003 cannot serve
+    if conn.dialect.name != "sqlite":
+        return
+    from .pagination import SQLITE_TS_FORMAT
+
+    for table in ("feedbacks", "nperf_results"):
+        create_index(conn, f"ix_{table}_sort_ts_id", table, f"strftime('{SQLITE_TS_FORMAT}', created_at) DESC, id DESC")
+
+
+@migration(9, "rebuild feedback_rollups that do not match feedbacks")
+def _repair_rollups(conn: Connection) -> None:
+    # 007 only filled empty rollups: a database that got feedback between 001
+    # and 007 had partial ones
+    from .rollups import rebuild
+
+    r = models.FeedbackRollup
+    counted = conn.execute(select(
+        func.coalesce(func.sum(r.feedback_count), 0), func.coalesce(func.sum(r.rating_count), 0))).one()
+    feedbacks = conn.scalar(select(func.count()).select_from(models.Feedback))
+    rated = conn.scalar(select(func.count()).select_from(models.FeedbackRating))
+    if tuple(counted) != (feedbacks, rated):
+        print(f"feedback_rollups count {counted[0]} feedbacks / {counted[1]} ratings for {feedbacks} / {rated}: rebuilding")
+        with Session(bind=conn) as db:
+            rebuild(db)
+
+
+@migration(10, "data_versions, bumped by archive/restore")
+def _data_versions(conn: Connection) -> None:
+    dv = models.DataVersion.__table__
+    dv.create(conn, checkfirst=True)
+    if conn.scalar(select(dv.c.name).where(dv.c.name == "feedbacks")) is None:
+        conn.execute(dv.insert().values(name="feedbacks", version=0))
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+
+@contextmanager
+def _migration_lock(bind: Engine):
+    """Serialise concurrent runs. SQLite relies on idempotent steps and busy_timeout."""
+    if bind.dialect.name != "postgresql":
+        yield
+        return
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # poll rather than block in pg_advisory_lock: a waiting statement holds a
+        # snapshot, and CREATE INDEX CONCURRENTLY in the lock holder would wait for it
+        while not conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": LOCK_KEY}):
+            time.sleep(LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+
+
+def applied_versions(bind: Engine) -> List[int]:
+    with bind.begin() as conn:
+        schema_migrations.create(conn, checkfirst=True)
+        return list(conn.scalars(select(schema_migrations.c.version).order_by(schema_migrations.c.version)))
+
+
+def _apply(bind: Engine, m: Migration) -> bool:
+    # DDL may legitimately outlast the API's DB_STATEMENT_TIMEOUT_MS
+    pg = bind.dialect.name == "postgresql"
+    try:
+        if m.transactional:
+            with bind.begin() as conn:
+                if pg:
+                    conn.execute(text("SET LOCAL statement_timeout = 0"))
+                m.apply(conn)
+                conn.execute(schema_migrations.insert().values(version=m.version, name=m.name))
+        else:
+            with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                if pg:
+                    conn.execute(text("SET statement_timeout = 0"))
+                try:
+                    m.apply(conn)
+                finally:
+                    if pg:
+                        conn.execute(text("RESET statement_timeout"))
+            with bind.begin() as conn:
+                conn.execute(schema_migrations.insert().values(version=m.version, name=m.name))
+    except IntegrityError:
+        return False  # recorded meanwhile by a concurrent runner (SQLite)
+    return True
+
+
+def upgrade(bind: Optional[Engine] = None) -> List[int]:
+    """Apply pending migrations in order. Returns the versions applied by this call."""
+    bind = bind or engine
+    done: List[int] = []
+    with _migration_lock(bind):
+        applied = set(applied_versions(bind))
+        for m in sorted(MIGRATIONS, key=lambda m: m.version):
+            if m.version in applied:
+                continue
+            print(f"Applying migration {m.version:03d}: {m.name}")
+            if _apply(bind, m):
+                done.append(m.version)
+    return done
+
+
+def reset(bind: Optional[Engine] = None) -> None:
+    """Drop every table, including the migration history (RESET_DB_ON_STARTUP)."""
+    bind = bind or engine
+    with _migration_lock(bind):
+        Base.metadata.drop_all(bind=bind)
+        schema_migrations.drop(bind, checkfirst=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    parser.add_argument("command", nargs="?", default="upgrade", choices=["upgrade", "status"])
+    args = parser.parse_args()
+
+    if args.command == "status":
+        applied = set(applied_versions(engine))
+        for m in sorted(MIGRATIONS, key=lambda m: m.version):
+            print(f"{m.version:03d} {'applied' if m.version in applied else 'pending':8} {m.name}")
+        return
+    done = upgrade()
+    print(f"Applied {len(done)} migration(s)" if done else "Schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
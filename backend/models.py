@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, func
+from sqlalchemy import Column, ForeignKey, Index, Integer, SmallInteger, String, Date, DateTime, UniqueConstraint, func
 from sqlalchemy.types import JSON as SAJSON
 from sqlalchemy.dialects.postgresql import JSONB
 
@@ -37,6 +37,9 @@ class Feedback(Base):
     
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    # fetch server-generated created_at with the INSERT (needed by the rollups)
+    __mapper_args__ = {"eager_defaults": True}
+
     def __repr__(self) -> str:  # pragma: no cover - debug helper
         return f"<Feedback id={self.id} type={self.type} provider={self.provider}>"
 
@@ -50,3 +53,100 @@ class NPerfResult(Base):
     sector = Column(String(255), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    __table_args__ = (
+        # one row per test and device: a retried POST upserts (see ingest.insert_nperf_results)
+        Index("ux_nperf_results_external_uuid_test_id", "external_uuid", "nperf_test_id", unique=True),
+    )
+
+
+class RatingLabel(Base):
+    """Interned criterion labels referenced by ``feedback_ratings``."""
+    __tablename__ = "rating_labels"
+
+    id = Column(Integer, primary_key=True)
+    label = Column(String, nullable=False, unique=True)
+
+
+class FeedbackRating(Base):
+    """One criterion rating of a feedback, exploded from ``Feedback.ratings``.
+
+    The filter columns of the feedback are copied so criterion queries never
+    join ``feedbacks`` nor parse JSON. Filled on insert by ``backend.ratings``.
+    """
+    __tablename__ = "feedback_ratings"
+
+    id = Column(Integer, primary_key=True)
+    feedback_id = Column(Integer, nullable=False)
+    criterion = Column(String, nullable=False)  # "crit-N" key of the ratings entry
+    label_id = Column(Integer, ForeignKey("rating_labels.id"), nullable=False)
+    rating = Column(SmallInteger, nullable=False)  # 1..4
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    type = Column(String(20), nullable=False)
+    provider = Column(String(255), nullable=False)
+    sector = Column(String(255), nullable=True)
+
+    __table_args__ = (
+        Index("ix_feedback_ratings_feedback_id", "feedback_id"),
+        Index("ix_feedback_ratings_label_created_at", "label_id", "created_at"),
+        Index("ix_feedback_ratings_created_at", "created_at"),
+    )
+
+
+class FeedbackRollup(Base):
+    """Pre-aggregated feedback counts and rating sums per hour bucket.
+
+    Rows with an empty ``label`` count feedbacks; the other rows hold the rating
+    aggregates of one criterion label. Maintained by ``backend.rollups``.
+    """
+    __tablename__ = "feedback_rollups"
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    hour = Column(SmallInteger, nullable=False)
+    weekday = Column(SmallInteger, nullable=False)  # 0=Monday
+    type = Column(String(20), nullable=False)
+    provider = Column(String(255), nullable=False, default="")
+    sector = Column(String(255), nullable=False, default="")
+    label = Column(String, nullable=False, default="")
+
+    feedback_count = Column(Integer, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_1 = Column(Integer, nullable=False, default=0)
+    rating_2 = Column(Integer, nullable=False, default=0)
+    rating_3 = Column(Integer, nullable=False, default=0)
+    rating_4 = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("day", "hour", "weekday", "type", "provider", "sector", "label",
+                         name="uq_feedback_rollups_key"),
+    )
+
+
+class AttachmentJob(Base):
+    """Processing of one stored upload: thumbnails, recompressed variants, metadata
+    stripped. Claimed by the workers of ``backend.attachments``."""
+    __tablename__ = "attachment_jobs"
+
+    id = Column(Integer, primary_key=True)
+    filename = Column(String(255), nullable=False, unique=True)  # name under uploads/
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, done, skipped, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    variants = Column(JSONType, nullable=True)  # manifest written by the processing
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_attachment_jobs_status_updated_at", "status", "updated_at"),
+    )
+
+
+class DataVersion(Base):
+    """Counter bumped when stored rows are removed or put back in bulk (``backend.partitions``
+    archive/restore), so that the in-memory copies of ``backend.columnar`` reload."""
+    __tablename__ = "data_versions"
+
+    name = Column(String(50), primary_key=True)  # "feedbacks"
+    version = Column(Integer, nullable=False, default=0)
+    changed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -0,0 +1,88 @@
+"""Keyset (cursor) pagination on (created_at, id), newest first.
+
+A cursor encodes the (created_at, id) of the last row of a page; the next page
+is read with ``WHERE (created_at, id) < (:ts, :id) ORDER BY created_at DESC, id DESC``,
+which is an index range scan whatever the page depth, unlike OFFSET.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, func, literal_column, select, tuple_
+from sqlalchemy.orm import Session
+
+TOTAL_MODES = ("exact", "estimate", "none")
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, row_id = json.loads(raw)
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# SQLite stores timestamps as text, "2024-01-01 10:00:00" from server defaults but
+# "2024-01-01 10:00:00.000000" from Python: order and compare a normalized form.
+SQLITE_TS_FORMAT = "%Y-%m-%d %H:%M:%f"
+
+
+def _sort_ts(db: Session, value):
+    if db.get_bind().dialect.name == "sqlite":
+        # inlined, not bound: the expression indexes of migration 008 only match the same text
+        return func.strftime(literal_column(f"'{SQLITE_TS_FORMAT}'"), value)
+    return value
+
+
+def newest_first(db: Session, model) -> list:
+    """ORDER BY clauses of the pages: created_at DESC, id DESC."""
+    return [_sort_ts(db, model.created_at).desc(), model.id.desc()]
+
+
+def _after_cursor(db: Session, model, cursor: str):
+    ts, row_id = decode_cursor(cursor)
+    if db.get_bind().dialect.name == "sqlite":
+        text_ts = ts.replace(tzinfo=None).isoformat(sep=" ")
+        return tuple_(_sort_ts(db, model.created_at), model.id) < tuple_(_sort_ts(db, text_ts), row_id)
+    # the plain bound on created_at also lets PostgreSQL skip newer partitions
+    return and_(model.created_at <= ts, tuple_(model.created_at, model.id) < tuple_(ts, row_id))
+
+
+def keyset_page(db: Session, model, conds: list, limit: int, cursor: Optional[str] = None) -> Tuple[List[Any], Optional[str]]:
+    """One page of ``model`` rows matching ``conds`` and the cursor of the next page (None at the end)."""
+    limit = max(1, limit)
+    stmt = select(model).where(*conds)
+    if cursor:
+        stmt = stmt.where(_after_cursor(db, model, cursor))
+    stmt = stmt.order_by(*newest_first(db, model)).limit(limit + 1)
+    rows = list(db.scalars(stmt))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
+
+
+def count_rows(db: Session, model, conds: list, mode: str = "exact") -> Optional[int]:
+    """Total for the filtered rows: exact COUNT, planner estimate, or None.
+
+    Estimates use the PostgreSQL planner (no table scan); other databases fall
+    back to an exact count.
+    """
+    if mode == "none":
+        return None
+    if mode == "estimate" and db.get_bind().dialect.name == "postgresql":
+        compiled = select(model.id).where(*conds).compile(dialect=db.get_bind().dialect)
+        plan = db.connection().exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    return db.scalar(select(func.count()).select_from(model).where(*conds))
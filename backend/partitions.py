@@ -0,0 +1,488 @@
+"""Monthly partitions and retention of the feedback tables (PostgreSQL).
+
+``feedbacks`` and ``feedback_ratings`` can be range-partitioned by month on
+``created_at`` (``feedbacks_p202401``...). A query filtered by
+``start_date``/``end_date`` then only scans the partitions of its range, and
+an old month is removed by dropping its partitions instead of a huge DELETE::
+
+    python -m backend.partitions enable      # convert the tables (locked while their rows are copied)
+    python -m backend.partitions maintain    # create the partitions of the coming months
+    python -m backend.partitions archive --keep-months 24
+    python -m backend.partitions archive --month 2024-01
+    python -m backend.partitions restore 2024-01
+    python -m backend.partitions status
+
+Once enabled, every API worker creates the partitions of the current month and
+of the next ``PARTITION_PREMAKE_MONTHS`` (3) at startup and then every
+``PARTITION_MAINTAIN_HOURS`` (6). A ``_default`` partition catches rows
+outside them, so an insert never fails for want of a partition.
+
+``archive`` writes a month to ``ARCHIVE_DIR/<YYYY-MM>/``. The directory gets
+one gzipped CSV per table and a ``manifest.json`` with the row counts. The
+tables are the month's feedbacks and ratings, its nPerf results and its
+``feedback_rollups`` rows. Then, in one short transaction, the partitions are
+detached and dropped and the other rows deleted. The dashboard then no longer
+counts that month, and the in-memory engine of ``backend.columnar`` reloads
+(``data_versions``). ``restore`` loads a month back and re-attaches its
+partitions. Without partitioning (plain tables) the same commands copy and
+DELETE by date range.
+
+``nperf_results`` stays a plain table. Its upsert needs a unique index on
+(external_uuid, nperf_test_id), and the unique indexes of a partitioned table
+must include the partition key. Its rows are archived with their month all
+the same.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import shutil
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from . import cache, columnar
+from .db import engine
+from .rollups import COUNTER_COLUMNS, KEY_COLUMNS
+
+PARTITIONED = ["feedbacks", "feedback_ratings"]
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))
+PARTITION_MAINTAIN_HOURS = float(os.getenv("PARTITION_MAINTAIN_HOURS", "6"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+RETENTION_MONTHS = os.getenv("RETENTION_MONTHS")  # default of archive --keep-months
+
+LOCK_KEY = 0x41525450  # "ARTP": one partition change at a time
+ROLLUP_COLUMNS = KEY_COLUMNS + COUNTER_COLUMNS
+
+
+# -----------------------------
+# Months and names
+# -----------------------------
+
+def add_months(month: date, n: int) -> date:
+    i = month.year * 12 + month.month - 1 + n
+    return date(i // 12, i % 12 + 1, 1)
+
+
+def month_of(ts: datetime) -> date:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    return date(ts.year, ts.month, 1)
+
+
+def parse_month(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m").date()
+
+
+def current_month() -> date:
+    return month_of(datetime.now(timezone.utc))
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def _bounds(month: date):
+    """SQL literals of the month's [start, end) in UTC."""
+    return f"'{month.isoformat()} 00:00:00+00'", f"'{add_months(month, 1).isoformat()} 00:00:00+00'"
+
+
+# -----------------------------
+# Catalog
+# -----------------------------
+
+def _exists(conn: Connection, name: str) -> bool:
+    return conn.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    return conn.scalar(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}) == "p"
+
+
+def partitions(conn: Connection, table: str) -> List[date]:
+    """Months that have a partition of ``table`` (the default partition excluded)."""
+    names = conn.scalars(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:t)"
+    ), {"t": table})
+    prefix = f"{table}_p"
+    return sorted(datetime.strptime(n[len(prefix):], "%Y%m").date() for n in names
+                  if n.startswith(prefix) and n[len(prefix):].isdigit())
+
+
+def _prepare(conn: Connection) -> None:
+    """Serialise partition changes and lift DB_STATEMENT_TIMEOUT_MS (copies outlast it)."""
+    conn.execute(text("SET LOCAL statement_timeout = 0"))
+    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+
+
+def _attach(conn: Connection, table: str, month: date, fill=None) -> str:
+    """Create the month's partition of ``table`` as a plain table, fill it, then attach it.
+
+    Rows of that month caught meanwhile by the default partition are moved into it.
+    """
+    name = partition_name(table, month)
+    lo, hi = _bounds(month)
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+    if fill is not None:
+        fill(name)
+    if _exists(conn, f"{table}_default"):
+        conn.execute(text(
+            f"WITH moved AS (DELETE FROM {table}_default WHERE created_at >= {lo} AND created_at < {hi} "
+            f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+        ))
+    # a matching CHECK spares ATTACH a validation scan of the new partition
+    conn.execute(text(f"ALTER TABLE {name} ADD CONSTRAINT {name}_range "
+                      f"CHECK (created_at >= {lo} AND created_at < {hi})"))
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({lo}) TO ({hi})"))
+    conn.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_range"))
+    return name
+
+
+# -----------------------------
+# Enable and maintain
+# -----------------------------
+
+def _convert(conn: Connection, table: str, months_ahead: int) -> None:
+    old = f"{table}_unpartitioned"
+    pkey = conn.scalar(text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:t) AND contype = 'p'"),
+                       {"t": table})
+    indexes = conn.execute(text(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :t"
+    ), {"t": table}).all()
+    foreign_keys = conn.execute(text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(:t) AND contype = 'f'"
+    ), {"t": table}).all()
+    sequence = conn.scalar(text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": table})
+    oldest = conn.scalar(text(f"SELECT min(created_at) FROM {table}"))
+
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    if pkey:
+        conn.execute(text(f"ALTER TABLE {old} DROP CONSTRAINT {pkey}"))
+    for name, _ddl in indexes:
+        if name != pkey:
+            conn.execute(text(f"DROP INDEX {name}"))
+
+    conn.execute(text(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"))
+    conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+    month = month_of(oldest) if oldest else current_month()
+    last = add_months(current_month(), months_ahead)
+    while month <= last:
+        lo, hi = _bounds(month)
+        conn.execute(text(f"CREATE TABLE {partition_name(table, month)} PARTITION OF {table} "
+                          f"FOR VALUES FROM ({lo}) TO ({hi})"))
+        month = add_months(month, 1)
+    conn.execute(text(f"INSERT INTO {table} SELECT * FROM {old}"))
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+    conn.execute(text(f"DROP TABLE {old}"))
+
+    # unique constraints of a partitioned table must include the partition key
+    conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {pkey or table + '_pkey'} PRIMARY KEY (id, created_at)"))
+    for name, ddl in indexes:
+        if name != pkey:
+            conn.execute(text(ddl))  # built on every partition
+    for name, definition in foreign_keys:
+        conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}"))
+    conn.execute(text(f"ANALYZE {table}"))
+
+
+def enable(bind: Optional[Engine] = None, months_ahead: int = PARTITION_PREMAKE_MONTHS) -> List[str]:
+    """Convert the plain tables into monthly partitions. Returns the converted tables.
+
+    Rows are copied in one transaction holding an exclusive lock: plan the
+    downtime on a large database.
+    """
+    bind = bind or engine
+    if bind.dialect.name != "postgresql":
+        raise RuntimeError("partitioning needs PostgreSQL")
+    converted = []
+    with bind.begin() as conn:
+        _prepare(conn)
+        for table in PARTITIONED:
+            if not is_partitioned(conn, table):
+                _convert(conn, table, months_ahead)
+                converted.append(table)
+    return converted
+
+
+def maintain(bind: Optional[Engine] = None, months_ahead: int = PARTITION_PREMAKE_MONTHS) -> List[str]:
+    """Create the missing partitions from this month to ``months_ahead`` months ahead."""
+    bind = bind or engine
+    if bind.dialect.name != "postgresql":
+        return []
+    created: List[str] = []
+    with bind.begin() as conn:
+        tables = [t for t in PARTITIONED if is_partitioned(conn, t)]
+        if not tables:
+            return []
+        _prepare(conn)
+        this = current_month()
+        for table in tables:
+            existing = set(partitions(conn, table))
+            for i in range(months_ahead + 1):
+                month = add_months(this, i)
+                if month not in existing:
+                    created.append(_attach(conn, table, month))
+    return created
+
+
+async def _maintain_loop() -> None:
+    while True:
+        try:
+            created = await asyncio.to_thread(maintain)
+            if created:
+                print(f"Partitions: created {', '.join(created)}")
+        except Exception as e:
+            print(f"Partitions: maintenance failed: {e}")
+        await asyncio.sleep(PARTITION_MAINTAIN_HOURS * 3600)
+
+
+_task: Optional[asyncio.Task] = None
+
+
+async def start() -> None:
+    global _task
+    if engine.dialect.name == "postgresql":
+        _task = asyncio.get_running_loop().create_task(_maintain_loop(), name="partitions")
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+# -----------------------------
+# Archive and restore
+# -----------------------------
+
+def _sources(conn: Connection, month: date) -> Dict[str, str]:
+    """What ``COPY ... TO`` reads for each archived table of the month."""
+    lo, hi = _bounds(month)
+    out = {}
+    for table in PARTITIONED:
+        name = partition_name(table, month)
+        if is_partitioned(conn, table) and _exists(conn, name):
+            out[table] = name
+        else:
+            out[table] = f"(SELECT * FROM {table} WHERE created_at >= {lo} AND created_at < {hi})"
+    out["nperf_results"] = f"(SELECT * FROM nperf_results WHERE created_at >= {lo} AND created_at < {hi})"
+    out["feedback_rollups"] = (f"(SELECT {', '.join(ROLLUP_COLUMNS)} FROM feedback_rollups "
+                               f"WHERE day >= '{month}' AND day < '{add_months(month, 1)}')")
+    return out
+
+
+def _copy_out(conn: Connection, source: str, path: str) -> int:
+    with gzip.open(path, "wb") as f, conn.connection.driver_connection.cursor() as cur:
+        cur.copy_expert(f"COPY {source} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        return cur.rowcount
+
+
+def _copy_in(conn: Connection, table: str, path: str) -> int:
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        columns = f.readline().strip()  # the header: a column added since still loads
+        with conn.connection.driver_connection.cursor() as cur:
+            cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", f)
+            return cur.rowcount
+
+
+def _fsync_dir(path: str) -> None:
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), "rb") as f:
+            os.fsync(f.fileno())
+
+
+def archive(month: date, archive_dir: str = ARCHIVE_DIR, bind: Optional[Engine] = None) -> Dict[str, int]:
+    """Write the month to ``archive_dir/<YYYY-MM>/`` then remove it from the database.
+
+    Returns the archived row count per table.
+    """
+    bind = bind or engine
+    if bind.dialect.name != "postgresql":
+        raise RuntimeError("archiving needs PostgreSQL")
+    if month >= current_month():
+        raise ValueError(f"{month:%Y-%m} is not over yet")
+    target = os.path.join(archive_dir, f"{month:%Y-%m}")
+    if os.path.exists(target):
+        raise FileExistsError(f"{target} already exists")
+    tmp = target + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    # 1. copy out from one snapshot, without blocking anything
+    counts: Dict[str, int] = {}
+    with bind.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        with conn.begin():
+            conn.execute(text("SET LOCAL statement_timeout = 0"))
+            for table, source in _sources(conn, month).items():
+                counts[table] = _copy_out(conn, source, os.path.join(tmp, f"{table}.csv.gz"))
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump({"month": f"{month:%Y-%m}", "archived_at": datetime.now(timezone.utc).isoformat(),
+                   "rows": counts}, f, indent=2)
+    _fsync_dir(tmp)
+
+    # 2. remove the same rows: a count that differs means rows changed meanwhile
+    lo, hi = _bounds(month)
+    try:
+        with bind.begin() as conn:
+            _prepare(conn)
+            removed: Dict[str, int] = {}
+            for table in PARTITIONED:
+                name = partition_name(table, month)
+                if is_partitioned(conn, table) and _exists(conn, name):
+                    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                    removed[table] = conn.scalar(text(f"SELECT count(*) FROM {name}"))
+                    conn.execute(text(f"DROP TABLE {name}"))
+                else:
+                    removed[table] = conn.execute(text(
+                        f"DELETE FROM {table} WHERE created_at >= {lo} AND created_at < {hi}")).rowcount
+            removed["nperf_results"] = conn.execute(text(
+                f"DELETE FROM nperf_results WHERE created_at >= {lo} AND created_at < {hi}")).rowcount
+            removed["feedback_rollups"] = conn.execute(text(
+                f"DELETE FROM feedback_rollups WHERE day >= '{month}' AND day < '{add_months(month, 1)}'")).rowcount
+            if removed != counts:
+                raise RuntimeError(f"rows of {month:%Y-%m} changed while archiving ({removed} != {counts})")
+            columnar.bump_data_version(conn)
+            os.replace(tmp, target)
+    except Exception:
+        if os.path.isdir(target) and not os.path.exists(tmp):
+            os.replace(target, tmp)  # the transaction did not commit: not archived
+        raise
+    cache.invalidate()
+    return counts
+
+
+def archive_older_than(keep_months: int, archive_dir: str = ARCHIVE_DIR,
+                       bind: Optional[Engine] = None) -> List[date]:
+    """Archive every month before the last ``keep_months`` (the current one included)."""
+    if keep_months < 1:
+        raise ValueError("keep_months must be at least 1")
+    bind = bind or engine
+    cutoff = add_months(current_month(), -(keep_months - 1))
+    with bind.connect() as conn:
+        oldest = [conn.scalar(text(f"SELECT min(created_at) FROM {t}")) for t in PARTITIONED + ["nperf_results"]]
+        oldest_day = conn.scalar(text("SELECT min(day) FROM feedback_rollups"))
+    months = [month_of(ts) for ts in oldest if ts is not None]
+    if oldest_day is not None:
+        months.append(date(oldest_day.year, oldest_day.month, 1))
+    done = []
+    month = min(months, default=cutoff)
+    while month < cutoff:
+        if not os.path.exists(os.path.join(archive_dir, f"{month:%Y-%m}")):
+            archive(month, archive_dir, bind)
+            done.append(month)
+        month = add_months(month, 1)
+    return done
+
+
+def restore(month: date, archive_dir: str = ARCHIVE_DIR, bind: Optional[Engine] = None) -> Dict[str, int]:
+    """Load an archived month back. The archive then moves to ``archive_dir/restored/``."""
+    bind = bind or engine
+    source = os.path.join(archive_dir, f"{month:%Y-%m}")
+    with open(os.path.join(source, "manifest.json")) as f:
+        manifest = json.load(f)
+    path = lambda table: os.path.join(source, f"{table}.csv.gz")  # noqa: E731
+
+    counts: Dict[str, int] = {}
+    with bind.begin() as conn:
+        _prepare(conn)
+        for table in PARTITIONED:
+            if not is_partitioned(conn, table):
+                counts[table] = _copy_in(conn, table, path(table))
+                continue
+            if _exists(conn, partition_name(table, month)):
+                raise RuntimeError(f"{partition_name(table, month)} exists: {month:%Y-%m} is already in the database")
+            _attach(conn, table, month, fill=lambda name, table=table: counts.__setitem__(
+                table, _copy_in(conn, name, path(table))))
+        # rows stored again since the archive win; rollups add up
+        conn.execute(text("CREATE TEMP TABLE restore_nperf ON COMMIT DROP AS SELECT * FROM nperf_results WITH NO DATA"))
+        counts["nperf_results"] = _copy_in(conn, "restore_nperf", path("nperf_results"))
+        conn.execute(text("INSERT INTO nperf_results SELECT * FROM restore_nperf ON CONFLICT DO NOTHING"))
+        columns = ", ".join(ROLLUP_COLUMNS)
+        conn.execute(text(f"CREATE TEMP TABLE restore_rollups ON COMMIT DROP AS "
+                          f"SELECT {columns} FROM feedback_rollups WITH NO DATA"))
+        counts["feedback_rollups"] = _copy_in(conn, "restore_rollups", path("feedback_rollups"))
+        updates = ", ".join(f"{c} = feedback_rollups.{c} + excluded.{c}" for c in COUNTER_COLUMNS)
+        conn.execute(text(f"INSERT INTO feedback_rollups ({columns}) SELECT {columns} FROM restore_rollups "
+                          f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET {updates}"))
+        if counts != manifest["rows"]:
+            raise RuntimeError(f"archive of {month:%Y-%m} is incomplete ({counts} != {manifest['rows']})")
+        columnar.bump_data_version(conn)
+
+    restored = os.path.join(archive_dir, "restored")
+    os.makedirs(restored, exist_ok=True)
+    os.replace(source, os.path.join(restored, f"{month:%Y-%m}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}"))
+    cache.invalidate()
+    return counts
+
+
+def status(bind: Optional[Engine] = None, archive_dir: str = ARCHIVE_DIR) -> Dict[str, Any]:
+    bind = bind or engine
+    out: Dict[str, Any] = {"tables": {}, "archives": []}
+    if bind.dialect.name == "postgresql":
+        with bind.connect() as conn:
+            for table in PARTITIONED:
+                out["tables"][table] = ([f"{m:%Y-%m}" for m in partitions(conn, table)]
+                                        if is_partitioned(conn, table) else None)
+    if os.path.isdir(archive_dir):
+        for name in sorted(os.listdir(archive_dir)):
+            manifest = os.path.join(archive_dir, name, "manifest.json")
+            if os.path.exists(manifest):
+                with open(manifest) as f:
+                    out["archives"].append(json.load(f))
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Monthly partitions and retention of the feedback tables")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("enable", help="convert feedbacks and feedback_ratings into monthly partitions")
+    sub.add_parser("maintain", help="create the partitions of the coming months")
+    p = sub.add_parser("archive", help="archive old months to ARCHIVE_DIR and remove them")
+    group = p.add_mutually_exclusive_group()
+    group.add_argument("--keep-months", type=int, default=int(RETENTION_MONTHS) if RETENTION_MONTHS else None,
+                       help="months kept in the database, the current one included (RETENTION_MONTHS)")
+    group.add_argument("--month", type=parse_month, help="archive this month (YYYY-MM)")
+    p = sub.add_parser("restore", help="load an archived month back")
+    p.add_argument("month", type=parse_month, help="YYYY-MM")
+    sub.add_parser("status", help="partitions and archives")
+    for p in sub.choices.values():
+        p.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "enable":
+            converted = enable()
+            print(f"Partitioned {', '.join(converted)}" if converted else "Already partitioned")
+        elif args.command == "maintain":
+            created = maintain()
+            print(f"Created {', '.join(created)}" if created else "Partitions are up to date")
+        elif args.command == "archive":
+            if args.month:
+                counts = archive(args.month, args.archive_dir)
+                print(f"Archived {args.month:%Y-%m}: {counts}")
+            elif args.keep_months:
+                done = archive_older_than(args.keep_months, args.archive_dir)
+                print(f"Archived {', '.join(f'{m:%Y-%m}' for m in done)}" if done else "Nothing to archive")
+            else:
+                parser.error("archive needs --keep-months (or RETENTION_MONTHS) or --month")
+        elif args.command == "restore":
+            counts = restore(args.month, args.archive_dir)
+            print(f"Restored {args.month:%Y-%m}: {counts}")
+        else:
+            print(json.dumps(status(archive_dir=args.archive_dir), indent=2))
+    except (RuntimeError, ValueError, OSError) as e:
+        parser.exit(1, f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""On-demand sampling profile of a single request.
+
+Set ``PROFILING_TOKEN`` to a secret, then send a request with the header
+``X-Profile: <token>`` (a header only: a query string ends up in access logs)::
+
+    curl -H "X-Profile: $PROFILING_TOKEN" "https://.../api/analytics/criteria_over_time?..."
+
+The request runs as usual, but its response is replaced by a ``text/plain``
+report: the functions with the largest share of the samples (self and total),
+then every sampled stack in the collapsed format read by speedscope and
+``flamegraph.pl`` (the lines after the first blank line).
+
+A thread samples the stacks every ``PROFILE_INTERVAL_MS`` (5), in wall-clock
+time: SQL waits show up under the driver's ``execute``. It samples the event
+loop thread (async endpoints, JSON encoding) and the threadpool thread that
+runs a sync endpoint. Frames of other requests served at the same time by the
+event loop thread can appear too.
+
+Without ``PROFILING_TOKEN`` nothing is installed: no middleware, no wrapped
+endpoints.
+"""
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi.routing import APIRoute
+from starlette.responses import PlainTextResponse
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+TOP_FUNCTIONS = 40
+
+enabled = bool(PROFILING_TOKEN)
+
+Frame = Tuple[str, str, int]  # file, function, first line
+
+
+class Sampler(threading.Thread):
+    """Counts the stacks of the watched threads at a fixed interval."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        super().__init__(name="request-profiler", daemon=True)
+        self.interval = interval
+        self.threads: Set[int] = set()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            frames = sys._current_frames()
+            self.samples += 1
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = _stack(frame)
+                    if stack and not _idle(stack):
+                        self.stacks[stack] += 1
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+
+def _stack(frame) -> Tuple[Frame, ...]:
+    stack: List[Frame] = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+# innermost frame of an event loop waiting for I/O: asyncio's selector, or the
+# Python caller of uvloop's (C) loop
+IDLE_FRAMES = {("selectors.py", "select"), ("selectors.py", "poll"), ("runners.py", "run"),
+               ("base_events.py", "run_until_complete"), ("base_events.py", "run_forever")}
+
+
+def _idle(stack: Tuple[Frame, ...]) -> bool:
+    # e.g. the loop waiting for the threadpool or the database: not time spent by the request itself
+    filename, function, _ = stack[-1]
+    return (os.path.basename(filename), function) in IDLE_FRAMES
+
+
+def _label(frame: Frame) -> str:
+    """``backend/analytics.py:criteria_over_time:120``; libraries from their package, stdlib by file name."""
+    filename, function, line = frame
+    path = filename.replace("\\", "/")
+    if "/site-packages/" in path:
+        path = path.rsplit("/site-packages/", 1)[1]
+    elif "/backend/" in path:
+        path = "backend/" + path.rsplit("/backend/", 1)[1]
+    else:
+        path = os.path.basename(path)
+    return f"{path}:{function}:{line}"
+
+
+def report(sampler: Sampler, method: str, path: str, status: int, elapsed: float) -> str:
+    busy = sum(sampler.stacks.values())
+    total = busy or 1
+    own: Counter = Counter()
+    inclusive: Counter = Counter()
+    collapsed: Counter = Counter()
+    depth: Dict[str, int] = {}  # callers before callees when the totals are equal
+    for stack, count in sampler.stacks.items():
+        labels = [_label(f) for f in stack]
+        own[labels[-1]] += count
+        for i, label in enumerate(labels):
+            depth[label] = min(depth.get(label, i), i)
+        for label in set(labels):
+            inclusive[label] += count
+        collapsed[";".join(labels)] += count
+    lines = [f"# {method} {path} -> {status} in {elapsed * 1000:.1f} ms; {busy} of {sampler.samples} samples "
+             f"(every {sampler.interval * 1000:g} ms) in the request, the others with the event loop idle",
+             "#", "#   self   total  function (by self time)"]
+    for label, count in own.most_common(TOP_FUNCTIONS):
+        lines.append(f"# {count / total:6.1%} {inclusive[label] / total:6.1%}  {label}")
+    lines += ["#", "#   self   total  function (backend, by total time)"]
+    own_file = "backend/" + os.path.basename(__file__) + ":"  # the endpoint wrapper
+    backend = [label for label in inclusive if label.startswith("backend/") and not label.startswith(own_file)]
+    for label in sorted(backend, key=lambda label: (-inclusive[label], depth[label]))[:TOP_FUNCTIONS]:
+        count = inclusive[label]
+        lines.append(f"# {own[label] / total:6.1%} {count / total:6.1%}  {label}")
+    lines.append("")
+    lines.extend(f"{stack} {count}" for stack, count in collapsed.most_common())
+    return "\n".join(lines) + "\n"
+
+
+_sampler: ContextVar[Optional[Sampler]] = ContextVar("profile_sampler", default=None)
+
+
+def _sampled(endpoint: Callable) -> Callable:
+    """Sync endpoint that adds its threadpool thread to the sampler of a profiled request."""
+    @wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        sampler = _sampler.get()
+        if sampler is None:
+            return endpoint(*args, **kwargs)
+        ident = threading.get_ident()
+        sampler.threads.add(ident)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            sampler.threads.discard(ident)
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """Route class of the app when profiling is enabled: see :func:`_sampled`."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = _sampled(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _requested(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            return hmac.compare_digest(value, PROFILING_TOKEN.encode())
+    return False
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware: profiles the requests carrying the token, passes the others through."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope):
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        sampler = Sampler()
+        sampler.threads.add(threading.get_ident())
+        token = _sampler.set(sampler)
+        sampler.start()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            elapsed = time.perf_counter() - t0
+            sampler.stop()
+            _sampler.reset(token)
+        text = report(sampler, scope["method"], scope["path"], status, elapsed)
+        await PlainTextResponse(text, headers={"Cache-Control": "no-store"})(scope, receive, send)
@@ -0,0 +1,112 @@
+"""Maintenance of the normalized ``feedback_ratings`` / ``rating_labels`` tables.
+
+``ingest.insert_feedbacks`` calls :func:`arecord` in the insert transaction, so
+every write path fills them. :func:`backfill` adds the rows of feedbacks that
+have none (existing data, manual imports); migration 004 runs it, and so can::
+
+    python -m backend.ratings backfill
+"""
+import argparse
+from typing import Any, Dict, Iterable, List
+
+from sqlalchemy import distinct, exists, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+from .analytics import iter_criteria, rating_items
+
+_label_ids: Dict[str, int] = {}  # committed labels only (see _alabel_ids)
+
+
+def _insert_labels(dialect: str, labels: List[str]):
+    """INSERT ... ON CONFLICT DO NOTHING RETURNING the labels actually created."""
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise NotImplementedError(f"rating labels are not supported on {dialect}")
+    lb = models.RatingLabel
+    return (
+        dialect_insert(lb)
+        .values([{"label": label} for label in labels])
+        .on_conflict_do_nothing(index_elements=["label"])
+        .returning(lb.id, lb.label)
+    )
+
+
+async def _alabel_ids(db: AsyncSession, labels: List[str]) -> Dict[str, int]:
+    ids = {label: _label_ids[label] for label in labels if label in _label_ids}
+    missing = [label for label in labels if label not in ids]
+    if missing:
+        # ids created by this transaction are not cached: it may still roll back
+        created = await db.execute(_insert_labels(db.get_bind().dialect.name, missing))
+        ids.update({label: label_id for label_id, label in created.all()})
+        existing = [label for label in missing if label not in ids]
+        if existing:
+            lb = models.RatingLabel
+            rows = await db.execute(select(lb.id, lb.label).where(lb.label.in_(existing)))
+            for label_id, label in rows.all():
+                ids[label] = _label_ids[label] = label_id
+    return ids
+
+
+async def arecord(db: AsyncSession, feedbacks: Iterable[Any]) -> None:
+    """Add one ``feedback_ratings`` row per valid criterion of the given feedbacks (caller commits)."""
+    items = [(fb, key, label, rating) for fb in feedbacks for key, label, rating in iter_criteria(fb.ratings)]
+    if not items:
+        return
+    # sorted: concurrent transactions create new labels in the same order
+    ids = await _alabel_ids(db, sorted({label for _fb, _key, label, _rating in items}))
+    await db.execute(insert(models.FeedbackRating), [
+        {
+            "feedback_id": fb.id,
+            "criterion": key,
+            "label_id": ids[label],
+            "rating": rating,
+            "created_at": fb.created_at,
+            "type": fb.type,
+            "provider": fb.provider,
+            "sector": fb.sector,
+        }
+        for fb, key, label, rating in items
+    ])
+
+
+def backfill(db: Session) -> int:
+    """Explode the ``ratings`` JSON of feedbacks without rating rows, in SQL (caller commits).
+
+    Returns the number of rating rows added.
+    """
+    fb, fr, lb = models.Feedback, models.FeedbackRating, models.RatingLabel
+    items = rating_items(db, [~exists().where(fr.feedback_id == fb.id)])
+    db.execute(insert(lb).from_select(
+        ["label"],
+        select(distinct(items.c.label)).where(items.c.label.not_in(select(lb.label))),
+    ))
+    result = db.execute(insert(fr).from_select(
+        ["feedback_id", "criterion", "label_id", "rating", "created_at", "type", "provider", "sector"],
+        select(items.c.feedback_id, items.c.criterion, lb.id, items.c.rating,
+               items.c.created_at, items.c.type, items.c.provider, items.c.sector)
+        .join(lb, lb.label == items.c.label),
+    ))
+    return result.rowcount
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the normalized feedback ratings")
+    parser.add_argument("command", choices=["backfill"])
+    parser.parse_args()
+
+    from .db import SessionLocal
+    from .migrate import upgrade
+    upgrade()
+    with SessionLocal() as db:
+        n = backfill(db)
+        db.commit()
+    print(f"Backfilled feedback_ratings: {n} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""JSON encoding of the API responses.
+
+``orjson`` (optional, ``pip install orjson``) encodes several times faster than
+the stdlib ``json`` used by Starlette, and handles datetimes natively; without
+it the stdlib is used with the same output.
+
+FastAPI validates what a route returns against its ``response_model`` (or
+return annotation), then walks it with ``jsonable_encoder`` before encoding.
+For values built by this backend from its own ORM rows and analytics queries
+that is pure overhead: :func:`trusted` wraps them in a response that FastAPI
+sends as is. The ``response_model`` still documents the route in OpenAPI.
+"""
+import json
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Optional, Type
+
+from pydantic import BaseModel
+from starlette.responses import JSONResponse as StarletteJSONResponse
+
+from . import metrics
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text  # as pydantic and orjson write UTC
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON; datetimes as ISO 8601, Decimals as numbers."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                      default=_default).encode("utf-8")
+
+
+class JSONResponse(StarletteJSONResponse):
+    """Default response class of the app: Starlette's, encoded with :func:`dumps`."""
+
+    def render(self, content: Any) -> bytes:
+        if not metrics.SERVER_TIMING:
+            return dumps(content)
+        t0 = time.perf_counter()
+        body = dumps(content)
+        stats = metrics.request_stats()
+        if stats is not None:
+            stats.render_seconds += time.perf_counter() - t0
+        return body
+
+
+def trusted(content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    """Send ``content`` without response_model validation nor ``jsonable_encoder``."""
+    return JSONResponse(content, status_code=status_code, headers=headers)
+
+
+def fields(model: Type[BaseModel], obj: Any) -> Dict[str, Any]:
+    """The attributes of ``obj`` declared by ``model``: ``model.from_orm(obj)`` without the validation."""
+    return {name: getattr(obj, name) for name in model.model_fields}
@@ -0,0 +1,143 @@
+"""Maintenance of the ``feedback_rollups`` table.
+
+``create_feedback`` calls :func:`arecord` in its own transaction so the rollups
+stay in step with ``feedbacks``. :func:`rebuild` recomputes everything from the
+raw table, e.g. after a manual import (migrations 007 and 009 run it when the
+rollups do not add up to the raw tables)::
+
+    python -m backend.rollups rebuild
+"""
+import argparse
+from datetime import timezone
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import case, delete, func, insert, literal, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models, ratings
+from .analytics import day_expr, hour_expr, iter_rating_items, rating_rows, weekday_expr
+
+KEY_COLUMNS = ["day", "hour", "weekday", "type", "provider", "sector", "label"]
+COUNTER_COLUMNS = ["feedback_count", "rating_count", "rating_sum",
+                   "rating_1", "rating_2", "rating_3", "rating_4"]
+
+
+def rollup_rows(feedbacks: Iterable[Any]) -> List[Dict[str, Any]]:
+    """Rollup increments for freshly inserted feedbacks, merged by key.
+
+    Each feedback needs ``created_at``, ``type``, ``provider``, ``sector`` and
+    ``ratings`` attributes (ORM objects or ``RETURNING`` rows both work).
+    """
+    merged: Dict[Tuple, Dict[str, Any]] = {}
+
+    def bump(base: Tuple, label: str, **incs: int) -> None:
+        key = base + (label,)
+        row = merged.get(key)
+        if row is None:
+            row = dict(zip(KEY_COLUMNS, key))
+            row.update({c: 0 for c in COUNTER_COLUMNS})
+            merged[key] = row
+        for col, inc in incs.items():
+            row[col] += inc
+
+    for fb in feedbacks:
+        ts = fb.created_at
+        if ts.tzinfo is not None:
+            # psycopg2 returns the session TimeZone; buckets are UTC like rebuild()
+            ts = ts.astimezone(timezone.utc)
+        base = (ts.date(), ts.hour, ts.weekday(), fb.type, fb.provider or "", fb.sector or "")
+        bump(base, "", feedback_count=1)
+        for label, rating in iter_rating_items(fb.ratings):
+            bump(base, label, rating_count=1, rating_sum=rating, **{f"rating_{rating}": 1})
+    # sorted by key: concurrent upserts lock the same buckets in the same order
+    return [merged[key] for key in sorted(merged)]
+
+
+def upsert_statement(dialect: str, rows: List[Dict[str, Any]]):
+    """INSERT ... ON CONFLICT DO UPDATE adding ``rows`` onto existing buckets."""
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise NotImplementedError(f"rollups are not supported on {dialect}")
+    table = models.FeedbackRollup.__table__
+    stmt = dialect_insert(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=KEY_COLUMNS,
+        set_={c: table.c[c] + stmt.excluded[c] for c in COUNTER_COLUMNS},
+    )
+
+
+def record(db: Session, feedbacks: Iterable[Any]) -> None:
+    """Add the given feedbacks to the rollups (caller commits)."""
+    rows = rollup_rows(feedbacks)
+    if rows:
+        db.execute(upsert_statement(db.get_bind().dialect.name, rows))
+
+
+async def arecord(db: AsyncSession, feedbacks: Iterable[Any]) -> None:
+    """:func:`record` for the async write path."""
+    rows = rollup_rows(feedbacks)
+    if rows:
+        await db.execute(upsert_statement(db.get_bind().dialect.name, rows))
+
+
+def rebuild(db: Session) -> int:
+    """Recompute all rollups from ``feedbacks`` in SQL. Returns the bucket count.
+
+    ``feedback_ratings`` is re-exploded from the JSON first, so rows imported or
+    edited by hand are picked up; the rating buckets are then read from it.
+    """
+    fb = models.Feedback
+    table = models.FeedbackRollup.__table__
+    if db.get_bind().dialect.name == "postgresql":
+        # concurrent inserts wait until the rebuilt rows are committed; same
+        # table order as insert_feedbacks so the two cannot deadlock
+        db.execute(text("LOCK TABLE feedback_ratings, feedback_rollups IN EXCLUSIVE MODE"))
+    db.execute(delete(models.FeedbackRating.__table__))
+    ratings.backfill(db)
+    db.execute(delete(table))
+
+    day, hour, wd = day_expr(db, fb.created_at), hour_expr(db, fb.created_at), weekday_expr(db, fb.created_at)
+    sector = func.coalesce(fb.sector, "")
+    provider = func.coalesce(fb.provider, "")
+    zero = literal(0)
+    db.execute(insert(table).from_select(
+        KEY_COLUMNS + COUNTER_COLUMNS,
+        select(day, hour, wd, fb.type, provider, sector, literal(""),
+               func.count(), zero, zero, zero, zero, zero, zero)
+        .group_by(day, hour, wd, fb.type, provider, sector),
+    ))
+
+    items = rating_rows([])
+    day, hour, wd = day_expr(db, items.c.created_at), hour_expr(db, items.c.created_at), weekday_expr(db, items.c.created_at)
+    sector = func.coalesce(items.c.sector, "")
+    provider = func.coalesce(items.c.provider, "")
+    per_value = [func.sum(case((items.c.rating == v, 1), else_=0)) for v in (1, 2, 3, 4)]
+    db.execute(insert(table).from_select(
+        KEY_COLUMNS + COUNTER_COLUMNS,
+        select(day, hour, wd, items.c.type, provider, sector, items.c.label,
+               zero, func.count(), func.sum(items.c.rating), *per_value)
+        .group_by(day, hour, wd, items.c.type, provider, sector, items.c.label),
+    ))
+    db.commit()
+    return db.scalar(select(func.count()).select_from(table))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the feedback analytics rollups")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    from .db import SessionLocal
+    from .migrate import upgrade
+    upgrade()
+    with SessionLocal() as db:
+        n = rebuild(db)
+    print(f"Rebuilt feedback_rollups: {n} buckets")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,13 +10,15 @@ class Criterion(BaseModel):
 
 
 class FeedbackIn(BaseModel):
-    type: str = Field(..., description="fixe|mobile|ciperf")
-    provider: Optional[str] = ""
+    # lengths of the columns: a longer value is a 422 here, not a failed INSERT
+    # after a buffered 202 (see backend.ingest)
+    type: str = Field(..., max_length=20, description="fixe|mobile|ciperf")
+    provider: Optional[str] = Field("", max_length=255)  # null is stored as ""
     ratings: List[Dict[str, Any]]
     comments: Optional[str] = ""
     attachment: Optional[str] = ""
-    nperf_test_id: Optional[str] = None
-    sector: Optional[str] = None
+    nperf_test_id: Optional[str] = Field(None, max_length=255)
+    sector: Optional[str] = Field(None, max_length=255)
 
 
 class FeedbackOut(BaseModel):
@@ -34,9 +36,9 @@ class FeedbackOut(BaseModel):
 
 
 class NPerfResultIn(BaseModel):
-    nperf_test_id: Optional[str] = None
-    external_uuid: Optional[str] = None
-    sector: Optional[str] = None
+    nperf_test_id: Optional[str] = Field(None, max_length=255)
+    external_uuid: Optional[str] = Field(None, max_length=255)
+    sector: Optional[str] = Field(None, max_length=255)
 
 
 class NPerfResultOut(BaseModel):
@@ -0,0 +1,205 @@
+"""Precompressed, cache-friendly serving of the static frontend (``source/``).
+
+At startup every file of the directory is read once and:
+
+- gets a strong ETag derived from the SHA-256 of its content;
+- except HTML pages, gets a fingerprinted alias ``name.<hash>.ext`` served with
+  ``Cache-Control: public, max-age=31536000, immutable``;
+- is precompressed with gzip and brotli (text types, when it saves bytes); the
+  variant is picked from ``Accept-Encoding``.
+
+References to local assets in the HTML pages and in CSS ``url()`` are rewritten
+to the fingerprinted names, so browsers only revalidate the pages (``no-cache``
+plus ``If-None-Match`` -> 304) and never refetch an unchanged script, stylesheet
+or image. The original names still work (embedded nPerf widget, image paths
+built in JS) with revalidation.
+
+Brotli needs the ``brotli`` package; without it only gzip is offered. Files are
+kept in memory (the whole frontend is a few hundred KB). ``STATIC_WATCH=true``
+rebuilds when a file changes, for frontend work with ``uvicorn --reload``.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+STATIC_WATCH = os.getenv("STATIC_WATCH", "false").lower() == "true"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESSIBLE = {
+    "text/html", "text/css", "text/javascript", "application/javascript", "application/json",
+    "image/svg+xml", "image/x-icon", "image/vnd.microsoft.icon", "text/plain",
+}
+HTML_REF = re.compile(r"""(\b(?:href|src)\s*=\s*)(["'])([^"']+)\2""")
+CSS_URL = re.compile(r"""url\(\s*(["']?)([^"')]+)\1\s*\)""")
+
+
+class Asset:
+    """One file and its encoded variants."""
+
+    def __init__(self, path: str, body: bytes, content_type: str):
+        self.path = path
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.bodies: Dict[str, bytes] = {"identity": body}
+        if content_type in COMPRESSIBLE:
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                self.bodies["gzip"] = gz
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    self.bodies["br"] = br
+
+    @property
+    def fingerprinted(self) -> str:
+        stem, ext = posixpath.splitext(self.path)
+        return f"{stem}.{self.digest[:10]}{ext}"
+
+    def etag(self, encoding: str) -> str:
+        # strong validators must differ between encodings of the same file
+        return f'"{self.digest[:32]}"' if encoding == "identity" else f'"{self.digest[:32]}-{encoding}"'
+
+
+def accepted_encodings(header: str) -> List[str]:
+    """Encodings of an Accept-Encoding header with a non-zero q value."""
+    out = []
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name and q > 0:
+            out.append(name.strip().lower())
+    return out
+
+
+def _is_local(ref: str) -> bool:
+    return not (ref.startswith(("#", "//", "data:")) or re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*:", ref))
+
+
+class StaticSite:
+    """In-memory copy of a static directory with fingerprinted aliases."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.assets: Dict[str, Tuple[Asset, bool]] = {}  # url path -> (asset, immutable)
+        self._signature: Optional[tuple] = None
+        self._lock = threading.Lock()
+        self.build()
+
+    def _scan(self) -> List[Tuple[str, int, int]]:
+        files = []
+        for root, _dirs, names in os.walk(self.directory):
+            for name in names:
+                full = os.path.join(root, name)
+                st = os.stat(full)
+                files.append((os.path.relpath(full, self.directory).replace(os.sep, "/"), st.st_mtime_ns, st.st_size))
+        return sorted(files)
+
+    def build(self) -> None:
+        files = self._scan()
+        raw: Dict[str, bytes] = {}
+        for rel, _mtime, _size in files:
+            with open(os.path.join(self.directory, rel), "rb") as f:
+                raw[rel] = f.read()
+
+        def kind(rel: str) -> int:
+            # plain files first so that CSS, then HTML, can point at their fingerprints
+            return 2 if rel.endswith(".html") else 1 if rel.endswith(".css") else 0
+
+        assets: Dict[str, Tuple[Asset, bool]] = {}
+        renamed: Dict[str, str] = {}
+        for rel in sorted(raw, key=lambda r: (kind(r), r)):
+            body = raw[rel]
+            if kind(rel) == 1:
+                body = self._rewrite(CSS_URL, body, rel, renamed, group=2)
+            elif kind(rel) == 2:
+                body = self._rewrite(HTML_REF, body, rel, renamed, group=3)
+            content_type = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+            asset = Asset(rel, body, content_type)
+            assets[rel] = (asset, False)
+            if kind(rel) != 2:
+                renamed[rel] = asset.fingerprinted
+                assets[asset.fingerprinted] = (asset, True)
+        self.assets = assets
+        self._signature = tuple(files)
+
+    @staticmethod
+    def _rewrite(pattern: "re.Pattern", body: bytes, rel: str, renamed: Dict[str, str], group: int) -> bytes:
+        base = posixpath.dirname(rel)
+
+        def repl(m: "re.Match") -> str:
+            ref = m.group(group)
+            if not _is_local(ref):
+                return m.group(0)
+            path, suffix = re.match(r"([^?#]*)(.*)", ref).groups()
+            target = path.lstrip("/") if path.startswith("/") else posixpath.normpath(posixpath.join(base, path))
+            if target not in renamed:
+                return m.group(0)
+            start, end = m.span(group)
+            new_ref = "/" + renamed[target] + suffix
+            return m.group(0)[: start - m.start()] + new_ref + m.group(0)[end - m.start():]
+
+        return pattern.sub(repl, body.decode("utf-8")).encode("utf-8")
+
+    def lookup(self, path: str) -> Optional[Tuple[Asset, bool]]:
+        if STATIC_WATCH:
+            with self._lock:
+                if tuple(self._scan()) != self._signature:
+                    self.build()
+        path = path.lstrip("/")
+        if path == "" or path.endswith("/"):
+            path += "index.html"
+        return self.assets.get(path) or self.assets.get(path + "/index.html")
+
+    def response(self, request: Request, path: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        """Serve ``path`` (relative to the directory) honouring Accept-Encoding and If-None-Match."""
+        found = self.lookup(path)
+        if found is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        asset, immutable = found
+        encoding = "identity"
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        for candidate in ("br", "gzip"):
+            if candidate in asset.bodies and candidate in accepted:
+                encoding = candidate
+                break
+
+        etag = asset.etag(encoding)
+        out = {"ETag": etag, "Cache-Control": IMMUTABLE if immutable else REVALIDATE}
+        if len(asset.bodies) > 1:
+            out["Vary"] = "Accept-Encoding"
+        out.update(headers or {})
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+            if "*" in tags or etag in tags:
+                return Response(status_code=304, headers=out)
+
+        body = asset.bodies[encoding]
+        if encoding != "identity":
+            out["Content-Encoding"] = encoding
+        media_type = asset.content_type
+        if media_type.startswith("text/") or media_type in ("application/javascript", "image/svg+xml"):
+            media_type += "; charset=utf-8"
+        out["Content-Length"] = str(len(body))
+        return Response(b"" if request.method == "HEAD" else body, media_type=media_type, headers=out)
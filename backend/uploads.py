@@ -0,0 +1,159 @@
+"""Streaming attachment uploads for ``POST /api/upload``.
+
+The multipart body is parsed as it arrives (no spooled copy of the whole form)
+and the ``file`` part is written to a temporary file in ``UPLOAD_CHUNK_BYTES``
+chunks from the threadpool, so a worker holds O(chunk) bytes per upload and the
+event loop never waits on the disk. Bodies announcing more than
+``UPLOAD_MAX_BYTES`` are refused with 413 before anything is read; chunked
+bodies are cut off as soon as they cross the limit.
+
+Files are stored as ``<sha256><ext>``: a retried upload of the same attachment
+maps onto the file already stored and is not written twice.
+"""
+import hashlib
+import os
+import tempfile
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from fastapi import HTTPException
+from python_multipart import MultipartParser
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(256 * 1024)))
+FIELD_NAME = "file"
+MULTIPART_OVERHEAD = 16 * 1024  # boundaries and part headers on top of the file itself
+
+# requestBody of the route, which reads the raw stream instead of a File() parameter
+OPENAPI_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {FIELD_NAME: {"type": "string", "format": "binary"}},
+            "required": [FIELD_NAME],
+        }}},
+    }
+}
+
+
+def _extension(filename: str) -> str:
+    ext = os.path.splitext(filename)[1].lower()
+    ext = "".join(c for c in ext[1:] if c.isalnum())[:10]
+    return f".{ext}" if ext else ".bin"
+
+
+def _write(f: BinaryIO, digest, data: bytes) -> None:
+    f.write(data)
+    digest.update(data)
+
+
+def _store(f: BinaryIO, tmp_path: str, path: str) -> bool:
+    """Move the finished temp file into place; True when the content was already stored."""
+    f.close()
+    if os.path.exists(path):
+        os.unlink(tmp_path)
+        return True
+    os.chmod(tmp_path, 0o644)  # mkstemp creates 0600 files
+    os.replace(tmp_path, path)  # atomic: concurrent identical uploads end up as one file
+    return False
+
+
+def _discard(f: BinaryIO, tmp_path: str) -> None:
+    f.close()
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+
+
+class _FilePart:
+    """Parser callbacks keeping only the bytes of the first ``file`` part, one chunk at a time."""
+
+    def __init__(self):
+        self.pending = bytearray()
+        self.filename: Optional[str] = None
+        self.size = 0
+        self.done = False
+        self._in_file = False
+        self._headers: List[bytes] = []
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_part_begin(self) -> None:
+        self._headers = []
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._headers.append(self._header_value)
+        self._header_name = self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        self._in_file = False
+        if self.done or self.filename is not None or not self._headers:
+            return
+        _, options = parse_options_header(self._headers[0])
+        if options.get(b"name") == FIELD_NAME.encode() and b"filename" in options:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self._in_file = True
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self.pending += data[start:end]
+            self.size += end - start
+
+    def on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self.done = True
+
+    def callbacks(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in (
+            "on_part_begin", "on_header_field", "on_header_value", "on_header_end",
+            "on_headers_finished", "on_part_data", "on_part_end")}
+
+
+async def save_upload(request: Request, upload_dir: str, max_bytes: int = UPLOAD_MAX_BYTES) -> Dict[str, Any]:
+    """Store the ``file`` field of a multipart request; returns its name and URL."""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"Upload larger than {max_bytes} bytes")
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+
+    part = _FilePart()
+    parser = MultipartParser(params[b"boundary"], part.callbacks())
+    digest = hashlib.sha256()
+    fd, tmp_path = await run_in_threadpool(tempfile.mkstemp, dir=upload_dir, prefix=".upload-")
+    f = os.fdopen(fd, "wb")
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if part.size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Upload larger than {max_bytes} bytes")
+            if len(part.pending) >= UPLOAD_CHUNK_BYTES:
+                data, part.pending = bytes(part.pending), bytearray()
+                await run_in_threadpool(_write, f, digest, data)
+        parser.finalize()
+        if part.filename is None:
+            raise HTTPException(status_code=400, detail=f"Missing '{FIELD_NAME}' file field")
+        if not part.done:  # the body ended inside the file part
+            raise HTTPException(status_code=400, detail="Truncated multipart body")
+        await run_in_threadpool(_write, f, digest, bytes(part.pending))
+        name = digest.hexdigest() + _extension(part.filename)
+        duplicate = await run_in_threadpool(_store, f, tmp_path, os.path.join(upload_dir, name))
+    except MultipartParseError as e:
+        await run_in_threadpool(_discard, f, tmp_path)
+        raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+    except BaseException:
+        await run_in_threadpool(_discard, f, tmp_path)
+        raise
+    return {"filename": name, "url": f"/uploads/{name}", "size": part.size, "duplicate": duplicate}
@@ -0,0 +1,198 @@
+"""Benchmarks of the analytics hot paths at several database sizes.
+
+For each ``--sizes`` value (default 10k, 100k and 1M feedbacks) the database is
+grown to that many synthetic rows (``generate.py``), then the script times:
+
+- ``python:*`` — the pure-Python paths of the write and dashboard code:
+  ``iter_rating_items`` and ``rollups.rollup_rows`` over as many feedbacks,
+  and each panel function over the dashboard facts;
+- ``sql:*`` — ``analytics.load_facts`` and every ``analytics.*`` endpoint
+  function, unfiltered and with a provider + last-30-days filter;
+- ``http:*`` — every ``GET /api/analytics/*`` route and ``GET /api/feedback``
+  in-process (validation and JSON encoding included, cache off);
+- ``numpy:*`` — the same ``analytics.*`` functions answered by the in-memory
+  columnar engine (``backend.columnar``), plus its full load, when numpy is
+  installed.
+
+Results (min/median/max in ms over ``--repeat`` runs) go to ``--output`` as
+JSON, with the commit, Python and database versions; compare two runs with
+``compare.py``::
+
+    python benchmarks/analytics_bench.py --output bench-sqlite.json
+    python benchmarks/analytics_bench.py --database-url postgresql://... --reset --output bench-pg.json
+    python benchmarks/compare.py old.json bench-sqlite.json
+
+Without ``--database-url`` a fresh SQLite file is used. ``--reset`` drops every
+table of the given database first.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import generate  # noqa: E402
+
+POOL_SIZE = 10000  # distinct synthetic feedbacks cycled through by the Python benchmarks
+ROLLUP_BATCH = 500  # rows per insert_feedbacks call with the default INGEST_BATCH_SIZE
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - t0) * 1000)
+    return {
+        "min_ms": round(min(runs), 3),
+        "median_ms": round(statistics.median(runs), 3),
+        "max_ms": round(max(runs), 3),
+        "runs": repeat,
+    }
+
+
+def git_commit(app_dir: str) -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=app_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def python_benchmarks(size: int, pool: List[SimpleNamespace]) -> Dict[str, Callable[[], Any]]:
+    from backend import rollups
+    from backend.analytics import iter_rating_items
+
+    def rating_items():
+        n = len(pool)
+        for i in range(size):
+            for _ in iter_rating_items(pool[i % n].ratings):
+                pass
+
+    def rollup_rows():
+        n = len(pool)
+        for start in range(0, size, ROLLUP_BATCH):
+            rollups.rollup_rows(pool[i % n] for i in range(start, min(size, start + ROLLUP_BATCH)))
+
+    return {"python:iter_rating_items": rating_items, "python:rollup_rows": rollup_rows}
+
+
+def db_benchmarks(db, client) -> Dict[str, Callable[[], Any]]:
+    from backend import analytics
+
+    out: Dict[str, Callable[[], Any]] = {}
+    facts = analytics.load_facts(db, analytics.DASHBOARD_DIMS)
+    out["python:panels.summary"] = lambda: analytics.summary_panel(facts)
+    out["python:panels.criteria"] = lambda: analytics.criteria_panel(facts)
+    out["python:panels.time_series"] = lambda: analytics.time_series_panel(facts, 30)
+    out["python:panels.heatmap"] = lambda: analytics.heatmap_panel(facts)
+    out["python:panels.criteria_over_time"] = lambda: analytics.criteria_over_time_panel(facts, 30)
+
+    out["sql:load_facts.dashboard"] = lambda: analytics.load_facts(db, analytics.DASHBOARD_DIMS)
+    month_ago = str(date.today() - timedelta(days=30))
+    filters = {"start_date": month_ago, "provider_filter": "MTN"}
+    for name in ("summary", "criteria", "time_series", "heatmap", "criteria_over_time", "dashboard"):
+        fn = getattr(analytics, name)
+        out[f"sql:{name}"] = lambda fn=fn: fn(db)
+        out[f"sql:{name}[provider,30d]"] = lambda fn=fn: fn(db, **filters)
+        out[f"http:/api/analytics/{name}"] = lambda name=name: client.get(f"/api/analytics/{name}")
+        out[f"http:/api/analytics/{name}?provider&start_date"] = lambda name=name: client.get(
+            f"/api/analytics/{name}", params={"provider": "MTN", "start_date": month_ago})
+    out["http:/api/feedback?limit=50"] = lambda: client.get("/api/feedback", params={"limit": 50, "total": "none"})
+
+    from backend import columnar
+    if columnar.np is not None:
+        store = columnar.load()
+        out["numpy:load"] = columnar.load
+        for name in ("summary", "criteria", "time_series", "heatmap", "criteria_over_time", "dashboard"):
+            fn = getattr(store, name)
+            out[f"numpy:{name}"] = lambda fn=fn: fn(db)
+            out[f"numpy:{name}[provider,30d]"] = lambda fn=fn: fn(db, **filters)
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="default: a fresh SQLite file")
+    parser.add_argument("--app-dir", default=generate.REPO_DIR, help="checkout to benchmark")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated feedback counts")
+    parser.add_argument("--months", type=int, default=6, help="time span of the synthetic feedbacks")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--reset", action="store_true", help="drop every table of --database-url first")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+    tmp = tempfile.TemporaryDirectory()
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmp.name, 'bench.db')}"
+    app_dir = os.path.abspath(args.app_dir)
+    os.environ["ANALYTICS_CACHE"] = "off"  # measure the queries, not the cache
+    generate.use_backend(database_url, app_dir)
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, select
+
+    from backend import models
+    from backend.db import SessionLocal, engine
+
+    generate.populate(0, reset=args.reset)
+    from backend.main import app
+
+    rnd = random.Random(args.seed)
+    now = datetime.utcnow()
+    pool = [SimpleNamespace(**generate.feedback_payload(rnd), created_at=generate.created_at(rnd, now, args.months))
+            for _ in range(POOL_SIZE)]
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "commit": git_commit(app_dir),
+            "started_at": now.isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "server_version": ".".join(map(str, engine.dialect.server_version_info or ())),
+            "months": args.months,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "populate": [],
+        "results": [],
+    }
+    with TestClient(app) as client:
+        for size in sizes:
+            with SessionLocal() as db:
+                current = db.scalar(select(func.count()).select_from(models.Feedback))
+            if current > size:
+                parser.error(f"the database already holds {current} feedbacks (> {size}); use --reset")
+            if current < size:
+                print(f"Generating {size - current} feedbacks...", flush=True)
+                timings = generate.populate(size - current, args.months, args.seed)
+                report["populate"].append({"size": size, **timings})
+
+            with SessionLocal() as db:
+                benches = python_benchmarks(size, pool)
+                benches.update(db_benchmarks(db, client))
+                for name, fn in benches.items():
+                    fn()  # warm up (plans, caches, imports)
+                    result = {"size": size, "name": name, **timed(fn, args.repeat)}
+                    report["results"].append(result)
+                    print(f"{size:>9} {name:<58} {result['median_ms']:>10.2f} ms", flush=True)
+    tmp.cleanup()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare two benchmark result files and flag regressions.
+
+Works on the JSON written by ``analytics_bench.py`` and ``write_load.py``:
+every ``*_ms`` value of the new file is compared with the same entry of the
+old one (``median_ms`` and the ``p50_ms``/``p95_ms`` percentiles, not the
+noisy min/max)::
+
+    python benchmarks/compare.py v1.4.json v1.5.json --threshold 20
+
+Exits with status 1 when an entry got slower by more than ``--threshold`` percent.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict
+
+COMPARED = ("median_ms", "p50_ms", "p95_ms")
+
+
+def flatten(data: Any, prefix: str = "") -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key in COMPARED and isinstance(value, (int, float)):
+                out[f"{prefix}{key}"] = float(value)
+            elif key != "meta":
+                out.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        for i, item in enumerate(data):
+            if isinstance(item, dict) and "name" in item:
+                name = f"{item['size']}:{item['name']}" if "size" in item else str(item["name"])
+                out.update(flatten(item, f"{prefix}{name} "))
+            else:
+                out.update(flatten(item, f"{prefix}{i}."))
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=20.0, help="percent slower counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = flatten(json.load(f))
+    with open(args.new) as f:
+        new = flatten(json.load(f))
+
+    regressions = 0
+    for key in sorted(new):
+        if key not in old:
+            print(f"{'new':>9}  {key}: {new[key]:.2f} ms")
+            continue
+        before, after = old[key], new[key]
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{change:>+8.1f}%  {key}: {before:.2f} -> {after:.2f} ms{flag}")
+    for key in sorted(set(old) - set(new)):
+        print(f"{'gone':>9}  {key}")
+    if regressions:
+        print(f"{regressions} regression(s) above {args.threshold}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Synthetic feedback generator for the benchmarks.
+
+Fills a database with feedbacks shaped like the ones the frontend posts
+(``schemas.FeedbackIn``): the types, providers and ``crit-*`` criteria of
+``source/main.js``, the sectors of the nPerf widget, comments and attachments
+on a share of them. Timestamps are spread over the last ``--months`` months,
+busier in the daytime and on weekdays. The rating rows and rollups are then
+rebuilt, exactly as after a manual import::
+
+    python benchmarks/generate.py --rows 100000
+    python benchmarks/generate.py --rows 1000000 --database-url postgresql://... --reset
+
+Rows are appended: run it again to grow the same database. The same ``--seed``
+produces the same rows (timestamps are relative to now).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+PROVIDERS = {
+    "mobile": ["ORANGE", "MTN", "MOOV"],
+    "fixe": ["ORANGE", "MTN", "MOOV", "GVA", "CI DATA", "VIPNET", "KONNECT AFRICA", "DATACONNECT"],
+    "ciperf": [""],
+}
+CRITERIA = {
+    "mobile": ["Disponibilité du service", "Qualité d’appel voix", "Envoi/réception SMS",
+               "Disponibilité de l’Internet", "Vitesse de navigation web", "Qualité lecture video",
+               "Consommation de crédit ou forfait", "Disponibilité/Qualité du SAV"],
+    "fixe": ["Disponibilité du réseau", "Qualité d’appel voix", "Disponibilité de l’Internet",
+             "Vitesse de navigation web", "Qualité lecture video", "Disponibilité/Qualité du SAV"],
+    "ciperf": ["Facilité d’installation", "Facilité d’utilisation", "Design graphique", "Satisfaction"],
+}
+SECTORS = ["Consommateur / Société civile", "Administration / Service public", "Régions / Collectivités",
+           "Entreprise / Secteur privé", "Secteur Santé", "Secteur Education", "Presse / Médias",
+           "ARTCI", "Autres"]
+COMMENTS = ["Réseau instable le soir", "Coupures fréquentes", "Très bon débit", "SAV injoignable",
+            "Forfait consommé trop vite", "RAS"]
+
+TYPE_WEIGHTS = [("mobile", 0.65), ("fixe", 0.3), ("ciperf", 0.05)]
+# share of the traffic per hour of the day (UTC = Abidjan time), peaks at noon and in the evening
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 6, 8, 9, 9, 10, 11, 10, 9, 9, 9, 10, 12, 13, 12, 9, 5, 2]
+
+
+def feedback_payload(rnd: random.Random) -> Dict[str, Any]:
+    """One ``POST /api/feedback`` body."""
+    kind = rnd.choices([t for t, _ in TYPE_WEIGHTS], [w for _, w in TYPE_WEIGHTS])[0]
+    # each provider gets its own mean rating, so the dashboard has something to show
+    provider = rnd.choice(PROVIDERS[kind])
+    bias = (sum(map(ord, provider)) % 5 - 2) * 0.3
+    criteria = CRITERIA[kind]
+    ratings = []
+    for i, label in enumerate(criteria[:rnd.randint(max(1, len(criteria) - 3), len(criteria))], start=1):
+        rating = min(4, max(1, round(rnd.gauss(2.6 + bias, 0.9))))
+        ratings.append({f"crit-{i}": {"label": label, "sublabel": "", "rating": str(rating)}})
+    return {
+        "type": kind,
+        "provider": provider,
+        "ratings": ratings,
+        "comments": rnd.choice(COMMENTS) if rnd.random() < 0.25 else "",
+        "attachment": f"{uuid.UUID(int=rnd.getrandbits(128)).hex}.jpg" if rnd.random() < 0.03 else "",
+        "nperf_test_id": str(rnd.randint(10 ** 8, 10 ** 9)) if kind == "ciperf" or rnd.random() < 0.1 else None,
+        "sector": rnd.choice(SECTORS) if rnd.random() < 0.4 else None,
+    }
+
+
+def created_at(rnd: random.Random, now: datetime, months: int) -> datetime:
+    """A timestamp in the last ``months`` months, following HOUR_WEIGHTS, fewer on weekends."""
+    while True:
+        day = now - timedelta(days=rnd.randrange(max(1, months * 30)))
+        if day.weekday() < 5 or rnd.random() < 0.6:
+            break
+    hour = rnd.choices(range(24), HOUR_WEIGHTS)[0]
+    ts = day.replace(hour=hour, minute=rnd.randrange(60), second=rnd.randrange(60), microsecond=0)
+    return min(ts, now)
+
+
+def payloads(n: int, seed: int = 42) -> Iterator[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    for _ in range(n):
+        yield feedback_payload(rnd)
+
+
+def use_backend(database_url: Optional[str], app_dir: str = REPO_DIR) -> None:
+    """Make ``import backend`` load ``app_dir`` bound to ``database_url``.
+
+    ``backend.db`` reads DATABASE_URL once, at import: call this before.
+    """
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, app_dir)
+
+
+def populate(rows: int, months: int = 6, seed: int = 42, chunk: int = 5000,
+             reset: bool = False) -> Dict[str, Any]:
+    """Append ``rows`` synthetic feedbacks, then rebuild ratings and rollups.
+
+    Call :func:`use_backend` first. Returns timings in seconds.
+    """
+    from sqlalchemy import func, insert, select
+
+    from backend import ingest, migrate, models, rollups, schemas
+    from backend.db import SessionLocal
+
+    if reset:
+        migrate.reset()
+    migrate.upgrade()
+    with SessionLocal() as db:
+        existing = db.scalar(select(func.count()).select_from(models.Feedback))
+    # a different stream per batch of appended rows, so a second run does not repeat the first
+    rnd = random.Random(seed + existing)
+    now = datetime.utcnow()
+    timings: Dict[str, Any] = {"rows": rows, "existing": existing}
+    if not rows:
+        return timings
+
+    t0 = time.perf_counter()
+    with SessionLocal() as db:
+        batch: List[Dict[str, Any]] = []
+        for i in range(rows):
+            row = ingest.feedback_values(schemas.FeedbackIn(**feedback_payload(rnd)))
+            row["created_at"] = created_at(rnd, now, months)
+            batch.append(row)
+            if len(batch) == chunk or i == rows - 1:
+                db.execute(insert(models.Feedback), batch)
+                db.commit()
+                batch = []
+    timings["insert_seconds"] = round(time.perf_counter() - t0, 3)
+
+    t0 = time.perf_counter()
+    with SessionLocal() as db:
+        timings["rollup_buckets"] = rollups.rebuild(db)
+    timings["rebuild_seconds"] = round(time.perf_counter() - t0, 3)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url", help="default: DATABASE_URL, else ./app.db")
+    parser.add_argument("--app-dir", default=REPO_DIR, help="checkout whose backend package is used")
+    parser.add_argument("--reset", action="store_true", help="drop every table first")
+    args = parser.parse_args()
+
+    use_backend(args.database_url, os.path.abspath(args.app_dir))
+    timings = populate(args.rows, args.months, args.seed, reset=args.reset)
+    print(f"Inserted {args.rows} feedbacks in {timings['insert_seconds']} s "
+          f"(now {timings['existing'] + args.rows}); rebuilt {timings['rollup_buckets']} rollup buckets "
+          f"in {timings['rebuild_seconds']} s")
+
+
+if __name__ == "__main__":
+    main()
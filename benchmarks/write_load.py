@@ -0,0 +1,200 @@
+"""HTTP load benchmark against a local uvicorn.
+
+Starts uvicorn on a fresh database, fires concurrent requests and prints the
+throughput and latency percentiles. Scenarios (``--endpoint``):
+
+- ``feedback``, ``nperf``, ``mixed``: POST /api/feedback and/or POST /api/nperf/results;
+- ``dashboard``: dashboard reads (``/api/analytics/dashboard`` and the single
+  panels with random filters, ``/api/feedback`` pages) mixed with feedback
+  POSTs, ``--read-ratio`` of them reads. ``--seed-rows`` fills the database
+  with synthetic feedbacks first (``generate.py``).
+
+Point ``--app-dir`` at another checkout (e.g. a ``git worktree`` of an older
+commit) to compare before/after, with ``compare.py`` on the ``--output`` files:
+
+    python benchmarks/write_load.py --requests 3000 --concurrency 64
+    python benchmarks/write_load.py --endpoint dashboard --seed-rows 100000 --output load.json
+    git worktree add /tmp/artci-old <commit>
+    python benchmarks/write_load.py --app-dir /tmp/artci-old --requests 3000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+import httpx
+
+from generate import REPO_DIR, feedback_payload
+
+DASHBOARD_PANELS = ["summary", "criteria", "time_series", "heatmap", "criteria_over_time"]
+
+
+def dashboard_read(rnd: random.Random) -> tuple:
+    """(url, params) of one dashboard read, filtered like a user would."""
+    params = {}
+    if rnd.random() < 0.5:
+        params["start_date"] = str(date.today() - timedelta(days=rnd.choice([7, 30, 90])))
+    if rnd.random() < 0.3:
+        params["provider"] = rnd.choice(["ORANGE", "MTN", "MOOV"])
+    if rnd.random() < 0.3:
+        params["type"] = rnd.choice(["mobile", "fixe"])
+    roll = rnd.random()
+    if roll < 0.5:
+        return "/api/analytics/dashboard", params
+    if roll < 0.8:
+        return f"/api/analytics/{rnd.choice(DASHBOARD_PANELS)}", params
+    return "/api/feedback", {"limit": 50, **{k: v for k, v in params.items() if k != "start_date"}}
+
+
+def nperf_payload(rnd: random.Random) -> dict:
+    # a device uuid, so that every POST goes through the upsert on (external_uuid, nperf_test_id)
+    return {"nperf_test_id": str(rnd.randint(1, 10 ** 9)), "external_uuid": uuid.UUID(int=rnd.getrandbits(128)).hex,
+            "sector": "Sante"}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app_dir: str, database_url: str, port: int, workers: int) -> subprocess.Popen:
+    env = dict(os.environ, DATABASE_URL=database_url)
+    # every request comes from one address: measure the server, not the per-client limit
+    env.setdefault("RATE_LIMIT_BACKEND", "off")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=app_dir, env=env,
+    )
+
+
+async def wait_ready(base: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(base + "/api/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+
+    def pct(p: float) -> float:
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+    }
+
+
+async def run_load(base: str, endpoint: str, total: int, concurrency: int, read_ratio: float = 0.8) -> dict:
+    rnd = random.Random(42)
+    latencies = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    remaining = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as client:
+        async def worker():
+            for i in remaining:
+                kind, params, body = "write", None, None
+                if endpoint == "dashboard" and rnd.random() < read_ratio:
+                    kind = "read"
+                    url, params = dashboard_read(rnd)
+                elif endpoint == "nperf" or (endpoint == "mixed" and i % 2):
+                    url, body = "/api/nperf/results", nperf_payload(rnd)
+                else:
+                    url, body = "/api/feedback", feedback_payload(rnd)
+                t0 = time.perf_counter()
+                try:
+                    if kind == "read":
+                        r = await client.get(url, params=params)
+                    else:
+                        r = await client.post(url, json=body)
+                    ok = r.status_code < 300
+                except httpx.HTTPError:
+                    ok = False
+                latencies[kind].append(time.perf_counter() - t0)
+                if not ok:
+                    errors[kind] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    result = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        **summarize(latencies["read"] + latencies["write"], errors["read"] + errors["write"], elapsed),
+    }
+    if endpoint == "dashboard":
+        result["by_kind"] = {kind: summarize(latencies[kind], errors[kind], elapsed)
+                             for kind in ("read", "write") if latencies[kind]}
+    return result
+
+
+def seed(app_dir: str, database_url: str, rows: int) -> None:
+    """Fill the database before the server starts (own process: backend binds DATABASE_URL at import)."""
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "generate.py"),
+                    "--rows", str(rows), "--database-url", database_url, "--app-dir", app_dir], check=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-dir", default=REPO_DIR, help="checkout to benchmark")
+    parser.add_argument("--database-url", help="default: a fresh SQLite file")
+    parser.add_argument("--endpoint", choices=["feedback", "nperf", "mixed", "dashboard"], default="feedback")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--read-ratio", type=float, default=0.8, help="share of reads in the dashboard scenario")
+    parser.add_argument("--seed-rows", type=int, default=0, help="synthetic feedbacks inserted before the run")
+    parser.add_argument("--output", help="write the result as JSON to this file")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmp.name, 'bench.db')}"
+    if args.seed_rows:
+        seed(os.path.abspath(args.app_dir), database_url, args.seed_rows)
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = start_server(os.path.abspath(args.app_dir), database_url, port, args.workers)
+    try:
+        asyncio.run(wait_ready(base))
+        result = asyncio.run(run_load(base, args.endpoint, args.requests, args.concurrency, args.read_ratio))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        tmp.cleanup()
+
+    result["app_dir"] = os.path.abspath(args.app_dir)
+    result["database"] = database_url.split("://", 1)[0]
+    result["seed_rows"] = args.seed_rows
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -60,3 +60,14 @@ Create the name of the service account to use
 {{- default "default" .Values.serviceAccount.name }}
 {{- end }}
 {{- end }}
+
+{{/*
+DATABASE_URL of the app and of its jobs
+*/}}
+{{- define "artci.databaseUrl" -}}
+{{- if .Values.postgresql.enabled -}}
+postgresql://{{ .Values.postgresql.auth.username }}:{{ .Values.postgresql.auth.password }}@{{ .Release.Name }}-postgresql:5432/{{ .Values.postgresql.auth.database }}
+{{- else -}}
+{{ .Values.env.DATABASE_URL }}
+{{- end -}}
+{{- end }}
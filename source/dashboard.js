@@ -24,6 +24,15 @@
 
   function sum(arr) { return arr.reduce((a, b) => a + b, 0); }
   function safeNum(n) { return Number.isFinite(n) ? n : 0; }
+  // 2 decimals like the backend's round(x, 2): toFixed rounds the exact binary
+  // value; exact ties (multiples of 1/8 such as 3.125) go to the even digit
+  function round2(x) {
+    if (Number.isInteger(x * 8) && (x * 200) % 2 === 1) {
+      const f = Math.floor(x * 100);
+      return (f % 2 ? f + 1 : f) / 100;
+    }
+    return Number(x.toFixed(2));
+  }
   function by(arr, key) { const m = new Map(); arr.forEach(o => m.set(o[key], o)); return m; }
 
   function buildQuery(params) {
@@ -84,6 +93,12 @@
     if (charts[key]) { charts[key].destroy(); charts[key] = null; }
   }
 
+  // Last dashboard response and the filters it was loaded with; live deltas update it in place
+  let state = null;
+  let activeParams = {};
+  let loading = false;
+  let renderTimer = null;
+
   async function loadAndRender() {
     const params = {
       start_date: fStart?.value || undefined,
@@ -93,24 +108,29 @@
     };
 
     // Fetch analytics data with filters
-    let summary, criteria, timeseries, heatmap, criteriaOverTime;
+    // All panels come from one combined request
+    loading = true;
     try {
-      [summary, criteria, timeseries, heatmap, criteriaOverTime] = await Promise.all([
-        getJSON('/api/analytics/summary' + buildQuery(params)),
-        getJSON('/api/analytics/criteria' + buildQuery(params)),
-        getJSON('/api/analytics/time_series' + buildQuery({ ...params, days: 30 })),
-        getJSON('/api/analytics/heatmap' + buildQuery(params)),
-        getJSON('/api/analytics/criteria_over_time' + buildQuery({ ...params, days: 30 })),
-      ]);
+      // columnar time series: parallel arrays, smaller to send and to parse
+      state = await getJSON('/api/analytics/dashboard' + buildQuery({ ...params, days: 30, shape: 'columns' }));
+      activeParams = params;
     } catch (err) {
       console.error('Analytics fetch failed', err);
+      state = null;
       document.getElementById('kpi-total').textContent = '0';
       document.getElementById('kpi-providers').textContent = '0';
       document.getElementById('kpi-avg').textContent = '0.0';
       document.getElementById('kpi-good-share').textContent = '0%';
       ['distribution','timeseries','criteria','providers','heatmap','criteriaLines'].forEach(destroyChart);
       return;
+    } finally {
+      loading = false;
     }
+    render();
+  }
+
+  function render() {
+    const { summary, criteria, time_series: timeseries, heatmap, criteria_over_time: criteriaOverTime } = state;
 
     // KPIs
     const total = safeNum(summary.total_feedback || 0);
@@ -156,8 +176,8 @@
     // Time series (line)
     const tsCtx = document.getElementById('chart-timeseries');
     if (tsCtx) {
-      const labels = timeseries.map(p => p.date);
-      const data = timeseries.map(p => safeNum(p.count));
+      const labels = timeseries.date;
+      const data = timeseries.count.map(safeNum);
       destroyChart('timeseries');
       charts.timeseries = new Chart(tsCtx, {
         type: 'line',
@@ -247,15 +267,14 @@
     if (clCtx) {
       sizeCanvasToParent(clCtx);
       // Pivot by date -> label
-      const dates = Array.from(new Set(criteriaOverTime.map(r => r.date))).sort();
-      const labelsSet = new Set(criteriaOverTime.map(r => r.label));
-      const labels = Array.from(labelsSet).sort();
+      const dates = Array.from(new Set(criteriaOverTime.date)).sort();
+      const labels = Array.from(new Set(criteriaOverTime.label)).sort();
       const colorPool = [colors.purple, colors.teal, colors.pink, colors.amber, colors.blue, colors.bad, colors.ok];
 
-      const byDate = criteriaOverTime.reduce((acc, r) => {
-        (acc[r.date] ||= {})[r.label] = safeNum(r.avg);
-        return acc;
-      }, {});
+      const byDate = {};
+      criteriaOverTime.date.forEach((date, i) => {
+        (byDate[date] ||= {})[criteriaOverTime.label[i]] = safeNum(criteriaOverTime.avg[i]);
+      });
 
       const datasets = labels.map((lbl, i) => ({
         label: lbl,
@@ -281,6 +300,88 @@
     }
   }
 
+  // Live updates: the server pushes the rollup increments (one row per
+  // day/hour/type/provider/label bucket) of every new feedback
+  function matchesFilters(row, p) {
+    if (p.type && row.type !== p.type) return false;
+    if (p.provider && row.provider !== p.provider) return false;
+    if (p.start_date && row.day < p.start_date) return false;
+    if (p.end_date && row.day > p.end_date) return false;
+    return true;
+  }
+
+  function applyDelta(rows) {
+    const { summary, criteria, time_series: ts, heatmap, criteria_over_time: cot } = state;
+    const values = ['1', '2', '3', '4'];
+    for (const r of rows) {
+      if (!matchesFilters(r, activeParams)) continue;
+      if (r.label === '') {
+        // feedback counts
+        summary.total_feedback += r.feedback_count;
+        summary.by_type[r.type] = (summary.by_type[r.type] || 0) + r.feedback_count;
+        summary.by_provider[r.provider] = (summary.by_provider[r.provider] || 0) + r.feedback_count;
+        const i = ts.date.indexOf(r.day);
+        if (i >= 0) ts.count[i] += r.feedback_count;
+        else if (r.day > ts.date[ts.date.length - 1]) return loadAndRender(); // a new day: the window moved
+        const cell = heatmap[r.weekday * 24 + r.hour];
+        if (cell) cell.count += r.feedback_count;
+        continue;
+      }
+      // ratings of one criterion
+      values.forEach(v => { summary.rating_distribution[v] = (summary.rating_distribution[v] || 0) + r[`rating_${v}`]; });
+      let c = criteria.find(x => x.label === r.label);
+      if (!c) {
+        c = { label: r.label, count: 0, avg: 0, distribution: { '1': 0, '2': 0, '3': 0, '4': 0 } };
+        criteria.push(c);
+        criteria.sort((a, b) => (a.label < b.label ? -1 : a.label > b.label ? 1 : 0));
+      }
+      values.forEach(v => { c.distribution[v] += r[`rating_${v}`]; });
+      c.count += r.rating_count;
+      const total = values.reduce((acc, v) => acc + Number(v) * c.distribution[v], 0);
+      c.avg = c.count ? round2(total / c.count) : 0;
+      if (!ts.date.includes(r.day)) continue;
+      const j = cot.date.findIndex((d, k) => d === r.day && cot.label[k] === r.label);
+      if (j < 0) return loadAndRender(); // a criterion new to the window: one line per day to add
+      cot.count[j] += r.rating_count;
+      cot.sum[j] += r.rating_sum;
+      cot.avg[j] = round2(cot.sum[j] / cot.count[j]);
+    }
+    // redraw at most once a second however fast feedback arrives
+    if (!renderTimer) renderTimer = setTimeout(() => { renderTimer = null; if (state) render(); }, 1000);
+  }
+
+  // Full reloads: the real totals, so the panels cannot drift for long (events
+  // missed or published to another worker), and polling without a stream
+  const LIVE_REFRESH_MS = 5 * 60 * 1000;
+  const POLL_MS = 60 * 1000;
+  let refreshTimer = null;
+
+  function refreshEvery(ms) {
+    clearInterval(refreshTimer);
+    refreshTimer = setInterval(() => { if (!loading) loadAndRender(); }, ms);
+  }
+
+  function connectLive() {
+    if (!window.EventSource) return refreshEvery(POLL_MS);
+    const source = new EventSource('/api/analytics/stream');
+    let dropped = false;
+    refreshEvery(LIVE_REFRESH_MS);
+    source.addEventListener('delta', (e) => {
+      // a response being loaded already includes the feedback committed before it
+      if (state && !loading) applyDelta(JSON.parse(e.data).rows);
+    });
+    source.addEventListener('resync', () => loadAndRender());
+    source.onerror = () => {
+      dropped = true;
+      // refused (e.g. 404, live updates disabled): the browser will not retry
+      if (source.readyState === EventSource.CLOSED) refreshEvery(POLL_MS);
+    };
+    source.onopen = () => {
+      // events sent while disconnected are lost: reload once reconnected
+      if (dropped) { dropped = false; loadAndRender(); }
+    };
+  }
+
   // Bind filters
   fApply?.addEventListener('click', loadAndRender);
   fReset?.addEventListener('click', () => {
@@ -293,4 +394,5 @@
 
   // Initial render
   loadAndRender();
+  connectLive();
 })();
@@ -18,6 +18,17 @@
   }
 
   // Helpers
+  // 429/503 mean the server refused the request before processing it (rate
+  // limit, overload): send it again after Retry-After, a few times at most.
+  async function fetchWithRetry(url, options, attempts = 3) {
+    for (let i = 1; ; i++) {
+      const res = await fetch(url, options);
+      if ((res.status !== 429 && res.status !== 503) || i >= attempts) return res;
+      const seconds = Math.min(parseFloat(res.headers.get('Retry-After')) || 1, 10);
+      await new Promise(resolve => setTimeout(resolve, seconds * 1000 * (1 + Math.random() / 2)));
+    }
+  }
+
   const PROVIDERS = {
     mobile: ['ORANGE', 'MTN', 'MOOV'],
     fixe: ['ORANGE', 'MTN', 'MOOV', 'GVA', 'CI DATA', 'VIPNET', 'KONNECT AFRICA', 'DATACONNECT'],
@@ -446,7 +457,7 @@
       try {
         const fd = new FormData();
         fd.append('file', attachmentInput.files[0]);
-        const up = await fetch('/api/upload', { method: 'POST', body: fd });
+        const up = await fetchWithRetry('/api/upload', { method: 'POST', body: fd });
         if (up.ok) {
           const j = await up.json();
           attachmentName = j.filename || attachmentInput.files[0].name;
@@ -474,7 +485,7 @@
     };
 
     try {
-      const res = await fetch('/api/feedback', {
+      const res = await fetchWithRetry('/api/feedback', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(payload),
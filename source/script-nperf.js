@@ -701,7 +701,7 @@ class NPerfWidget {
         // Use configured API URL (auto-detected or overridden)
         const apiUrl = this.apiBaseUrl.replace(/\/$/, "") + '/api/nperf/results';
 
-        fetch(apiUrl, {
+        this.postWithRetry(apiUrl, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
@@ -711,6 +711,17 @@ class NPerfWidget {
         }).catch(err => console.error("Error saving result:", err));
     }
 
+    // 429/503: refused before processing (rate limit, overload). Wait for
+    // Retry-After and try again, a few times at most.
+    async postWithRetry(url, options, attempts = 3) {
+        for (let i = 1; ; i++) {
+            const res = await fetch(url, options);
+            if ((res.status !== 429 && res.status !== 503) || i >= attempts) return res;
+            const seconds = Math.min(parseFloat(res.headers.get('Retry-After')) || 1, 10);
+            await new Promise(resolve => setTimeout(resolve, seconds * 1000 * (1 + Math.random() / 2)));
+        }
+    }
+
     onGetLastResult(lastResult) {
         // console.log("[NPerfWidget] Last Result", lastResult);
 
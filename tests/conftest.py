@@ -0,0 +1,32 @@
+"""Settings read by ``backend`` at import time: a throwaway SQLite database
+unless ``DATABASE_URL`` is set (e.g. to run the suite against PostgreSQL)."""
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="artci-tests-"), "test.db"))
+os.environ.setdefault("ANALYTICS_CACHE", "off")
+
+
+@pytest.fixture
+def clean_db():
+    """Empty feedback and nPerf tables (the schema is migrated by importing ``backend.main``)."""
+    from sqlalchemy import delete
+
+    from backend import main, models  # noqa: F401
+    from backend.db import SessionLocal
+
+    with SessionLocal() as db:
+        for model in (models.FeedbackRating, models.FeedbackRollup, models.Feedback, models.NPerfResult):
+            db.execute(delete(model))
+        db.commit()
+
+
+@pytest.fixture(autouse=True)
+def fresh_async_pool():
+    """Each TestClient runs its own event loop; asyncpg connections cannot move between loops."""
+    from backend.db import async_engine
+
+    async_engine.sync_engine.dispose(close=False)
+    yield
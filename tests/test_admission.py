@@ -0,0 +1,174 @@
+import asyncio
+import os
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from backend import admission
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_gate_admits_up_to_its_limit():
+    async def scenario():
+        gate = admission.Gate("t", limit=2, queue_size=4, target=1.0)
+        assert await gate.acquire() is None
+        assert await gate.acquire() is None
+        assert gate.active == 2
+        gate.release()
+        gate.release()
+        assert gate.active == 0
+    run(scenario())
+
+
+def test_release_hands_the_slot_to_the_oldest_waiter():
+    async def scenario():
+        gate = admission.Gate("t", limit=1, queue_size=4, target=1.0)
+        assert await gate.acquire() is None
+        first = asyncio.ensure_future(gate.acquire())
+        second = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        assert gate.queued == 2
+        gate.release()
+        assert await first is None
+        assert not second.done()
+        assert gate.active == 1  # handed over, not released
+        gate.release()
+        assert await second is None
+        gate.release()
+        assert gate.active == 0 and gate.queued == 0
+    run(scenario())
+
+
+def test_queue_timeout_then_overload_shedding():
+    async def scenario():
+        gate = admission.Gate("t", limit=1, queue_size=4, target=0.05)
+        assert await gate.acquire() is None
+        assert await gate.acquire() == "queue_timeout"
+        assert gate.queued == 0
+        # refused at once for OVERLOAD_HOLD after a timeout
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        assert await gate.acquire() == "overloaded"
+        assert loop.time() - t0 < 0.05
+        gate.release()
+        assert await gate.acquire() is None  # a free slot is still given
+    run(scenario())
+
+
+def test_full_queue_is_refused():
+    async def scenario():
+        gate = admission.Gate("t", limit=1, queue_size=1, target=1.0)
+        assert await gate.acquire() is None
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        assert await gate.acquire() == "queue_full"
+        gate.release()
+        assert await waiter is None
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        gate = admission.Gate("t", limit=1, queue_size=4, target=1.0)
+        assert await gate.acquire() is None
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gate.queued == 0
+        gate.release()
+        assert gate.active == 0
+    run(scenario())
+
+
+def test_memory_bucket_refills_at_its_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    buckets = admission.MemoryBuckets()
+
+    async def scenario():
+        assert await buckets.take("k", 1.0, 2) == 0
+        assert await buckets.take("k", 1.0, 2) == 0
+        assert await buckets.take("k", 1.0, 2) == pytest.approx(1.0)
+        assert await buckets.take("other", 1.0, 2) == 0  # one bucket per key
+        now[0] += 0.5
+        assert await buckets.take("k", 1.0, 2) == pytest.approx(0.5)
+        now[0] += 0.5
+        assert await buckets.take("k", 1.0, 2) == 0
+    run(scenario())
+
+
+def test_memory_buckets_keep_at_most_max_keys():
+    buckets = admission.MemoryBuckets(max_keys=2)
+
+    async def scenario():
+        for key in ("a", "b", "c"):
+            await buckets.take(key, 1.0, 1)
+    run(scenario())
+    assert list(buckets._buckets) == ["b", "c"]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/api/feedback", ok, methods=["POST"]), Route("/api/health", ok)])
+    app.add_middleware(admission.AdmissionMiddleware)
+    monkeypatch.setattr(admission, "buckets", admission.MemoryBuckets())
+    monkeypatch.setattr(admission, "RATE_LIMITS", {"feedback": (1.0, 2)})
+    monkeypatch.setattr(admission, "gates", {"feedback": admission.Gate("feedback", 1, queue_size=4, target=0.05)})
+    monkeypatch.setattr(admission, "rate_limited", {})
+    return TestClient(app)
+
+
+def test_rate_limit_answers_429(client):
+    assert client.post("/api/feedback").status_code == 200
+    assert client.post("/api/feedback").status_code == 200
+    r = client.post("/api/feedback")
+    assert r.status_code == 429
+    assert r.headers["Retry-After"] == "1"
+    assert admission.rate_limited == {"feedback": 1}
+    # one bucket per client
+    assert client.post("/api/feedback", headers={"X-Real-IP": "x"}).status_code == 429
+    assert client.get("/api/health").status_code == 200  # not a write route
+
+
+def test_rate_limit_key_header(client, monkeypatch):
+    monkeypatch.setattr(admission, "RATE_LIMIT_KEY_HEADER", "x-client")
+    for _ in range(2):
+        assert client.post("/api/feedback", headers={"X-Client": "a"}).status_code == 200
+    assert client.post("/api/feedback", headers={"X-Client": "a"}).status_code == 429
+    assert client.post("/api/feedback", headers={"X-Client": "b"}).status_code == 200
+
+
+def test_busy_class_answers_503(client, monkeypatch):
+    monkeypatch.setattr(admission, "RATE_LIMITS", {})
+    gate = admission.gates["feedback"]
+    gate.active = gate.limit  # every slot taken by requests in flight
+    r = client.post("/api/feedback")
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+    assert client.post("/api/feedback").status_code == 503
+    assert gate.shed == {"queue_timeout": 1, "overloaded": 1}
+    gate.active = 0
+    assert client.post("/api/feedback").status_code == 200
+    assert gate.active == 0  # released after the response
+
+
+@pytest.mark.skipif("RATE_LIMITS" in os.environ, reason="RATE_LIMITS set for this run")
+def test_rate_limits_are_off_by_default():
+    assert admission.RATE_LIMITS == {}
+
+
+def test_rate_spec_parsing():
+    assert admission._parse("feedback=2/60, upload=0.5") == {"feedback": "2/60", "upload": "0.5"}
+    assert admission._rate("2/60") == (2.0, 60.0)
+    assert admission._rate("3") == (3.0, 3.0)
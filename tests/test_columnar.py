@@ -0,0 +1,98 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from backend import analytics, columnar, ingest, models
+from backend.db import AsyncSessionLocal, SessionLocal, async_engine
+
+pytest.importorskip("numpy")
+
+LABELS = ["Débit", "Couverture", "Appels", "Service client"]
+PANELS = ["summary", "criteria", "time_series", "heatmap", "criteria_over_time", "dashboard"]
+DAYS = 14
+TODAY = datetime.now(timezone.utc).date()
+FILTERS = [
+    {},
+    {"type_filter": "mobile"},
+    {"provider_filter": "Orange"},
+    {"provider_filter": ""},  # no filter, as in the SQL engine
+    {"type_filter": "satellite"},  # unknown value: empty panels
+    {"start_date": str(TODAY - timedelta(days=9)), "end_date": str(TODAY - timedelta(days=3))},
+    {"start_date": str(TODAY - timedelta(days=5)), "type_filter": "fixe", "provider_filter": "MTN"},
+]
+
+
+def _rows(n: int, seed: int = 7):
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    rows = []
+    for _ in range(n):
+        ratings = [{f"crit-{i}": {"label": label, "sublabel": "", "rating": str(rnd.randint(1, 4))}}
+                   for i, label in enumerate(LABELS) if rnd.random() < 0.6]
+        rows.append({
+            "type": rnd.choice(["mobile", "fixe"]),
+            "provider": rnd.choice(["MTN", "Orange", "Moov", ""]),
+            "sector": None,
+            "ratings": ratings + [{"_meta": {"comments": "", "attachment": ""}}],
+            "comments": None,
+            "nperf_test_id": None,
+            # inside and outside the time windows, never in the current hour
+            "created_at": now - timedelta(hours=1, minutes=rnd.randint(0, 3 * DAYS * 24 * 60)),
+        })
+    return rows
+
+
+async def _insert(rows, batch: int = 25) -> None:
+    for i in range(0, len(rows), batch):
+        async with AsyncSessionLocal() as db:
+            await ingest.insert_feedbacks(db, rows[i:i + batch])
+            await db.commit()
+    await async_engine.dispose()  # the connections belong to this event loop
+
+
+@pytest.fixture(scope="module")
+def facts():
+    """The same feedbacks (and rollups) for both engines."""
+    from sqlalchemy import delete
+
+    from backend import main  # noqa: F401  (migrates the schema)
+
+    with SessionLocal() as db:
+        for model in (models.FeedbackRating, models.FeedbackRollup, models.Feedback):
+            db.execute(delete(model))
+        db.commit()
+    asyncio.run(_insert(_rows(300)))
+    yield
+    with SessionLocal() as db:
+        for model in (models.FeedbackRating, models.FeedbackRollup, models.Feedback):
+            db.execute(delete(model))
+        db.commit()
+
+
+def _call(engine, db, panel: str, filters: dict, days: int):
+    if panel in ("time_series", "criteria_over_time", "dashboard"):
+        return getattr(engine, panel)(db, days=days, **filters)
+    return getattr(engine, panel)(db, **filters)
+
+
+@pytest.mark.parametrize("panel", PANELS)
+@pytest.mark.parametrize("filters", FILTERS, ids=lambda f: ",".join(f"{k}={v}" for k, v in f.items()) or "all")
+def test_numpy_engine_matches_sql(facts, panel, filters):
+    store = columnar.load()
+    with SessionLocal() as db:
+        for days in (7, 30):
+            assert _call(store, None, panel, filters, days) == _call(analytics, db, panel, filters, days)
+
+
+def test_appended_feedbacks_match_loaded_ones(facts):
+    """The write path (``columnar.append``) builds the same columns as a load from the tables."""
+    loaded, appended = columnar.load(), columnar.ColumnarStore()
+    with SessionLocal() as db:
+        appended.append(db.scalars(select(models.Feedback).order_by(models.Feedback.id)).all())
+    assert appended.feedbacks.size == loaded.feedbacks.size == 300
+    assert appended.ratings.size == loaded.ratings.size
+    for panel in PANELS:
+        assert _call(appended, None, panel, {}, DAYS) == _call(loaded, None, panel, {}, DAYS)
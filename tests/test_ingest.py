@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from backend import ingest, main, models
+from backend.db import SessionLocal
+
+FEEDBACK = {"type": "mobile", "provider": "MTN", "ratings": [{"crit-1": {"label": "Débit", "rating": "3"}}]}
+
+
+@pytest.fixture
+def buffered(monkeypatch, clean_db):
+    """INGEST_MODE=buffered with fresh buffers; returns a factory for the feedback buffer."""
+    monkeypatch.setattr(ingest, "buffered", True)
+    monkeypatch.setattr(ingest, "nperf_buffer", ingest.IngestBuffer("nperf", ingest.insert_nperf_results))
+
+    def make(insert_rows=ingest.insert_feedbacks, **kwargs) -> ingest.IngestBuffer:
+        kwargs.setdefault("flush_ms", 20)
+        buffer = ingest.IngestBuffer("feedback", insert_rows, on_flush=ingest.feedbacks_committed, **kwargs)
+        monkeypatch.setattr(ingest, "feedback_buffer", buffer)
+        return buffer
+    return make
+
+
+def _stored() -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(models.Feedback))
+
+
+def _wait(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_post_is_acknowledged_then_flushed(buffered):
+    buffer = buffered()
+    with TestClient(main.app) as client:
+        for _ in range(5):
+            r = client.post("/api/feedback", json=FEEDBACK)
+            assert r.status_code == 202
+            assert r.json() == {"status": "queued"}
+        _wait(lambda: buffer.flushed_rows == 5)
+        stats = client.get("/api/ingest/stats").json()["feedback"]
+    assert stats["accepted"] == 5
+    assert stats["flushed_rows"] == 5
+    assert stats["failed_rows"] == stats["rejected_rows"] == 0
+    assert stats["batches"] >= 1
+    assert _stored() == 5
+
+
+def test_validation_happens_before_the_202(buffered):
+    buffered()
+    with TestClient(main.app) as client:
+        assert client.post("/api/feedback", json=dict(FEEDBACK, type="x" * 21)).status_code == 422
+        # NOT NULL column: null is stored as ""
+        assert client.post("/api/feedback", json=dict(FEEDBACK, provider=None)).status_code == 202
+    with SessionLocal() as db:
+        assert db.scalars(select(models.Feedback.provider)).all() == [""]
+
+
+def test_poison_row_is_isolated_from_its_batch(buffered):
+    buffer = buffered(flush_ms=500)
+    good = ingest.feedback_values(ingest.schemas.FeedbackIn(**FEEDBACK))
+    poison = dict(good, type=None)  # refused by the database (NOT NULL)
+    with TestClient(main.app) as client:
+        # queued together so they land in one batch
+        client.portal.call(lambda: [buffer.submit(row) for row in [good] * 3 + [poison] + [good] * 4])
+    # the shutdown drained the queue
+    assert buffer.rejected_rows == 1
+    assert buffer.flushed_rows == 7
+    assert buffer.failed_rows == 0
+    assert buffer.batches > 1
+    assert _stored() == 7
+
+
+def test_transient_errors_are_retried(buffered):
+    calls = []
+
+    async def flaky(db, rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise OperationalError("INSERT", {}, Exception("connection lost"))
+        return await ingest.insert_feedbacks(db, rows)
+
+    buffer = buffered(flaky)
+    with TestClient(main.app) as client:
+        assert client.post("/api/feedback", json=FEEDBACK).status_code == 202
+        _wait(lambda: buffer.flushed_rows == 1)
+    assert len(calls) == 2
+    assert buffer.failed_rows == 0
+    assert _stored() == 1
+
+
+def test_batch_given_up_after_retries(buffered, monkeypatch):
+    async def broken(db, rows):
+        raise OperationalError("INSERT", {}, Exception("connection lost"))
+
+    async def no_wait(seconds):
+        pass
+
+    monkeypatch.setattr(ingest.asyncio, "sleep", no_wait)
+    buffer = buffered(broken)
+    with TestClient(main.app) as client:
+        assert client.post("/api/feedback", json=FEEDBACK).status_code == 202
+        _wait(lambda: buffer.failed_rows == 1)
+    assert buffer.flushed_rows == 0
+    assert _stored() == 0
+
+
+def test_full_queue_answers_503(buffered):
+    release = threading.Event()
+
+    async def slow(db, rows):
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        return await ingest.insert_feedbacks(db, rows)
+
+    buffer = buffered(slow, batch_size=1, max_queue=1)
+    with TestClient(main.app) as client:
+        assert client.post("/api/feedback", json=FEEDBACK).status_code == 202
+        _wait(lambda: buffer.queue.qsize() == 0)  # the runner is blocked in the flush
+        assert client.post("/api/feedback", json=FEEDBACK).status_code == 202
+        r = client.post("/api/feedback", json=FEEDBACK)
+        assert r.status_code == 503
+        assert r.headers["Retry-After"] == "1"
+        release.set()
+    assert buffer.accepted == 2
+    assert _stored() == 2
@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+
+from backend import migrate, models, pagination
+from backend.db import IS_SQLITE, Base
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[models.NPerfResult.__table__])
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def _all_pages(db, limit):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = pagination.keyset_page(db, models.NPerfResult, [], limit, cursor)
+        pages.append([r.id for r in rows])
+        if cursor is None:
+            return pages
+
+
+def test_rows_in_the_same_second_are_all_returned(db):
+    # written by Python: stored as "2024-01-01 10:00:00.000000"
+    db.add_all([models.NPerfResult(id=i, created_at=datetime(2024, 1, 1, 10, 0, 0)) for i in range(1, 6)])
+    db.commit()
+    assert _all_pages(db, 2) == [[5, 4], [3, 2], [1]]
+
+
+def test_mixed_text_shapes_keep_one_order(db):
+    db.add_all([models.NPerfResult(id=i, created_at=datetime(2024, 1, 1, 10, 0, 0)) for i in (1, 3)])
+    db.add(models.NPerfResult(id=5, created_at=datetime(2024, 1, 1, 10, 0, 0, 500000)))
+    db.commit()
+    # server-default shape, without fractional seconds
+    for row_id in (2, 4):
+        db.execute(text("INSERT INTO nperf_results (id, created_at) VALUES (:id, '2024-01-01 10:00:00')"),
+                   {"id": row_id})
+    db.commit()
+    assert _all_pages(db, 2) == [[5, 4], [3, 2], [1]]
+    assert _all_pages(db, 1) == [[5], [4], [3], [2], [1]]
+
+
+@pytest.fixture
+def migrated(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/plan.db")
+    migrate.upgrade(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def _plan(db, stmt) -> str:
+    sql = stmt.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True})
+    return "\n".join(row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+
+
+@pytest.mark.skipif(not IS_SQLITE, reason="the models are built for PostgreSQL in this run")
+@pytest.mark.parametrize("model", [models.Feedback, models.NPerfResult])
+def test_sqlite_pages_use_the_sort_index(migrated, model):
+    first = select(model).order_by(*pagination.newest_first(migrated, model)).limit(21)
+    cursor = pagination.encode_cursor(datetime(2024, 1, 1, 10, 0, 0), 42)
+    deep = first.where(pagination._after_cursor(migrated, model, cursor))
+    for stmt in (first, deep):
+        plan = _plan(migrated, stmt)
+        assert f"ix_{model.__tablename__}_sort_ts_id" in plan, plan
+        assert "TEMP B-TREE" not in plan, plan
@@ -0,0 +1,99 @@
+"""PostgreSQL only: run the suite with ``DATABASE_URL=postgresql://...``."""
+import asyncio
+import json
+import os
+from datetime import date, datetime, timezone
+
+import pytest
+from sqlalchemy import func, select
+
+from backend import analytics, columnar, ingest, models, partitions
+from backend.db import AsyncSessionLocal, SessionLocal, async_engine, engine
+
+pytestmark = pytest.mark.skipif(engine.dialect.name != "postgresql", reason="partitioning needs PostgreSQL")
+
+JANUARY = date(2024, 1, 1)
+
+
+def _feedback(ts: datetime, rating: str) -> dict:
+    return {"type": "mobile", "provider": "MTN", "sector": None, "comments": None, "nperf_test_id": None,
+            "ratings": [{"crit-1": {"label": "Débit", "sublabel": "", "rating": rating}}], "created_at": ts}
+
+
+async def _insert(rows) -> None:
+    async with AsyncSessionLocal() as db:
+        await ingest.insert_feedbacks(db, rows)
+        await db.commit()
+    await async_engine.dispose()  # the connections belong to this event loop
+
+
+def _counts() -> dict:
+    with SessionLocal() as db:
+        return {model.__tablename__: db.scalar(select(func.count()).select_from(model))
+                for model in (models.Feedback, models.FeedbackRating, models.FeedbackRollup)}
+
+
+def _summary() -> dict:
+    with SessionLocal() as db:
+        return analytics.summary(db)
+
+
+def _version() -> int:
+    with SessionLocal() as db:
+        return columnar.data_version(db)
+
+
+@pytest.fixture
+def two_months(clean_db):
+    rows = [_feedback(datetime(2024, 1, d, 10, tzinfo=timezone.utc), str(d % 4 + 1)) for d in range(1, 11)]
+    rows += [_feedback(datetime(2024, 2, d, 23, 30, tzinfo=timezone.utc), "4") for d in range(1, 6)]
+    asyncio.run(_insert(rows))
+
+
+def test_enable_converts_and_keeps_rows(two_months):
+    before = _counts()
+    partitions.enable()  # no-op when an earlier test converted the tables already
+    with engine.connect() as conn:
+        for table in partitions.PARTITIONED:
+            assert partitions.is_partitioned(conn, table)
+            months = partitions.partitions(conn, table)
+            assert months[0] <= JANUARY and partitions.current_month() in months
+    assert partitions.enable() == []
+    assert _counts() == before
+    assert partitions.maintain() == []
+
+
+@pytest.mark.skipif(columnar.np is None, reason="needs numpy")
+def test_archive_and_restore_round_trip(two_months, tmp_path):
+    partitions.enable()
+    before, summary, version = _counts(), _summary(), _version()
+    store = columnar.load()
+    assert store.summary() == summary
+
+    counts = partitions.archive(JANUARY, str(tmp_path))
+    assert counts["feedbacks"] == 10 and counts["feedback_ratings"] == 10
+    with open(tmp_path / "2024-01" / "manifest.json") as f:
+        assert json.load(f)["rows"] == counts
+    with engine.connect() as conn:
+        assert JANUARY not in partitions.partitions(conn, "feedbacks")
+    assert _summary()["total_feedback"] == 5
+    # a worker's columns are stale: its next refresh reloads them
+    assert _version() == version + 1 and columnar._stale(store)
+    assert columnar.load().summary() == _summary()
+    with pytest.raises(FileExistsError):
+        partitions.archive(JANUARY, str(tmp_path))
+
+    assert partitions.restore(JANUARY, str(tmp_path)) == counts
+    assert not os.path.exists(tmp_path / "2024-01")
+    assert os.listdir(tmp_path / "restored")
+    with engine.connect() as conn:
+        assert JANUARY in partitions.partitions(conn, "feedbacks")
+    assert _counts() == before
+    assert _summary() == summary
+    assert _version() == version + 2
+    assert columnar.load().summary() == summary
+
+
+def test_current_month_cannot_be_archived(tmp_path):
+    with pytest.raises(ValueError):
+        partitions.archive(partitions.current_month(), str(tmp_path))
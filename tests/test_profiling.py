@@ -0,0 +1,24 @@
+import pytest
+
+from backend import profiling
+
+
+@pytest.fixture(autouse=True)
+def token(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "s3cret")
+
+
+def _scope(headers=(), query=b""):
+    return {"type": "http", "headers": list(headers), "query_string": query}
+
+
+def test_header_token_is_required():
+    assert profiling._requested(_scope([(b"x-profile", b"s3cret")]))
+    assert not profiling._requested(_scope([(b"x-profile", b"wrong")]))
+    assert not profiling._requested(_scope())
+
+
+def test_query_string_token_is_ignored():
+    # it would be written to the access logs
+    assert not profiling._requested(_scope(query=b"profile=s3cret"))
+    assert not profiling._requested(_scope([(b"x-profile", b"nope")], query=b"profile=s3cret"))
@@ -0,0 +1,107 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from backend import static
+
+SCRIPT = b"console.log('dashboard');\n" * 50
+
+
+@pytest.fixture
+def site(tmp_path):
+    (tmp_path / "js").mkdir()
+    (tmp_path / "js" / "app.js").write_bytes(SCRIPT)
+    (tmp_path / "style.css").write_text("body { background: url('img.png'); }\n")
+    (tmp_path / "img.png").write_bytes(b"\x89PNG not really")
+    (tmp_path / "index.html").write_text(
+        '<link href="style.css"><script src="js/app.js"></script><a href="https://example.com/x.js">x</a>\n')
+    return static.StaticSite(str(tmp_path))
+
+
+@pytest.fixture
+def client(site):
+    def serve(request: Request):
+        return site.response(request, request.path_params["path"])
+    return TestClient(Starlette(routes=[Route("/{path:path}", serve, methods=["GET", "HEAD"])]))
+
+
+def test_etag_and_304(client):
+    r = client.get("/js/app.js", headers={"Accept-Encoding": "identity"})
+    assert r.status_code == 200
+    assert r.content == SCRIPT
+    assert r.headers["Cache-Control"] == "no-cache"
+    etag = r.headers["ETag"]
+    r = client.get("/js/app.js", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["ETag"] == etag
+    # weak comparison and lists
+    r = client.get("/js/app.js", headers={"Accept-Encoding": "identity", "If-None-Match": f'"other", W/{etag}'})
+    assert r.status_code == 304
+    r = client.get("/js/app.js", headers={"Accept-Encoding": "identity", "If-None-Match": '"other"'})
+    assert r.status_code == 200
+
+
+def test_brotli_preferred_then_gzip(client):
+    if static.brotli is None:
+        pytest.skip("brotli is not installed")
+    r = client.get("/js/app.js", headers={"Accept-Encoding": "gzip, br"})
+    assert r.headers["Content-Encoding"] == "br"
+    assert r.headers["Vary"] == "Accept-Encoding"
+    assert r.content == SCRIPT  # decoded by the client
+    assert r.headers["ETag"].endswith('-br"')
+
+
+def test_gzip_and_q_values(client):
+    r = client.get("/js/app.js", headers={"Accept-Encoding": "gzip, br;q=0"})
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert r.content == SCRIPT
+    assert r.headers["ETag"].endswith('-gzip"')
+    r = client.get("/js/app.js", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in r.headers
+    assert r.content == SCRIPT
+
+
+def test_etag_differs_per_encoding(client):
+    identity = client.get("/js/app.js", headers={"Accept-Encoding": "identity"}).headers["ETag"]
+    gz = client.get("/js/app.js", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+    assert identity != gz
+    # a cached gzip body is not revalidated as the identity one
+    r = client.get("/js/app.js", headers={"Accept-Encoding": "identity", "If-None-Match": gz})
+    assert r.status_code == 200
+
+
+def test_incompressible_files_have_no_variants(client):
+    r = client.get("/img.png", headers={"Accept-Encoding": "gzip, br"})
+    assert "Content-Encoding" not in r.headers
+    assert "Vary" not in r.headers
+
+
+def test_fingerprinted_aliases(site, client):
+    script = site.assets["js/app.js"][0]
+    r = client.get("/" + script.fingerprinted, headers={"Accept-Encoding": "identity"})
+    assert r.status_code == 200
+    assert r.headers["Cache-Control"] == static.IMMUTABLE
+    html = client.get("/", headers={"Accept-Encoding": "identity"}).text
+    assert f'src="/{script.fingerprinted}"' in html
+    assert f'href="/{site.assets["style.css"][0].fingerprinted}"' in html
+    assert 'href="https://example.com/x.js"' in html  # not local
+    css = site.assets["style.css"][0].bodies["identity"].decode()
+    assert site.assets["img.png"][0].fingerprinted in css
+    assert [k for k in site.assets if k.endswith(".html")] == ["index.html"]  # pages get no alias
+
+
+def test_head_and_404(client):
+    r = client.head("/js/app.js", headers={"Accept-Encoding": "identity"})
+    assert r.status_code == 200
+    assert r.content == b""
+    assert r.headers["Content-Length"] == str(len(SCRIPT))
+    assert client.get("/missing.js").status_code == 404
+
+
+def test_accepted_encodings():
+    assert static.accepted_encodings("gzip, deflate, br;q=0.5") == ["gzip", "deflate", "br"]
+    assert static.accepted_encodings("br;q=0, gzip;q=bad") == []
+    assert static.accepted_encodings("") == []
@@ -0,0 +1,100 @@
+import hashlib
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import attachments, main, uploads
+
+CONTENT = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 64
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    """Uploads stored under ``tmp_path``, without the attachment processing queue."""
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(attachments, "enabled", False)
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _leftovers(path) -> list:
+    return [name for name in os.listdir(path) if name.startswith(".upload-")]
+
+
+def test_upload_is_stored_under_its_sha256(client, tmp_path):
+    r = client.post("/api/upload", files={"file": ("Photo.PNG", CONTENT, "image/png")})
+    assert r.status_code == 200
+    body = r.json()
+    name = hashlib.sha256(CONTENT).hexdigest() + ".png"
+    assert body["filename"] == name
+    assert body["url"] == f"/uploads/{name}"
+    assert body["size"] == len(CONTENT)
+    assert body["duplicate"] is False
+    assert (tmp_path / name).read_bytes() == CONTENT
+
+
+def test_same_content_is_stored_once(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_BYTES", 1024)  # several threadpool writes
+    first = client.post("/api/upload", files={"file": ("a.png", CONTENT, "image/png")}).json()
+    again = client.post("/api/upload", files={"file": ("b.png", CONTENT, "image/png")}).json()
+    assert again["filename"] == first["filename"]
+    assert again["duplicate"] is True
+    assert sorted(os.listdir(tmp_path)) == [first["filename"]]
+
+
+def test_other_fields_are_ignored(client):
+    r = client.post("/api/upload", data={"note": "x" * 100}, files={"file": ("x.bin", b"abc")})
+    assert r.status_code == 200
+    assert r.json()["filename"] == hashlib.sha256(b"abc").hexdigest() + ".bin"
+
+
+def test_announced_length_over_the_limit_is_refused(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads.save_upload, "__defaults__", (1024,))
+    big = b"x" * (1024 + uploads.MULTIPART_OVERHEAD + 1)
+    r = client.post("/api/upload", files={"file": ("big.bin", big)})
+    assert r.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+
+def test_streamed_body_is_cut_off_at_the_limit(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads.save_upload, "__defaults__", (1024,))
+
+    def chunks():  # no Content-Length: only the parsed size can trip the limit
+        yield b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.bin\"\r\n\r\n"
+        for _ in range(8):
+            yield b"x" * 512
+        yield b"\r\n--b--\r\n"
+
+    r = client.post("/api/upload", content=chunks(), headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert r.status_code == 413
+    assert _leftovers(tmp_path) == []
+
+
+@pytest.mark.parametrize("body, detail", [
+    (b"--b\r\nContent-Disposition form-data\r\n\r\nabc\r\n--b--\r\n", "Malformed multipart body"),
+    (b"garbage\r\n--b\r\n", "Malformed multipart body"),
+    (b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"x.bin\"\r\n\r\nabc", "Truncated multipart body"),
+])
+def test_malformed_body_is_a_400(client, tmp_path, body, detail):
+    r = client.post("/api/upload", content=body, headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert r.status_code == 400
+    assert r.json()["detail"].startswith(detail)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("headers, body", [
+    ({"Content-Type": "application/json"}, b"{}"),
+    ({"Content-Type": "multipart/form-data"}, b""),
+])
+def test_non_multipart_body_is_a_400(client, headers, body):
+    r = client.post("/api/upload", content=body, headers=headers)
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Expected a multipart/form-data body"
+
+
+def test_missing_file_field_is_a_400(client, tmp_path):
+    r = client.post("/api/upload", data={"other": "value"}, files={"photo": ("x.bin", b"abc")})
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Missing 'file' file field"
+    assert _leftovers(tmp_path) == []